@@ -19,14 +19,21 @@
 # THE SOFTWARE.
 
 import abc
+import collections
+import concurrent.futures
+import copy
 import functools
+import json
+import math
+import threading
 import time
-from typing import Any, Literal, Optional, get_args
+from collections.abc import Iterable
+from typing import Any, Callable, Literal, Optional, get_args
 
-import ndjson
+import attrs
 import requests
 
-from . import LOGGER, models
+from . import LOGGER, archive, codec, contentcoding, models, ratelimit, snapshot
 
 OLD_AUTH_ENDPOINT = (
     "https://sofit-sso-oidc.grdf.fr/openam/oauth2/realms/externeGrdf/access_token"
@@ -35,6 +42,10 @@ NEW_AUTH_ENDPOINT = (
     "https://adict-connexion.grdf.fr/oauth2/aus5y2ta2uEHjCWIR417/v1/token"
 )
 
+SeriesDataset = models.SeriesDataset
+SERIES_DATASETS: tuple[SeriesDataset, ...] = get_args(SeriesDataset)
+DATASETS: tuple[models.Dataset, ...] = get_args(models.Dataset)
+
 
 def raise_for_status(resp: requests.Response) -> None:
     try:
@@ -48,7 +59,123 @@ def raise_for_status(resp: requests.Response) -> None:
         raise
 
 
+Transform = Callable[[Any], Any]
+
+
+def decode(
+    api_class: type["BaseAPI"], body: bytes, transform: Optional[Transform] = None
+) -> Any:
+    """Parse response `body` as `api_class` does, then apply `transform`
+
+    `transform` must be a module level function when decoding in a process
+    pool, e.g. :func:`access_models` or :func:`lowatt_grdf.columnar.to_columns`.
+    """
+    data = api_class._parse_body(body)
+    return data if transform is None else transform(data)
+
+
+def access_models(resp: Any) -> list[models.Access]:
+    """Structure accesses of a droits_acces response"""
+    return models.structure_accesses(snapshot.access_items(resp))
+
+
+def request_key(verb: str, url: str, **kwargs: Any) -> str:
+    """Return a key identifying a request by verb, url, params and body"""
+    body = {k: kwargs.get(k) for k in ("params", "data", "json")}
+    return f"{verb} {url} {json.dumps(body, sort_keys=True, default=str)}"
+
+
+def endpoint(url: str) -> str:
+    """Return name of the endpoint of `url`, e.g. ``donnees_techniques``"""
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+@attrs.define
+class CoalesceStats:
+    upstream: int = 0
+    coalesced: int = 0
+
+
+@attrs.define
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    # hedges answering before the original request
+    won: int = 0
+
+
+class DeadlineExceeded(requests.Timeout):
+    pass
+
+
+class LatencyStats:
+    """Latencies, in seconds, of the last `size` requests"""
+
+    def __init__(self, size: int = 1000):
+        self.samples: collections.deque[float] = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, latency: float) -> None:
+        with self._lock:
+            self.samples.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Return `percent` percentile (nearest rank), None without samples"""
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        rank = math.ceil(percent / 100 * len(samples))
+        return samples[min(max(rank, 1), len(samples)) - 1]
+
+    def summary(self) -> dict[str, Optional[float]]:
+        return {f"p{p}": self.percentile(p) for p in (50, 95, 99)}
+
+
+class _Flight(concurrent.futures.Future):  # type: ignore[type-arg]
+    expires = float("inf")
+
+
 class BaseAPI(metaclass=abc.ABCMeta):
+    """Base ADICT API client, safe to share between threads
+
+    The access token is refreshed by a single thread at a time, and renewed
+    in background `token_renew_margin` seconds (at most a tenth of its
+    lifetime) before it expires.
+
+    Responses are decoded, and transformed, by `parse_executor` when given,
+    e.g. a process pool to spread CPU bound work of concurrent requests over
+    several cores. Response bodies are stored in `archive` when given. With
+    `replay`, they are served from `archive` instead, without any network
+    request, so that history may be parsed again.
+
+    Requests time out after `timeout` seconds to connect or between bytes
+    read, and after `deadline` seconds overall. With `hedge_percentile`, a
+    duplicate of a GET request taking longer than this percentile of recent
+    latencies is sent, for at most `hedge_budget` of requests and if the rate
+    limiter allows it at once, and the first response is kept. Both clocks
+    start once the request may be sent according to the rate limiter. Such
+    requests are sent by a pool of threads sized for `concurrency` threads
+    sending requests through the client.
+
+    Responses are requested compressed (see :mod:`lowatt_grdf.contentcoding`),
+    and bytes received and decoded are counted by endpoint.
+    """
+
+    token_renew_margin = 60.0
+    coalesce_verbs = frozenset({"GET"})
+    coalesce_window = 0.0
+    timeout: tuple[float, float] = (10.0, 60.0)
+    deadline: Optional[float] = None
+    hedge_percentile: Optional[float] = None
+    hedge_budget = 0.05
+    # latencies measured before hedging
+    hedge_min_samples = 20
+    concurrency = 8
+
     @property
     @abc.abstractmethod
     def scope(self) -> str:
@@ -64,28 +191,242 @@ class BaseAPI(metaclass=abc.ABCMeta):
     def _auth_endpoint(self) -> str:
         raise NotImplementedError()
 
-    def __init__(self, client_id: str, client_secret: str):
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        rate_limiter: Optional[ratelimit.RateLimiter] = None,
+        archive: Optional[archive.Archive] = None,
+        replay: bool = False,
+        parse_executor: Optional[concurrent.futures.Executor] = None,
+    ):
+        if replay and archive is None:
+            raise ValueError("Replay mode requires an archive")
         self.client_id = client_id
         self.client_secret = client_secret
+        self.rate_limiter = (
+            ratelimit.IntervalLimiter() if rate_limiter is None else rate_limiter
+        )
         self._access_token: Optional[str] = None
-        self._last_request: Optional[float] = None
         self._access_expires: Optional[float] = None
-
-    def _parse_response(self, resp: requests.Response) -> Any:
-        return ndjson.loads(resp.text)
-
-    def request(self, verb: str, *args: Any, **kwargs: Any) -> Any:
+        self._access_renew: Optional[float] = None
+        self._token_lock = threading.Lock()
+        self._renewing = False
+        self.coalesce_stats = CoalesceStats()
+        self.hedge_stats = HedgeStats()
+        self._stats_lock = threading.Lock()
+        self.latency_stats = LatencyStats()
+        # bytes of decoded response bodies by endpoint, archived ones included
+        self.response_bytes: collections.Counter[str] = collections.Counter()
+        # bytes received by endpoint, hedges included
+        self.wire_bytes: collections.Counter[str] = collections.Counter()
+        # responses by content coding
+        self.content_codings: collections.Counter[str] = collections.Counter()
+        self._http_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._inflight: dict[str, _Flight] = {}
+        self._inflight_lock = threading.Lock()
+        self.archive = archive
+        self.replay = replay
+        self.parse_executor = parse_executor
+
+    @staticmethod
+    def _parse_body(body: bytes) -> Any:
+        return codec.loads_ndjson(body)
+
+    def _decode(self, body: bytes, transform: Optional[Transform]) -> Any:
+        if self.parse_executor is None:
+            return decode(type(self), body, transform)
+        return self.parse_executor.submit(decode, type(self), body, transform).result()
+
+    def request(
+        self,
+        verb: str,
+        *args: Any,
+        transform: Optional[Transform] = None,
+        **kwargs: Any,
+    ) -> Any:
+        """Send request and return its parsed response, passed to `transform`
+
+        Identical concurrent requests with a verb in `coalesce_verbs` share a
+        single upstream call, whose result is also served to identical
+        requests during the following `coalesce_window` seconds.
+        """
+        if verb not in self.coalesce_verbs or "files" in kwargs:
+            return self._send(verb, *args, transform=transform, **kwargs)
+        key = request_key(verb, *args, **kwargs)
+        if transform is not None:
+            key = f"{key} {transform.__module__}.{transform.__qualname__}"
+        with self._inflight_lock:
+            flight = self._inflight.get(key)
+            if flight is not None and flight.done() and flight.expires <= time.time():
+                flight = None
+            leader = flight is None
+            if flight is None:
+                flight = self._inflight[key] = _Flight()
+                self.coalesce_stats.upstream += 1
+            else:
+                self.coalesce_stats.coalesced += 1
+        if not leader:
+            # callers may alter results, don't share them
+            return copy.deepcopy(flight.result())
+        try:
+            result = self._send(verb, *args, transform=transform, **kwargs)
+        except BaseException as exc:
+            flight.set_exception(exc)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                if flight.exception() is None:
+                    flight.expires = time.time() + self.coalesce_window
+                else:
+                    flight.expires = 0
+                self._purge_flights()
+
+    def _purge_flights(self) -> None:
+        now = time.time()
+        for key, flight in list(self._inflight.items()):
+            if flight.done() and flight.expires <= now:
+                del self._inflight[key]
+
+    def _send(
+        self,
+        verb: str,
+        *args: Any,
+        transform: Optional[Transform] = None,
+        **kwargs: Any,
+    ) -> Any:
+        key = None
+        if self.archive is not None and "files" not in kwargs:
+            key = request_key(verb, *args, **kwargs)
+        if self.replay:
+            assert self.archive is not None
+            if key is None:
+                raise archive.NotArchived("Uploads are not archived")
+            body = self.archive.get(key)
+            self._count_bytes(args[0], body)
+            return self._decode(body, transform)
         headers = kwargs.setdefault("headers", {})
         headers.setdefault("Accept", "application/json")
+        headers.setdefault("Accept-Encoding", contentcoding.accept_encoding())
         if "files" not in kwargs:
             headers.setdefault("Content-Type", "application/json")
-        headers["Authorization"] = f"Bearer {self.access_token}"
-        if self._last_request is not None:
-            time.sleep(min(max(time.time() - self._last_request, 1), 1))
-        resp = requests.request(verb, *args, **kwargs)
-        self._last_request = time.time()
+        kwargs.setdefault("timeout", self.timeout)
+        resp = self._http(verb, *args, **kwargs)
         raise_for_status(resp)
-        return self._parse_response(resp)
+        if self.archive is not None and key is not None:
+            self.archive.put(key, resp.content)
+        self._count_bytes(args[0], resp.content)
+        return self._decode(resp.content, transform)
+
+    def _count_bytes(self, url: str, body: bytes) -> None:
+        with self._stats_lock:
+            self.response_bytes[endpoint(url)] += len(body)
+
+    def _attempt(
+        self,
+        verb: str,
+        *args: Any,
+        abandoned: Optional[threading.Event] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """Send request, once the rate limiter allowed it
+
+        The body isn't read if `abandoned` is set once headers are received.
+        """
+        # read once allowed to send, not to send a token expired meanwhile
+        headers = {
+            **kwargs.pop("headers", {}),
+            "Authorization": f"Bearer {self.access_token}",
+        }
+        start = time.monotonic()
+        resp = requests.request(verb, *args, headers=headers, stream=True, **kwargs)
+        if abandoned is not None and abandoned.is_set():
+            resp.close()
+            return resp
+        received = contentcoding.read(resp)
+        self.latency_stats.add(time.monotonic() - start)
+        with self._stats_lock:
+            self.wire_bytes[endpoint(args[0])] += received
+            coding = resp.headers.get("Content-Encoding") or "identity"
+            self.content_codings[coding] += 1
+        return resp
+
+    def _hedge_delay(self, verb: str) -> Optional[float]:
+        if (
+            verb != "GET"
+            or self.hedge_percentile is None
+            or len(self.latency_stats) < self.hedge_min_samples
+        ):
+            return None
+        return self.latency_stats.percentile(self.hedge_percentile)
+
+    def _http(self, verb: str, *args: Any, **kwargs: Any) -> requests.Response:
+        """Send request within `deadline`, hedged if it lasts too long"""
+        with self._stats_lock:
+            self.hedge_stats.requests += 1
+        hedge_delay = self._hedge_delay(verb)
+        self.rate_limiter.acquire()
+        if self.deadline is None and hedge_delay is None:
+            return self._attempt(verb, *args, **kwargs)
+        with self._stats_lock:
+            if self._http_executor is None:
+                # an attempt and its hedge per thread sending requests
+                self._http_executor = concurrent.futures.ThreadPoolExecutor(
+                    2 * self.concurrency, thread_name_prefix="lowatt-grdf-http"
+                )
+        executor = self._http_executor
+        # clocks start once the request may be sent
+        start = time.monotonic()
+        deadline = None if self.deadline is None else start + self.deadline
+        hedge_at = None if hedge_delay is None else start + hedge_delay
+        abandoned = threading.Event()
+        attempt = functools.partial(
+            self._attempt, verb, *args, abandoned=abandoned, **kwargs
+        )
+        original = executor.submit(attempt)
+        pending = {original}
+        try:
+            while True:
+                now = time.monotonic()
+                timeout = min(
+                    (t - now for t in (deadline, hedge_at) if t is not None),
+                    default=None,
+                )
+                done, pending = concurrent.futures.wait(
+                    pending, timeout, concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    if future.exception() is None or not pending:
+                        if future is not original:
+                            with self._stats_lock:
+                                self.hedge_stats.won += 1
+                        return future.result()
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise DeadlineExceeded(
+                        f"No response to {verb} {args[0]} within {self.deadline}s"
+                    )
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    # skipped rather than delayed if the rate limiter is busy
+                    with self._stats_lock:
+                        stats = self.hedge_stats
+                        hedge = stats.hedged < self.hedge_budget * stats.requests
+                        hedge = hedge and self.rate_limiter.acquire(block=False)
+                        stats.hedged += hedge
+                    if hedge:
+                        LOGGER.debug(
+                            "Hedging %s %s after %.3fs", verb, args[0], now - start
+                        )
+                        pending.add(executor.submit(attempt))
+        finally:
+            # attempts left are not sent, or their response not read
+            abandoned.set()
+            for future in pending:
+                future.cancel()
 
     get = functools.partialmethod(request, "GET")
     post = functools.partialmethod(request, "POST")
@@ -94,11 +435,41 @@ class BaseAPI(metaclass=abc.ABCMeta):
 
     @property
     def access_token(self) -> str:
-        if self._access_token is None or (
-            self._access_expires is not None and self._access_expires < time.time()
-        ):
-            self._access_token, self._access_expires = self._authenticate()
-        return self._access_token
+        with self._token_lock:
+            now = time.time()
+            if self._access_token is None or (
+                self._access_expires is not None and self._access_expires < now
+            ):
+                # other threads wait for this refresh instead of starting theirs
+                self._set_token(*self._authenticate())
+            elif (
+                self._access_renew is not None
+                and self._access_renew < now
+                and not self._renewing
+            ):
+                self._renewing = True
+                threading.Thread(target=self._renew_token, daemon=True).start()
+            assert self._access_token is not None
+            return self._access_token
+
+    def _set_token(self, token: str, expires: float) -> None:
+        self._access_token, self._access_expires = token, expires
+        margin = min(self.token_renew_margin, (expires - time.time()) / 10)
+        self._access_renew = expires - margin
+
+    def _renew_token(self) -> None:
+        try:
+            token, expires = self._authenticate()
+        except Exception:
+            LOGGER.exception("Could not renew access token")
+            token = None
+        with self._token_lock:
+            if token is not None:
+                self._set_token(token, expires)
+            else:
+                # retry on next request, at most once per second
+                self._access_renew = time.time() + 1
+            self._renewing = False
 
     def _authenticate(self) -> tuple[str, float]:
         resp = requests.post(
@@ -109,6 +480,7 @@ class BaseAPI(metaclass=abc.ABCMeta):
                 "client_secret": self.client_secret,
                 "scope": self.scope,
             },
+            timeout=self.timeout,
         )
         raise_for_status(resp)
         data = resp.json()
@@ -119,10 +491,19 @@ class BaseAPI(metaclass=abc.ABCMeta):
         access_expires = time.time() + expires_in
         return (token, access_expires)
 
-    def droits_acces(self, pce: Optional[list[str]] = None) -> Any:
+    def droits_acces(
+        self, pce: Optional[list[str]] = None, transform: Optional[Transform] = None
+    ) -> Any:
         if not pce:
-            return self.get(f"{self.api}/droits_acces")
-        return self.post(f"{self.api}/droits_acces", json={"id_pce": pce})
+            return self.get(f"{self.api}/droits_acces", transform=transform)
+        return self.post(
+            f"{self.api}/droits_acces", json={"id_pce": pce}, transform=transform
+        )
+
+    def accesses(self, pce: Optional[list[str]] = None) -> list[models.Access]:
+        """Return accesses from droits_acces, structured by the parse executor"""
+        result: list[models.Access] = self.droits_acces(pce, transform=access_models)
+        return result
 
     DEFAULT_THIRD_ROLE = get_args(models.ThirdRole)
     AccessRightState = Literal[
@@ -160,14 +541,8 @@ class BaseAPI(metaclass=abc.ABCMeta):
         )
 
     def check_consent_validation(self, pce: Optional[list[str]] = None) -> None:
-        resp = self.droits_acces(pce)
-        # XXX: this looks like a bug, "liste_acces" should be part of the response
-        items = resp[0]["liste_acces"] if resp and "liste_acces" in resp[0] else resp
         droits: dict[str, list[models.Access]] = {}
-        for item in items:
-            if "code_statut_traitement" in item:
-                continue
-            access = models.converter.structure(item, models.Access)
+        for access in self.accesses(pce):
             droits.setdefault(access.pce, []).append(access)
         errors = []
         for _, accesses in sorted(
@@ -205,13 +580,20 @@ class BaseAPI(metaclass=abc.ABCMeta):
             files=(("preuves", (fname, data)) for fname, data in preuves),
         )
 
-    def donnees_consos_publiees(self, pce: str, from_date: str, to_date: str) -> Any:
+    def donnees_consos_publiees(
+        self,
+        pce: str,
+        from_date: str,
+        to_date: str,
+        transform: Optional[Transform] = None,
+    ) -> Any:
         return self.get(
             f"{self.api}/pce/{pce}/donnees_consos_publiees",
             params={
                 "date_debut": from_date,
                 "date_fin": to_date,
             },
+            transform=transform,
         )
 
     def donnees_consos_informatives(
@@ -219,6 +601,7 @@ class BaseAPI(metaclass=abc.ABCMeta):
         pce: str,
         from_date: str,
         to_date: str,
+        transform: Optional[Transform] = None,
     ) -> Any:
         return self.get(
             f"{self.api}/pce/{pce}/donnees_consos_informatives",
@@ -226,10 +609,15 @@ class BaseAPI(metaclass=abc.ABCMeta):
                 "date_debut": from_date,
                 "date_fin": to_date,
             },
+            transform=transform,
         )
 
     def donnees_injections_publiees(
-        self, pce: str, from_date: str, to_date: str
+        self,
+        pce: str,
+        from_date: str,
+        to_date: str,
+        transform: Optional[Transform] = None,
     ) -> Any:
         return self.get(
             f"{self.api}/pce/{pce}/donnees_injections_publiees",
@@ -237,8 +625,69 @@ class BaseAPI(metaclass=abc.ABCMeta):
                 "date_debut": from_date,
                 "date_fin": to_date,
             },
+            transform=transform,
         )
 
+    def donnees_series(
+        self,
+        dataset: SeriesDataset,
+        pce: str,
+        from_date: str,
+        to_date: str,
+        transform: Optional[Transform] = None,
+    ) -> Any:
+        """Dispatch to donnees_consos_publiees, donnees_consos_informatives or
+        donnees_injections_publiees according to `dataset`
+        """
+        method = getattr(self, f"donnees_{dataset}")
+        return method(pce, from_date, to_date, transform=transform)
+
+    def pce_snapshot(
+        self,
+        pce: str,
+        from_date: str,
+        to_date: str,
+        datasets: Iterable[models.Dataset] = DATASETS,
+        accesses: Optional[list[models.Access]] = None,
+    ) -> models.PCESnapshot:
+        """Fetch `datasets` of `pce` concurrently, within the rate limit
+
+        Datasets not covered by an active access to `pce`, from `accesses` or
+        else from droits_acces, are skipped. Series are fetched between
+        `from_date` and `to_date`.
+        """
+        if accesses is None:
+            accesses = self.accesses([pce])
+        accesses = [access for access in accesses if access.pce == pce]
+        skipped: dict[str, str] = {}
+        calls: dict[str, Callable[[], Any]] = {}
+        for dataset in datasets:
+            reason = models.access_skip_reason(accesses, dataset)
+            if reason is not None:
+                skipped[dataset] = reason
+            elif dataset in SERIES_DATASETS:
+                calls[dataset] = functools.partial(
+                    self.donnees_series, dataset, pce, from_date, to_date
+                )
+            else:
+                calls[dataset] = functools.partial(
+                    getattr(self, f"donnees_{dataset}"), pce
+                )
+        results: dict[str, Any] = {}
+        errors: dict[str, str] = {}
+        if calls:
+            with concurrent.futures.ThreadPoolExecutor(len(calls)) as executor:
+                futures = {name: executor.submit(call) for name, call in calls.items()}
+            for name, future in futures.items():
+                exc = future.exception()
+                if exc is None:
+                    results[name] = future.result()
+                elif isinstance(exc, requests.HTTPError):
+                    errors[name] = str(exc)
+                else:
+                    raise exc
+        return models.PCESnapshot(pce, **results, skipped=skipped, errors=errors)
+
     def donnees_contractuelles(self, pce: str) -> Any:
         (payload,) = self.get(f"{self.api}/pce/{pce}/donnees_contractuelles")
         return payload
@@ -258,14 +707,19 @@ class StagingAPI(BaseAPI):
             return OLD_AUTH_ENDPOINT
         return NEW_AUTH_ENDPOINT
 
-    def _parse_response(self, resp: requests.Response) -> Any:
+    @staticmethod
+    def _parse_body(body: bytes) -> Any:
         # XXX: Adjusts GRDF API responses to fit ndjson expected input because
         # GRDF Staging API v6 responses contain multiple-lines JSON objects
         # whereas ndjson expects one-line JSON objects
-        return ndjson.loads(resp.text.replace("\n", "").replace("}{", "}\n{"))
+        return codec.loads_ndjson(body.replace(b"\n", b"").replace(b"}{", b"}\n{"))
 
     def donnees_injections_publiees(
-        self, pce: str, from_date: str, to_date: str
+        self,
+        pce: str,
+        from_date: str,
+        to_date: str,
+        transform: Optional[Transform] = None,
     ) -> Any:
         # XXX: Temporary fix for Staging API v6 that as an incorrect endpoint
         return self.get(
@@ -274,6 +728,7 @@ class StagingAPI(BaseAPI):
                 "date_debut": from_date,
                 "date_fin": to_date,
             },
+            transform=transform,
         )
 
 
@@ -286,3 +741,18 @@ class API(BaseAPI):
         if self.client_id.endswith("_grdf"):
             return OLD_AUTH_ENDPOINT
         return NEW_AUTH_ENDPOINT
+
+
+class StandInAPI(API):
+    """Client of a server standing in for the API at `url`, e.g. to load test
+
+    Access tokens are requested at ``{url}/token``.
+    """
+
+    def __init__(self, url: str, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.api = url.rstrip("/")
+
+    @property
+    def _auth_endpoint(self) -> str:
+        return f"{self.api}/token"
@@ -0,0 +1,180 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Append-only archive of raw API responses.
+
+Each response body is compressed on its own, as a gzip member or a zstd frame,
+and appended to the current segment file, which is rotated once it reaches
+`segment_size` bytes. An index file maps request keys (see
+:func:`lowatt_grdf.api.request_key`) to the location of their latest response,
+so that archived responses may be parsed again without any request.
+"""
+
+import gzip
+import os
+import threading
+import time
+from collections.abc import Iterator
+from typing import Literal, Optional, get_args
+
+import attrs
+
+from . import LOGGER, codec
+
+Compression = Literal["gzip", "zstd"]
+COMPRESSIONS: tuple[Compression, ...] = get_args(Compression)
+SUFFIXES: dict[Compression, str] = {"gzip": ".gz", "zstd": ".zst"}
+INDEX = "index.ndjson"
+
+
+class NotArchived(LookupError):
+    """No response is archived for a request"""
+
+
+@attrs.frozen
+class Entry:
+    key: str
+    timestamp: float
+    segment: str
+    offset: int
+    length: int
+
+
+def compress(data: bytes, compression: Compression) -> bytes:
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def decompress(data: bytes, compression: Compression) -> bytes:
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def segment_compression(segment: str) -> Compression:
+    for compression, suffix in SUFFIXES.items():
+        if segment.endswith(suffix):
+            return compression
+    raise ValueError(f"Not an archive segment: {segment}")
+
+
+class Archive:
+    """Archive of responses stored in `directory`, created if missing
+
+    Segments written with another `compression` remain readable. An archive
+    may be read by several processes but written by a single one at a time.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        compression: Compression = "gzip",
+        segment_size: int = 64 * 2**20,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.compression = compression
+        self.segment_size = segment_size
+        self.entries: dict[str, Entry] = {}
+        self._lock = threading.Lock()
+        self._load_index()
+        segments = sorted(
+            name
+            for name in os.listdir(directory)
+            if name.endswith(tuple(SUFFIXES.values()))
+        )
+        self._segment: Optional[str] = segments[-1] if segments else None
+        self._segment_count = len(segments)
+
+    def _load_index(self) -> None:
+        path = os.path.join(self.directory, INDEX)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = Entry(**codec.loads(line))
+                except ValueError:
+                    # line truncated by an interrupted write
+                    LOGGER.warning("Ignoring corrupted archive index entry %r", line)
+                    continue
+                self.entries[entry.key] = entry
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Entry]:
+        """Iterate on latest entry of each archived request"""
+        return iter(list(self.entries.values()))
+
+    def put(self, key: str, body: bytes, timestamp: Optional[float] = None) -> Entry:
+        """Archive response `body` of request `key`, superseding previous ones"""
+        data = compress(body, self.compression)
+        with self._lock:
+            segment = self._current_segment(len(data))
+            with open(os.path.join(self.directory, segment), "ab") as f:
+                offset = f.tell()
+                f.write(data)
+            entry = Entry(
+                key,
+                time.time() if timestamp is None else timestamp,
+                segment,
+                offset,
+                len(data),
+            )
+            # the index is written last, so that it only refers to complete data
+            with open(os.path.join(self.directory, INDEX), "a", encoding="utf-8") as f:
+                f.write(codec.dumps(attrs.asdict(entry)) + "\n")
+            self.entries[key] = entry
+        return entry
+
+    def get(self, key: str) -> bytes:
+        """Return latest response body of request `key`"""
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            raise NotArchived(f"No archived response for {key}") from None
+        return self.read(entry)
+
+    def read(self, entry: Entry) -> bytes:
+        with open(os.path.join(self.directory, entry.segment), "rb") as f:
+            f.seek(entry.offset)
+            data = f.read(entry.length)
+        return decompress(data, segment_compression(entry.segment))
+
+    def _current_segment(self, size: int) -> str:
+        """Return segment to append `size` bytes to, rotating it when full"""
+        segment = self._segment
+        if segment is not None and segment_compression(segment) == self.compression:
+            path = os.path.join(self.directory, segment)
+            used = os.path.getsize(path) if os.path.exists(path) else 0
+            if used == 0 or used + size <= self.segment_size:
+                return segment
+        self._segment_count += 1
+        self._segment = f"{self._segment_count:06d}{SUFFIXES[self.compression]}"
+        return self._segment
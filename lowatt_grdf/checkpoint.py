@@ -0,0 +1,84 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Checkpoints of long running bulk commands, to resume them after a crash.
+
+A checkpoint is a journal of completed units of work, e.g. PCE and window
+requests, with the position of the sink their results were written to. A
+line is appended each time the sink is flushed, listing units whose results
+it stored, so that after a crash, results written since the last line are
+removed from the sink and their units done again, without duplicates.
+"""
+
+import os
+from typing import Any, Optional
+
+from . import LOGGER, codec
+
+
+class Checkpoint:
+    """Journal at `path` of completed units, loaded if `resume` else cleared
+
+    Units are tuples of JSON serializable values.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.path = path
+        self.done: set[tuple[Any, ...]] = set()
+        # sink position after results of done units
+        self.position: Any = None
+        self._pending: list[tuple[Any, ...]] = []
+        if resume and os.path.exists(path):
+            self._load()
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _load(self) -> None:
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    entry = codec.loads(line)
+                except ValueError:
+                    # line truncated by an interrupted write
+                    LOGGER.warning("Ignoring corrupted checkpoint entry %r", line)
+                    continue
+                self.done.update(tuple(unit) for unit in entry["units"])
+                self.position = entry["position"]
+
+    def __contains__(self, unit: tuple[Any, ...]) -> bool:
+        return unit in self.done
+
+    def __len__(self) -> int:
+        return len(self.done)
+
+    def mark(self, unit: tuple[Any, ...]) -> None:
+        """Mark `unit` as done, once its results are stored (see :meth:`save`)"""
+        self._pending.append(unit)
+
+    def save(self, position: Optional[Any] = None) -> None:
+        """Record units marked as done, their results stored up to `position`"""
+        if not self._pending and position == self.position:
+            return
+        entry = {"units": self._pending, "position": position}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(codec.dumps(entry) + "\n")
+        self.done.update(self._pending)
+        self._pending = []
+        self.position = position
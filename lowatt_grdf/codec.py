@@ -0,0 +1,158 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""JSON encoding and decoding.
+
+The fastest installed backend among orjson, msgspec and the standard library
+json module is used, unless the ``LOWATT_GRDF_JSON`` environment variable
+names another one.
+"""
+
+import json
+import os
+from typing import Any, Callable, TypeVar, Union
+
+import cattrs
+
+T = TypeVar("T")
+Loads = Callable[[Union[bytes, str]], Any]
+Dumps = Callable[[Any, bool], str]
+
+BACKENDS = ("orjson", "msgspec", "json")
+
+_converter = cattrs.Converter()
+
+
+def _orjson() -> tuple[Loads, Dumps]:
+    import orjson
+
+    def dumps(obj: Any, indent: bool) -> str:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, option=option).decode()
+
+    return orjson.loads, dumps
+
+
+def _msgspec() -> tuple[Loads, Dumps]:
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def dumps(obj: Any, indent: bool) -> str:
+        data = encoder.encode(obj)
+        if indent:
+            data = msgspec.json.format(data, indent=2)
+        return data.decode()
+
+    return decoder.decode, dumps
+
+
+def _json() -> tuple[Loads, Dumps]:
+    def dumps(obj: Any, indent: bool) -> str:
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+    return json.loads, dumps
+
+
+_FACTORIES: dict[str, Callable[[], tuple[Loads, Dumps]]] = {
+    "orjson": _orjson,
+    "msgspec": _msgspec,
+    "json": _json,
+}
+
+backend = "json"
+_loads, _dumps = _json()
+
+
+def use(name: str) -> None:
+    """Select the JSON backend, raise ImportError if it is not installed"""
+    global backend, _loads, _dumps
+    if name not in _FACTORIES:
+        raise ValueError(f"Unknown JSON backend {name!r}, expected one of {BACKENDS}")
+    _loads, _dumps = _FACTORIES[name]()
+    backend = name
+
+
+def available() -> list[str]:
+    """Return the names of installed backends, fastest first"""
+    names = []
+    for name in BACKENDS:
+        try:
+            _FACTORIES[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    return _loads(data)
+
+
+def dumps(obj: Any, indent: bool = False) -> str:
+    return _dumps(obj, indent)
+
+
+def json_array(data: Union[bytes, str]) -> bytes:
+    """Return a JSON array, or newline delimited JSON as a JSON array
+
+    Blank lines are ignored.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    if data.lstrip().startswith(b"["):
+        return data
+    lines = [line for line in data.splitlines() if line.strip()]
+    return b"[" + b",".join(lines) + b"]"
+
+
+def loads_ndjson(data: Union[bytes, str]) -> list[Any]:
+    """Decode newline delimited JSON into a list of objects
+
+    Blank lines are ignored. All lines are decoded in a single backend call.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    lines = [line for line in data.splitlines() if line.strip()]
+    result: list[Any] = _loads(b"[" + b",".join(lines) + b"]")
+    return result
+
+
+def loads_records(data: Union[bytes, str]) -> list[Any]:
+    """Decode a JSON array or newline delimited JSON"""
+    result: list[Any] = _loads(json_array(data))
+    return result
+
+
+def decode(data: Union[bytes, str], type_: type[T]) -> T:
+    """Decode JSON into `type_` (attrs classes, dataclasses, containers...)
+
+    With msgspec, objects are built directly from the JSON document. Other
+    backends decode into builtin types first then structure them with cattrs.
+    """
+    if backend == "msgspec":
+        import msgspec
+
+        return msgspec.json.decode(data, type=type_)
+    return _converter.structure(_loads(data), type_)
+
+
+use(os.environ.get("LOWATT_GRDF_JSON") or available()[0])
@@ -0,0 +1,215 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Conversion of consumption and injection records to columns.
+
+Columns are lists of a single type, compact to send between processes and
+ready to be stored in typed arrays: ``pce`` holds strings, ``start`` and
+``end`` POSIX timestamps of the consumption period, ``low_quality`` and
+``definitive`` 0 or 1, and other columns floats, NaN when missing. Records
+without consumption period are left out.
+
+With the msgspec JSON backend, :func:`decode_columns` decodes records
+straight into structs holding only the fields needed, skipping dictionaries.
+"""
+
+import functools
+import math
+from collections.abc import Iterable
+from typing import Any, Optional, Union
+
+from . import codec, dates, gaps
+
+INT_COLUMNS = ("start", "end", "low_quality", "definitive")
+FLOAT_COLUMNS = (
+    "energie",
+    "volume_brut",
+    "volume_converti",
+    "coeff_conversion",
+    "index_debut",
+    "index_fin",
+)
+COLUMNS = ("pce", *INT_COLUMNS, *FLOAT_COLUMNS)
+
+Columns = dict[str, list[Any]]
+
+
+def empty() -> Columns:
+    return {name: [] for name in COLUMNS}
+
+
+def number(value: Any) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _index(releve: Optional[dict[str, Any]], key: str) -> float:
+    index = (releve or {}).get(key) or {}
+    return number(index.get("valeur_index"))
+
+
+def to_columns(records: Iterable[dict[str, Any]]) -> Columns:
+    columns = empty()
+    starts, ends = [], []
+    for record in records:
+        conso = record.get("consommation") or {}
+        start = conso.get("date_debut_consommation")
+        end = conso.get("date_fin_consommation")
+        if not start or not end:
+            continue
+        columns["pce"].append(gaps.record_pce(record))
+        starts.append(start)
+        ends.append(end)
+        columns["low_quality"].append(int(gaps.is_low_quality(record)))
+        columns["definitive"].append(int(conso.get("statut_conso") == "Définitive"))
+        columns["energie"].append(number(conso.get("energie")))
+        columns["volume_brut"].append(number(conso.get("volume_brut")))
+        columns["volume_converti"].append(number(conso.get("volume_converti")))
+        coeff = conso.get("coeff_calcul") or {}
+        columns["coeff_conversion"].append(number(coeff.get("coeff_conversion")))
+        columns["index_debut"].append(
+            _index(record.get("releve_debut"), "index_brut_debut")
+        )
+        columns["index_fin"].append(_index(record.get("releve_fin"), "index_brut_fin"))
+    columns["start"] = dates.timestamps(starts)
+    columns["end"] = dates.timestamps(ends)
+    return columns
+
+
+@functools.cache
+def record_type() -> Any:
+    """Return msgspec type of a list of records, holding fields of columns"""
+    import msgspec
+
+    class Index(msgspec.Struct):
+        valeur_index: Optional[float] = None
+
+    class Releve(msgspec.Struct):
+        qualite_releve: Optional[str] = None
+        statut_releve: Optional[str] = None
+        index_brut_debut: Optional[Index] = None
+        index_brut_fin: Optional[Index] = None
+
+    class Coefficients(msgspec.Struct):
+        coeff_conversion: Optional[float] = None
+
+    class Consommation(msgspec.Struct):
+        date_debut_consommation: Optional[str] = None
+        date_fin_consommation: Optional[str] = None
+        statut_conso: Optional[str] = None
+        energie: Optional[float] = None
+        volume_brut: Optional[float] = None
+        volume_converti: Optional[float] = None
+        coeff_calcul: Optional[Coefficients] = None
+
+    class PCE(msgspec.Struct):
+        id_pce: str
+
+    class Record(msgspec.Struct):
+        pce: PCE
+        consommation: Optional[Consommation] = None
+        releve_debut: Optional[Releve] = None
+        releve_fin: Optional[Releve] = None
+
+    return list[Record]
+
+
+def _is_low_quality(record: Any) -> bool:
+    """Same as :func:`lowatt_grdf.gaps.is_low_quality` for typed records"""
+    for releve in (record.releve_debut, record.releve_fin):
+        if releve is None:
+            continue
+        qualite, statut = releve.qualite_releve, releve.statut_releve
+        if qualite is not None and qualite not in gaps.GOOD_QUALITY:
+            return True
+        if statut is not None and statut not in gaps.GOOD_STATUS:
+            return True
+    return False
+
+
+def _number(value: Optional[float]) -> float:
+    return math.nan if value is None else value
+
+
+def typed_to_columns(records: Iterable[Any]) -> Columns:
+    """Same as :func:`to_columns` for records of :func:`record_type`"""
+    columns = empty()
+    starts, ends = [], []
+    for record in records:
+        conso = record.consommation
+        if conso is None:
+            continue
+        start, end = conso.date_debut_consommation, conso.date_fin_consommation
+        if not start or not end:
+            continue
+        columns["pce"].append(record.pce.id_pce)
+        starts.append(start)
+        ends.append(end)
+        columns["low_quality"].append(int(_is_low_quality(record)))
+        columns["definitive"].append(int(conso.statut_conso == "Définitive"))
+        columns["energie"].append(_number(conso.energie))
+        columns["volume_brut"].append(_number(conso.volume_brut))
+        columns["volume_converti"].append(_number(conso.volume_converti))
+        coeff = conso.coeff_calcul
+        columns["coeff_conversion"].append(
+            _number(None if coeff is None else coeff.coeff_conversion)
+        )
+        debut, fin = record.releve_debut, record.releve_fin
+        index_debut = None if debut is None else debut.index_brut_debut
+        index_fin = None if fin is None else fin.index_brut_fin
+        columns["index_debut"].append(
+            _number(None if index_debut is None else index_debut.valeur_index)
+        )
+        columns["index_fin"].append(
+            _number(None if index_fin is None else index_fin.valeur_index)
+        )
+    columns["start"] = dates.timestamps(starts)
+    columns["end"] = dates.timestamps(ends)
+    return columns
+
+
+def decode_columns(data: Union[bytes, str]) -> Columns:
+    """Decode records given as a JSON array or newline delimited JSON
+
+    With the msgspec backend, records are decoded into structs of
+    :func:`record_type`, unless some value has an unexpected type.
+    """
+    if codec.backend == "msgspec":
+        import msgspec
+
+        try:
+            records = codec.decode(codec.json_array(data), record_type())
+        except msgspec.ValidationError:
+            pass
+        else:
+            return typed_to_columns(records)
+    return to_columns(codec.loads_records(data))
+
+
+def concat(parts: Iterable[Columns]) -> Columns:
+    columns = empty()
+    for part in parts:
+        for name in COLUMNS:
+            columns[name].extend(part[name])
+    return columns
+
+
+def rows(columns: Columns) -> list[dict[str, Any]]:
+    """Return columns as a list of flat records"""
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
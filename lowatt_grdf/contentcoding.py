@@ -0,0 +1,252 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Negotiation and streaming decoding of HTTP content codings.
+
+API responses are requested gzip compressed, or brotli or zstd compressed
+when the ``brotli`` (or ``brotlicffi``) or ``zstandard`` package is
+installed. Bodies are read as received and decoded chunk by chunk, so that
+bytes on the wire and decoded bytes can be told apart, and decoded chunks
+consumed as they come.
+"""
+
+import abc
+import functools
+import importlib.util
+import zlib
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+import requests
+import urllib3
+
+CHUNK_SIZE = 64 * 1024
+
+
+class Decoder(metaclass=abc.ABCMeta):
+    # exception raised on invalid data
+    error: type[Exception] = zlib.error
+    # whether some data has been decoded
+    started = False
+
+    @abc.abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def flush(self) -> bytes:
+        return b""
+
+    @property
+    def finished(self) -> bool:
+        """Whether data decoded so far ends with a complete stream, or is empty"""
+        return True
+
+
+class GzipDecoder(Decoder):
+    """Decoder of gzip data, possibly made of several members"""
+
+    def __init__(self) -> None:
+        self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        self.started = self.started or bool(data)
+        decoded = []
+        while data:
+            decoded.append(self._obj.decompress(data))
+            data = self._obj.unused_data
+            if data:
+                self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return b"".join(decoded)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    @property
+    def finished(self) -> bool:
+        return not self.started or self._obj.eof
+
+
+class DeflateDecoder(Decoder):
+    def __init__(self) -> None:
+        self._obj = zlib.decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        self.started = self.started or bool(data)
+        return self._obj.decompress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+    @property
+    def finished(self) -> bool:
+        return not self.started or self._obj.eof
+
+
+def _brotli() -> Any:
+    try:
+        import brotli
+    except ImportError:
+        import brotlicffi as brotli
+    return brotli
+
+
+class BrotliDecoder(Decoder):
+    def __init__(self) -> None:
+        brotli = _brotli()
+        self.error = brotli.error
+        self._obj = brotli.Decompressor()
+
+    def decompress(self, data: bytes) -> bytes:
+        self.started = self.started or bool(data)
+        result: bytes = self._obj.process(data)
+        return result
+
+    @property
+    def finished(self) -> bool:
+        return not self.started or bool(self._obj.is_finished())
+
+
+class ZstdDecoder(Decoder):
+    """Decoder of zstd data, possibly made of several frames"""
+
+    def __init__(self) -> None:
+        import zstandard
+
+        self.error = zstandard.ZstdError
+        self._decompressor = zstandard.ZstdDecompressor()
+        # one object per frame: with read_across_frames, eof is never set
+        self._obj = self._decompressor.decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        self.started = self.started or bool(data)
+        decoded = []
+        while data:
+            if self._obj.eof:
+                self._obj = self._decompressor.decompressobj()
+            decoded.append(self._obj.decompress(data))
+            data = self._obj.unused_data
+        return b"".join(decoded)
+
+    @property
+    def finished(self) -> bool:
+        return not self.started or bool(self._obj.eof)
+
+
+DECODERS: dict[str, type[Decoder]] = {
+    "gzip": GzipDecoder,
+    "x-gzip": GzipDecoder,
+    "deflate": DeflateDecoder,
+    "br": BrotliDecoder,
+    "zstd": ZstdDecoder,
+}
+
+
+def _installed(*modules: str) -> bool:
+    return any(importlib.util.find_spec(module) for module in modules)
+
+
+@functools.cache
+def accept_encoding() -> str:
+    """Return Accept-Encoding header value, preferred codings first"""
+    codings = []
+    if _installed("zstandard"):
+        codings.append("zstd")
+    if _installed("brotli", "brotlicffi"):
+        codings.append("br")
+    codings.append("gzip")
+    return ", ".join(codings)
+
+
+def decoders(content_encoding: str) -> list[Decoder]:
+    """Return decoders of `content_encoding` codings, in decoding order"""
+    result = []
+    for coding in reversed(content_encoding.split(",")):
+        coding = coding.strip().lower()
+        if coding in ("", "identity"):
+            continue
+        if coding not in DECODERS:
+            raise requests.exceptions.ContentDecodingError(
+                f"Unsupported content coding {coding!r}"
+            )
+        result.append(DECODERS[coding]())
+    return result
+
+
+def iter_decoded(chunks: Iterable[bytes], content_encoding: str) -> Iterator[bytes]:
+    """Yield decoded chunks of a body encoded with `content_encoding`"""
+    chain = decoders(content_encoding)
+    errors = tuple(decoder.error for decoder in chain)
+    try:
+        for chunk in chunks:
+            for decoder in chain:
+                chunk = decoder.decompress(chunk)
+            if chunk:
+                yield chunk
+        tail = b""
+        for decoder in chain:
+            tail = decoder.decompress(tail) + decoder.flush()
+            if not decoder.finished:
+                raise requests.exceptions.ContentDecodingError(
+                    f"Truncated {content_encoding} response body"
+                )
+        if tail:
+            yield tail
+    except errors as exc:
+        raise requests.exceptions.ContentDecodingError(
+            f"Invalid {content_encoding} response body: {exc}"
+        ) from exc
+
+
+def iter_raw(resp: requests.Response, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield chunks of the body of `resp`, sent with ``stream=True``, as received
+
+    urllib3 errors are raised as requests errors, as by
+    :meth:`requests.Response.iter_content`.
+    """
+    try:
+        yield from resp.raw.stream(chunk_size, decode_content=False)
+    except urllib3.exceptions.ProtocolError as exc:
+        raise requests.exceptions.ChunkedEncodingError(exc) from exc
+    except urllib3.exceptions.ReadTimeoutError as exc:
+        raise requests.exceptions.ConnectionError(exc) from exc
+    except urllib3.exceptions.SSLError as exc:
+        raise requests.exceptions.SSLError(exc) from exc
+
+
+def read(resp: requests.Response) -> int:
+    """Read and decode the body of `resp`, sent with ``stream=True``
+
+    The decoded body is then available as ``resp.content``. Return the number
+    of bytes received.
+    """
+    received = 0
+
+    def counted() -> Iterator[bytes]:
+        nonlocal received
+        for chunk in iter_raw(resp):
+            received += len(chunk)
+            yield chunk
+
+    try:
+        content_encoding = resp.headers.get("Content-Encoding", "")
+        resp._content = b"".join(iter_decoded(counted(), content_encoding))
+    finally:
+        resp.close()
+    return received
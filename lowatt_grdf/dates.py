@@ -0,0 +1,69 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Fast parsing of GRDF dates and date times to POSIX timestamps.
+
+GRDF dates are ``YYYY-MM-DD`` strings, and date times ISO 8601 strings with
+an offset, e.g. ``2021-01-01T06:00:00+01:00``. Records of a fleet share few
+distinct values: gas days start at 6:00, and a record starts when the previous
+one ends. Values are thus parsed once, by the C implementation of
+:meth:`datetime.datetime.fromisoformat`, and cached.
+"""
+
+import datetime
+import functools
+from collections.abc import Iterable
+
+DAY = 86400
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+
+@functools.lru_cache(maxsize=65536)
+def epoch_day(value: str) -> int:
+    """Return number of days from 1970-01-01 to `value` (YYYY-MM-DD)
+
+    Raise ValueError if `value` isn't a valid date in this format.
+    """
+    if len(value) != 10 or value[4] != "-" or value[7] != "-":
+        raise ValueError(f"Invalid isoformat string: {value!r}")
+    return datetime.date.fromisoformat(value).toordinal() - _EPOCH
+
+
+def date_timestamp(value: str) -> int:
+    """Return timestamp of `value` (YYYY-MM-DD) at midnight UTC"""
+    return epoch_day(value) * DAY
+
+
+@functools.lru_cache(maxsize=65536)
+def timestamp(value: str) -> int:
+    """Return timestamp of an ISO 8601 date time with offset"""
+    return int(datetime.datetime.fromisoformat(value).timestamp())
+
+
+def timestamps(values: Iterable[str]) -> list[int]:
+    """Return timestamps of date times `values`, parsing each distinct one once"""
+    parsed: dict[str, int] = {}
+    result = []
+    for value in values:
+        ts = parsed.get(value)
+        if ts is None:
+            ts = parsed[value] = timestamp(value)
+        result.append(ts)
+    return result
@@ -0,0 +1,216 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Detection of missing and low quality periods in consumption series.
+
+Periods are half-open ``[start, end)`` intervals of gas days: a record from
+``2021-01-01T06:00:00+01:00`` to ``2021-01-23T06:00:00+01:00`` covers
+``[2021-01-01, 2021-01-23)``, which is also what a request with
+``date_debut=2021-01-01`` and ``date_fin=2021-01-23`` returns.
+"""
+
+import datetime
+from collections.abc import Iterable, Iterator
+from typing import Any, Literal, Optional
+
+import attrs
+
+from . import api
+
+Interval = tuple[datetime.date, datetime.date]
+GapReason = Literal["missing", "low_quality"]
+
+GOOD_QUALITY = frozenset({"Mesure", "Mesuré"})
+GOOD_STATUS = frozenset({"Normal"})
+
+
+@attrs.frozen
+class Gap:
+    pce: str
+    start: datetime.date
+    end: datetime.date
+    reason: GapReason
+
+    def as_dict(self) -> dict[str, str]:
+        return {
+            "pce": self.pce,
+            "from_date": self.start.isoformat(),
+            "to_date": self.end.isoformat(),
+            "reason": self.reason,
+        }
+
+
+def record_pce(record: dict[str, Any]) -> str:
+    pce: str = record["pce"]["id_pce"]
+    return pce
+
+
+def record_interval(record: dict[str, Any]) -> Optional[Interval]:
+    """Return gas days covered by a consumption record, None if unknown"""
+    conso = record.get("consommation") or {}
+    start = conso.get("date_debut_consommation")
+    end = conso.get("date_fin_consommation")
+    if not start or not end:
+        periode = record.get("periode") or {}
+        start, end = periode.get("date_debut"), periode.get("date_fin")
+    if not start or not end:
+        return None
+    return (
+        datetime.date.fromisoformat(start[:10]),
+        datetime.date.fromisoformat(end[:10]),
+    )
+
+
+def is_low_quality(record: dict[str, Any]) -> bool:
+    """Return True if a reading bounding the record is not a normal measure
+
+    Readings without quality information (informative data) are trusted.
+    """
+    for key in ("releve_debut", "releve_fin"):
+        releve = record.get(key) or {}
+        qualite = releve.get("qualite_releve")
+        if qualite is not None and qualite not in GOOD_QUALITY:
+            return True
+        statut = releve.get("statut_releve")
+        if statut is not None and statut not in GOOD_STATUS:
+            return True
+    return False
+
+
+def merge(intervals: Iterable[Interval], tolerance: int = 0) -> list[Interval]:
+    """Merge overlapping intervals, and those at most `tolerance` days apart
+
+    >>> d = datetime.date
+    >>> merge([(d(2021, 1, 5), d(2021, 1, 9)), (d(2021, 1, 1), d(2021, 1, 5))])
+    [(datetime.date(2021, 1, 1), datetime.date(2021, 1, 9))]
+    """
+    merged: list[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and (start - merged[-1][1]).days <= tolerance:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(window: Interval, covered: list[Interval]) -> list[Interval]:
+    """Return parts of `window` not in `covered` (merged intervals)"""
+    result = []
+    cursor, stop = window
+    for start, end in covered:
+        if end <= cursor:
+            continue
+        if start >= stop:
+            break
+        if start > cursor:
+            result.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < stop:
+        result.append((cursor, stop))
+    return result
+
+
+def split(interval: Interval, max_days: Optional[int] = None) -> list[Interval]:
+    """Split `interval` into consecutive intervals of at most `max_days` days
+
+    >>> d = datetime.date
+    >>> split((d(2021, 1, 1), d(2021, 1, 10)), 5)  # doctest: +NORMALIZE_WHITESPACE
+    [(datetime.date(2021, 1, 1), datetime.date(2021, 1, 6)),
+     (datetime.date(2021, 1, 6), datetime.date(2021, 1, 10))]
+    """
+    start, end = interval
+    result = []
+    while max_days is not None and (end - start).days > max_days:
+        result.append((start, start + datetime.timedelta(days=max_days)))
+        start = result[-1][1]
+    result.append((start, end))
+    return result
+
+
+def find_gaps(
+    records: Iterable[dict[str, Any]],
+    from_date: str,
+    to_date: str,
+    pces: Iterable[str] = (),
+) -> list[Gap]:
+    """Return missing and low quality periods between `from_date` and `to_date`
+
+    `pces` without any record are reported as missing for the whole window.
+    """
+    window = (
+        datetime.date.fromisoformat(from_date),
+        datetime.date.fromisoformat(to_date),
+    )
+    good: dict[str, list[Interval]] = {pce: [] for pce in pces}
+    low: dict[str, list[Interval]] = {}
+    for record in records:
+        interval = record_interval(record)
+        if interval is None:
+            continue
+        pce = record_pce(record)
+        good.setdefault(pce, [])
+        if is_low_quality(record):
+            low.setdefault(pce, []).append(interval)
+        else:
+            good[pce].append(interval)
+    gaps = []
+    for pce in sorted(good):
+        covered = merge(good[pce])
+        low_quality = merge(low.get(pce, []))
+        for start, end in subtract(window, covered):
+            cursor = start
+            for low_start, low_end in subtract((start, end), low_quality):
+                if low_start > cursor:
+                    gaps.append(Gap(pce, cursor, low_start, "low_quality"))
+                gaps.append(Gap(pce, low_start, low_end, "missing"))
+                cursor = low_end
+            if cursor < end:
+                gaps.append(Gap(pce, cursor, end, "low_quality"))
+    return gaps
+
+
+def refetch_requests(
+    gaps: Iterable[Gap], tolerance: int = 0, max_days: Optional[int] = None
+) -> list[tuple[str, str, str]]:
+    """Return the fewest (pce, from_date, to_date) requests covering `gaps`
+
+    Gaps at most `tolerance` days apart are fetched by a single request,
+    requests are split to span at most `max_days` days.
+    """
+    by_pce: dict[str, list[Interval]] = {}
+    for gap in gaps:
+        by_pce.setdefault(gap.pce, []).append((gap.start, gap.end))
+    requests = []
+    for pce, intervals in sorted(by_pce.items()):
+        for interval in merge(intervals, tolerance):
+            for start, end in split(interval, max_days):
+                requests.append((pce, start.isoformat(), end.isoformat()))
+    return requests
+
+
+def refetch(
+    grdf: api.BaseAPI,
+    dataset: api.SeriesDataset,
+    requests: Iterable[tuple[str, str, str]],
+) -> Iterator[dict[str, Any]]:
+    """Yield records of `dataset` for (pce, from_date, to_date) `requests`"""
+    for pce, from_date, to_date in requests:
+        yield from grdf.donnees_series(dataset, pce, from_date, to_date)
@@ -0,0 +1,273 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Load tests of the API client, to size workers and concurrency.
+
+A workload mixes operations in given proportions, e.g.
+``droits_acces=1,consos_publiees=8,techniques=1``, sent in a deterministic
+order by a pool of threads. The client may target a server standing in for
+the API (see :class:`lowatt_grdf.api.StandInAPI`) or replay an archive, so
+that results of successive client versions can be compared.
+
+Latencies are measured by the caller, including waits for the rate limiter
+and retries. Bytes are those of decoded response bodies, wire bytes those
+received, compressed.
+"""
+
+import collections
+import concurrent.futures
+import functools
+import itertools
+import threading
+import time
+from collections.abc import Iterable, Mapping
+from typing import Any, Callable, Literal, get_args
+
+import attrs
+import requests
+
+from . import api, archive, stream
+
+Operation = Literal[
+    "droits_acces",
+    "consos_publiees",
+    "consos_informatives",
+    "injections_publiees",
+    "contractuelles",
+    "techniques",
+]
+OPERATIONS: tuple[Operation, ...] = get_args(Operation)
+DEFAULT_MIX = "droits_acces=1,consos_publiees=8,techniques=1"
+
+
+def parse_mix(spec: str) -> dict[Operation, int]:
+    """Return weights of operations given as ``OPERATION=WEIGHT,...``"""
+    mix: dict[Operation, int] = {}
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(
+                f"Invalid operation {name!r}, expected one of {', '.join(OPERATIONS)}"
+            )
+        try:
+            mix[name] = int(weight or 1)
+        except ValueError:
+            raise ValueError(f"Invalid weight {weight!r} of {name}") from None
+        if mix[name] < 0:
+            raise ValueError(f"Invalid weight {weight!r} of {name}")
+    if not any(mix.values()):
+        raise ValueError("Workload mix has no operation")
+    return mix
+
+
+def schedule(mix: Mapping[Operation, int], count: int) -> list[Operation]:
+    """Return `count` operations interleaved according to their weight
+
+    Operations are spread evenly (smooth weighted round-robin), so that any
+    prefix of the schedule follows the mix.
+    """
+    total = sum(mix.values())
+    current = dict.fromkeys(mix, 0)
+    operations = []
+    for _ in range(count):
+        for name, weight in mix.items():
+            current[name] += weight
+        chosen = max(current, key=lambda name: current[name])
+        current[chosen] -= total
+        operations.append(chosen)
+    return operations
+
+
+def endpoint(operation: str) -> str:
+    return operation if operation == "droits_acces" else f"donnees_{operation}"
+
+
+@attrs.define
+class EndpointStats:
+    requests: int = 0
+    errors: int = 0
+    records: int = 0
+    bytes: int = 0
+    # bytes received, compressed
+    wire_bytes: int = 0
+    latencies: list[float] = attrs.Factory(list)
+
+    def __add__(self, other: "EndpointStats") -> "EndpointStats":
+        return EndpointStats(
+            self.requests + other.requests,
+            self.errors + other.errors,
+            self.records + other.records,
+            self.bytes + other.bytes,
+            self.wire_bytes + other.wire_bytes,
+            self.latencies + other.latencies,
+        )
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        latencies = api.LatencyStats(len(self.latencies) or 1)
+        for latency in self.latencies:
+            latencies.add(latency)
+        percentiles = {
+            name: None if value is None else round(value, 4)
+            for name, value in latencies.summary().items()
+        }
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4)
+            if self.requests
+            else 0.0,
+            "records": self.records,
+            "bytes": self.bytes,
+            "wire_bytes": self.wire_bytes,
+            "requests_per_second": round(self.requests / elapsed, 2),
+            "records_per_second": round(self.records / elapsed, 2),
+            "bytes_per_second": round(self.bytes / elapsed),
+            "wire_bytes_per_second": round(self.wire_bytes / elapsed),
+            **percentiles,
+        }
+
+
+@attrs.frozen
+class Report:
+    elapsed: float
+    concurrency: int
+    endpoints: dict[str, EndpointStats]
+
+    def total(self) -> EndpointStats:
+        return sum(self.endpoints.values(), EndpointStats())
+
+    def summary(self) -> dict[str, Any]:
+        elapsed = self.elapsed or 1e-9
+        return {
+            "elapsed": round(self.elapsed, 3),
+            "concurrency": self.concurrency,
+            "total": self.total().summary(elapsed),
+            "endpoints": {
+                name: stats.summary(elapsed) for name, stats in self.endpoints.items()
+            },
+        }
+
+    def text(self) -> str:
+        summary = self.summary()
+        lines = [
+            f"{summary['total']['requests']} requests in {summary['elapsed']}s, "
+            f"concurrency {self.concurrency}",
+            f"{'endpoint':<20} {'requests':>8} {'errors':>7} {'req/s':>8} "
+            f"{'records/s':>10} {'bytes/s':>11} {'p50':>8} {'p95':>8} {'p99':>8}",
+        ]
+        rows = [*summary["endpoints"].items(), ("total", summary["total"])]
+        for name, stats in rows:
+            latencies = [
+                "-" if stats[p] is None else f"{stats[p] * 1000:.1f}ms"
+                for p in ("p50", "p95", "p99")
+            ]
+            lines.append(
+                f"{name:<20} {stats['requests']:>8} {stats['error_rate']:>7.1%} "
+                f"{stats['requests_per_second']:>8.2f} "
+                f"{stats['records_per_second']:>10.2f} "
+                f"{stats['bytes_per_second']:>11} "
+                + " ".join(f"{latency:>8}" for latency in latencies)
+            )
+        return "\n".join(lines)
+
+
+def calls(
+    grdf: api.BaseAPI,
+    pces: Iterable[str],
+    from_date: str,
+    to_date: str,
+    operations: Iterable[Operation],
+    window: int = 30,
+) -> Iterable[tuple[Operation, Callable[[], Any]]]:
+    """Yield `operations` with their call, cycling through PCEs and windows"""
+    pces = list(pces)
+    if not pces:
+        raise ValueError("Load tests require PCEs")
+    units = itertools.cycle(list(stream.units(pces, from_date, to_date, window)))
+    cycle = itertools.cycle(pces)
+    for operation in operations:
+        if operation == "droits_acces":
+            yield operation, grdf.droits_acces
+        elif operation in api.SERIES_DATASETS:
+            yield (
+                operation,
+                functools.partial(grdf.donnees_series, operation, *next(units)),
+            )
+        else:
+            yield (
+                operation,
+                functools.partial(getattr(grdf, f"donnees_{operation}"), next(cycle)),
+            )
+
+
+def run(
+    grdf: api.BaseAPI,
+    pces: Iterable[str],
+    from_date: str,
+    to_date: str,
+    mix: Mapping[Operation, int],
+    count: int = 100,
+    concurrency: int = 4,
+    window: int = 30,
+) -> Report:
+    """Send `count` requests mixed according to `mix`, `concurrency` at once
+
+    Consumption requests cycle through windows of `window` days of `pces`
+    between `from_date` and `to_date`. Failed requests are counted as errors.
+    """
+    operations = schedule(mix, count)
+    todo = list(calls(grdf, pces, from_date, to_date, operations, window))
+    stats: dict[str, EndpointStats] = {
+        name: EndpointStats() for name in mix if name in operations
+    }
+    lock = threading.Lock()
+
+    def send(operation: Operation, call: Callable[[], Any]) -> None:
+        start = time.monotonic()
+        result, failed = None, False
+        try:
+            result = call()
+        except (requests.RequestException, archive.NotArchived):
+            failed = True
+        latency = time.monotonic() - start
+        with lock:
+            item = stats[operation]
+            item.requests += 1
+            item.latencies.append(latency)
+            if failed:
+                item.errors += 1
+            else:
+                item.records += len(result) if isinstance(result, list) else 1
+
+    if not grdf.replay:
+        # authenticate before timing requests
+        _ = grdf.access_token
+    before = collections.Counter(grdf.response_bytes)
+    wire_before = collections.Counter(grdf.wire_bytes)
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(send, *item) for item in todo]:
+            future.result()
+    elapsed = time.monotonic() - start
+    for name, item in stats.items():
+        key = endpoint(name)
+        item.bytes = grdf.response_bytes[key] - before[key]
+        item.wire_bytes = grdf.wire_bytes[key] - wire_before[key]
+    return Report(elapsed, concurrency, stats)
@@ -18,31 +18,56 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import datetime
+import functools
 import logging
 import os
 import sys
-from typing import Any, Callable, Union
+import time
+from collections.abc import Iterable
+from typing import Any, Callable, Optional, Union
 
 import attrs
 import click
 import requests
-import rich
 
-from . import LOGGER, api, models
+from . import (
+    LOGGER,
+    api,
+    archive,
+    checkpoint,
+    codec,
+    columnar,
+    dates,
+    gaps,
+    loadtest,
+    models,
+    output,
+    planner,
+    preflight,
+    rollup,
+    scheduler,
+    sink,
+    snapshot,
+    store,
+    stream,
+    workqueue,
+)
 
 Callback = Callable[..., None]
 
 
-def api_options(func: Callback) -> Callback:
+def api_options(func: Callback, required: bool = True) -> Callback:
+    """Add API options to command `func`, credentials being `required`"""
     click.option(
         "--client-id",
-        required="CLIENT_ID" not in os.environ,
+        required=required and "CLIENT_ID" not in os.environ,
         default=os.environ.get("CLIENT_ID"),
         help="openid client id",
     )(func)
     click.option(
         "--client-secret",
-        required="CLIENT_SECRET" not in os.environ,
+        required=required and "CLIENT_SECRET" not in os.environ,
         default=os.environ.get("CLIENT_SECRET"),
         help="openid client secret",
     )(func)
@@ -55,6 +80,70 @@ def api_options(func: Callback) -> Callback:
     return func
 
 
+# for commands sending requests only with some options
+optional_api_options = functools.partial(api_options, required=False)
+
+
+def client(
+    client_id: Optional[str],
+    client_secret: Optional[str],
+    bas: bool,
+    url: Optional[str] = None,
+) -> api.BaseAPI:
+    """Return API client according to api options and --archive main options
+
+    With `url`, the client targets a server standing in for the API.
+    """
+    if client_id is None or client_secret is None:
+        raise click.UsageError("--client-id and --client-secret are required")
+    options = main_options()
+    store = None if options.archive is None else archive.Archive(options.archive)
+    api_class: Callable[..., api.BaseAPI] = {True: api.StagingAPI, False: api.API}[bas]
+    if url is not None:
+        api_class = functools.partial(api.StandInAPI, url)
+    grdf = api_class(
+        client_id,
+        client_secret,
+        archive=store,
+        replay=options.replay,
+    )
+    grdf.deadline = options.deadline
+    grdf.hedge_percentile = options.hedge_percentile
+    return grdf
+
+
+def log_transfer(grdf: api.BaseAPI) -> None:
+    """Log bytes received and decoded by `grdf`, and response codings"""
+    received = sum(grdf.wire_bytes.values())
+    if not received:
+        return
+    LOGGER.info(
+        "Received %d bytes, %d decoded (%s)",
+        received,
+        sum(grdf.response_bytes.values()),
+        ", ".join(
+            f"{count} {coding}" for coding, count in grdf.content_codings.most_common()
+        ),
+    )
+
+
+def log_latency(grdf: api.BaseAPI) -> None:
+    """Log latency percentiles of requests sent by `grdf`, and hedges"""
+    if not len(grdf.latency_stats):
+        return
+    latency = ", ".join(
+        f"{name} {value:.3f}s" for name, value in grdf.latency_stats.summary().items()
+    )
+    stats = grdf.hedge_stats
+    LOGGER.info(
+        "Request latency: %s (%d requests, %d hedged, %d hedges answered first)",
+        latency,
+        stats.requests,
+        stats.hedged,
+        stats.won,
+    )
+
+
 def options_from_model(
     model: Any,
 ) -> Callable[[Callback], Callback]:
@@ -77,11 +166,67 @@ def options_from_model(
     return decorator
 
 
+@attrs.frozen
+class MainOptions:
+    format: output.Format = "json"
+    path: Optional[str] = None
+    archive: Optional[str] = None
+    replay: bool = False
+    deadline: Optional[float] = None
+    hedge_percentile: Optional[float] = None
+
+
+def main_options() -> MainOptions:
+    options = click.get_current_context().find_object(MainOptions)
+    return MainOptions() if options is None else options
+
+
+def echo(data: Any) -> None:
+    """Write command result according to --format and --output main options"""
+    options = main_options()
+    output.dump(data, options.format, options.path)
+
+
+def open_sink(spec: Optional[str], spool: bool = False) -> sink.Sink:
+    """Return sink of --sink, or writer of --format and --output main options
+
+    With `spool`, csv or parquet records written to a pipe are output at the
+    end only, rather than after each unit of work.
+    """
+    if spec is None:
+        options = main_options()
+        # flushed after each unit of work
+        return sink.WriterSink(options.format, options.path, max_delay=0, spool=spool)
+    try:
+        return sink.open_sink(spec)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--sink") from exc
+
+
+sink_option = click.option(
+    "--sink",
+    "sink_spec",
+    metavar="KIND:PATH",
+    help=(
+        "Write records by batches to sqlite:PATH, ndjson.gz:DIR, csv:PATH, "
+        "parquet:PATH... instead of --output"
+    ),
+)
+
+
 class ExceptionHandler(click.Group):
+    def invoke(self, ctx: click.Context) -> Any:
+        try:
+            return super().invoke(ctx)
+        except output.NotRewritable as exc:
+            raise click.UsageError(
+                f"{exc}: write to a file with --output, or to a --sink"
+            ) from exc
+
     def __call__(self, *args: Any, **kwargs: Any) -> None:
         try:
             self.main(*args, **kwargs)
-        except requests.HTTPError as exc:
+        except (requests.RequestException, archive.NotArchived) as exc:
             LOGGER.error(exc)
             sys.exit(1)
 
@@ -89,8 +234,61 @@ class ExceptionHandler(click.Group):
 @click.group(
     cls=ExceptionHandler, context_settings={"help_option_names": ["-h", "--help"]}
 )
-def main() -> None:
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(output.FORMATS),
+    default="json",
+    show_default=True,
+    help="Output format, records are written as they are produced",
+)
+@click.option(
+    "--output",
+    "path",
+    metavar="PATH",
+    help="Write output to PATH instead of stdout",
+)
+@click.option(
+    "--archive",
+    "archive_dir",
+    metavar="DIR",
+    help="Archive raw API responses in DIR",
+)
+@click.option(
+    "--replay",
+    default=False,
+    is_flag=True,
+    help="Serve API responses from --archive instead of requesting the API",
+)
+@click.option(
+    "--deadline",
+    type=float,
+    metavar="SECONDS",
+    help="Fail API requests lasting more than SECONDS, hedges included",
+)
+@click.option(
+    "--hedge-percentile",
+    type=click.FloatRange(0, 100, min_open=True),
+    metavar="P",
+    help=(
+        "Send a duplicate of GET requests lasting more than the P percentile "
+        "of latencies, for at most 5% of requests"
+    ),
+)
+@click.pass_context
+def main(
+    ctx: click.Context,
+    fmt: output.Format,
+    path: Optional[str],
+    archive_dir: Optional[str],
+    replay: bool,
+    deadline: Optional[float],
+    hedge_percentile: Optional[float],
+) -> None:
     logging.basicConfig(level="INFO", format="%(levelname)s %(message)s")
+    if replay and archive_dir is None:
+        raise click.UsageError("--replay requires --archive")
+    ctx.obj = MainOptions(fmt, path, archive_dir, replay, deadline, hedge_percentile)
 
 
 @main.command()
@@ -105,11 +303,11 @@ def main() -> None:
 def droits_acces(
     client_id: str, client_secret: str, bas: bool, pce: tuple[str], check: bool
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
+    grdf = client(client_id, client_secret, bas)
     if check:
         grdf.check_consent_validation(list(pce))
     else:
-        rich.print_json(data=grdf.droits_acces(list(pce)))
+        echo(grdf.droits_acces(list(pce)))
 
 
 @main.command()
@@ -135,9 +333,9 @@ def droits_acces_specifiques(
     etat: tuple[api.BaseAPI.AccessRightState],
     preuve: tuple[api.BaseAPI.ProofControlStatus],
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(
-        data=grdf.droits_acces_specifiques(
+    grdf = client(client_id, client_secret, bas)
+    echo(
+        grdf.droits_acces_specifiques(
             list(pce),
             third_role=role,
             access_right_state=etat,
@@ -146,14 +344,62 @@ def droits_acces_specifiques(
     )
 
 
+@main.command()
+@click.argument("pce", nargs=-1)
+@click.option(
+    "--snapshot",
+    "snapshot_path",
+    required=True,
+    metavar="PATH",
+    help="Snapshot of accesses from previous run, created if missing",
+)
+@click.option(
+    "--watch",
+    type=int,
+    default=0,
+    metavar="SECONDS",
+    help="Keep polling every SECONDS instead of exiting after the first diff",
+)
+@api_options
+def droits_acces_diff(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    pce: tuple[str],
+    snapshot_path: str,
+    watch: int,
+) -> None:
+    """Output new, changed and removed accesses since last run as ndjson events
+
+    The same PCE filter should be used for a given snapshot, else accesses
+    out of the filter are reported as removed.
+    """
+    grdf = client(client_id, client_secret, bas)
+    store = snapshot.AccessSnapshot(snapshot_path)
+    with output.open_writer("ndjson", main_options().path) as writer:
+
+        def emit(events: list[dict[str, Any]]) -> None:
+            for event in events:
+                writer.write(event)
+            writer.flush()
+
+        while True:
+            items = snapshot.access_items(grdf.droits_acces(list(pce)))
+            # events are written before the snapshot is saved, not to miss any
+            store.update(items, emit)
+            if not watch:
+                break
+            time.sleep(watch)
+
+
 @main.command()
 @click.argument("id_droit_acces")
 @api_options
 def revoke_acces(
     client_id: str, client_secret: str, bas: bool, id_droit_acces: str
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(data=grdf.revoke_acces(id_droit_acces))
+    grdf = client(client_id, client_secret, bas)
+    echo(grdf.revoke_acces(id_droit_acces))
 
 
 @main.command()
@@ -169,8 +415,8 @@ def donnees_consos_publiees(
     from_date: str,
     to_date: str,
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(data=grdf.donnees_consos_publiees(pce, from_date, to_date))
+    grdf = client(client_id, client_secret, bas)
+    echo(grdf.donnees_consos_publiees(pce, from_date, to_date))
 
 
 @main.command()
@@ -186,8 +432,8 @@ def donnees_consos_informatives(
     from_date: str,
     to_date: str,
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(data=grdf.donnees_consos_informatives(pce, from_date, to_date))
+    grdf = client(client_id, client_secret, bas)
+    echo(grdf.donnees_consos_informatives(pce, from_date, to_date))
 
 
 @main.command()
@@ -203,8 +449,152 @@ def donnees_injections_publiees(
     from_date: str,
     to_date: str,
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(data=grdf.donnees_injections_publiees(pce, from_date, to_date))
+    grdf = client(client_id, client_secret, bas)
+    echo(grdf.donnees_injections_publiees(pce, from_date, to_date))
+
+
+@main.command()
+@click.argument("pce", nargs=-1, required=True)
+@click.option("--from-date", required=True)
+@click.option("--to-date", required=True)
+@click.option(
+    "--dataset",
+    type=click.Choice(api.SERIES_DATASETS),
+    default="consos_publiees",
+    show_default=True,
+)
+@click.option(
+    "--input",
+    "inputs",
+    multiple=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Stored records (json or ndjson), fetched from the API if unset",
+)
+@click.option(
+    "--tolerance",
+    type=int,
+    default=0,
+    show_default=True,
+    metavar="DAYS",
+    help="Refetch gaps at most DAYS apart with a single request",
+)
+@click.option(
+    "--refetch",
+    default=False,
+    is_flag=True,
+    help="Output records fetched to fill gaps instead of the gaps",
+)
+@optional_api_options
+def donnees_gaps(
+    client_id: Optional[str],
+    client_secret: Optional[str],
+    bas: bool,
+    pce: tuple[str],
+    from_date: str,
+    to_date: str,
+    dataset: api.SeriesDataset,
+    inputs: tuple[str],
+    tolerance: int,
+    refetch: bool,
+) -> None:
+    """Output missing or low quality periods of consumption series
+
+    API credentials are only required to fetch records, without --input or
+    with --refetch.
+    """
+    grdf = None if inputs and not refetch else client(client_id, client_secret, bas)
+    records: list[Any] = []
+    if grdf is None or inputs:
+        for path in inputs:
+            with open(path, "rb") as f:
+                records.extend(codec.loads_records(f.read()))
+    else:
+        for id_pce in pce:
+            records.extend(grdf.donnees_series(dataset, id_pce, from_date, to_date))
+    found = [
+        gap
+        for gap in gaps.find_gaps(records, from_date, to_date, pce)
+        if gap.pce in pce
+    ]
+    if grdf is not None and refetch:
+        refetches = gaps.refetch_requests(found, tolerance=tolerance)
+        echo(gaps.refetch(grdf, dataset, refetches))
+    else:
+        echo(gap.as_dict() for gap in found)
+
+
+@main.command()
+@click.argument(
+    "inputs", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False)
+)
+@click.option("--store", "store_dir", required=True, metavar="DIR")
+def ingest(inputs: tuple[str], store_dir: str) -> None:
+    """Add stored consumption or injection records to a columnar store
+
+    INPUTS are json or ndjson records, e.g. written by fetching commands.
+    Records supersede those they overlap, unless less reliable.
+    Monthly aggregates of energy and volumes, saved in the store, are updated
+    along.
+    """
+    parts = []
+    for path in inputs:
+        with open(path, "rb") as f:
+            parts.append(columnar.decode_columns(f.read()))
+    with store.Store(store_dir) as db:
+        rollups = rollup.StoreRollups(db)
+        rollups.update(db.append(columnar.concat(parts)))
+        rollups.save()
+        LOGGER.info("Store has %d rows of %d PCEs", len(db), len(db.pces()))
+
+
+@main.command()
+@click.option("--store", "store_dir", required=True, metavar="DIR")
+@click.option("--pce", "pces", multiple=True, help="PCEs to query  [default: all]")
+@click.option("--from-date", metavar="YYYY-MM-DD")
+@click.option("--to-date", metavar="YYYY-MM-DD")
+@click.option(
+    "--column",
+    "columns",
+    type=click.Choice(columnar.COLUMNS),
+    multiple=True,
+    help="Columns to output, or to aggregate  [default: all, energie]",
+)
+@click.option(
+    "--aggregate",
+    "func",
+    type=click.Choice(store.AGGREGATES),
+    help="Aggregate column values instead of outputting rows",
+)
+@click.option(
+    "--by",
+    type=click.Choice(store.GROUP_BY),
+    multiple=True,
+    help="Group aggregated values by PCE, month or year  [default: pce]",
+)
+def query(
+    store_dir: str,
+    pces: tuple[str],
+    from_date: Optional[str],
+    to_date: Optional[str],
+    columns: tuple[str],
+    func: Optional[store.Aggregate],
+    by: tuple[store.GroupBy],
+) -> None:
+    """Output rows, or aggregated values, of a columnar store
+
+    Rows are selected by the gas day they start, e.g. the energy per PCE and
+    month is given by ``--column energie --aggregate sum --by pce --by month``
+    and the last index per meter by ``--column index_fin --aggregate last``.
+    """
+    start = None if from_date is None else dates.date_timestamp(from_date)
+    end = None if to_date is None else dates.date_timestamp(to_date)
+    with store.Store(store_dir) as db:
+        if func is None:
+            selected = db.select(pces or None, start, end, columns or columnar.COLUMNS)
+            echo(columnar.rows(selected))
+        else:
+            columns = columns or ("energie",)
+            echo(db.aggregate(columns, func, by or ("pce",), pces or None, start, end))
 
 
 @main.command()
@@ -216,8 +606,8 @@ def donnees_contractuelles(
     bas: bool,
     pce: str,
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(data=grdf.donnees_contractuelles(pce))
+    grdf = client(client_id, client_secret, bas)
+    echo(grdf.donnees_contractuelles(pce))
 
 
 @main.command()
@@ -229,8 +619,35 @@ def donnees_techniques(
     bas: bool,
     pce: str,
 ) -> None:
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
-    rich.print_json(data=grdf.donnees_techniques(pce))
+    grdf = client(client_id, client_secret, bas)
+    echo(grdf.donnees_techniques(pce))
+
+
+@main.command()
+@click.argument("pce")
+@click.option("--from-date", required=True)
+@click.option("--to-date", required=True)
+@click.option(
+    "--dataset",
+    "datasets",
+    type=click.Choice(api.DATASETS),
+    multiple=True,
+    help="Datasets to fetch  [default: all]",
+)
+@api_options
+def pce_snapshot(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    pce: str,
+    from_date: str,
+    to_date: str,
+    datasets: tuple[models.Dataset],
+) -> None:
+    """Output all datasets of a PCE covered by its access right"""
+    grdf = client(client_id, client_secret, bas)
+    result = grdf.pce_snapshot(pce, from_date, to_date, datasets or api.DATASETS)
+    echo(models.converter.unstructure(result))
 
 
 @main.command()
@@ -243,5 +660,594 @@ def declare_acces(
     **kwargs: Any,
 ) -> None:
     access = models.DeclareAccess(**kwargs)
-    grdf = {True: api.StagingAPI, False: api.API}[bas](client_id, client_secret)
+    grdf = client(client_id, client_secret, bas)
     grdf.declare_acces(access)
+
+
+@main.command()
+@click.argument("pce", nargs=-1, required=True)
+@click.option("--from-date", required=True)
+@click.option("--to-date", required=True)
+@click.option(
+    "--dataset",
+    type=click.Choice(api.SERIES_DATASETS),
+    default="consos_publiees",
+    show_default=True,
+)
+@click.option(
+    "--window",
+    type=int,
+    default=365,
+    show_default=True,
+    metavar="DAYS",
+    help="Split requests in windows of at most DAYS days",
+)
+@click.option(
+    "--prefetch",
+    type=int,
+    default=4,
+    show_default=True,
+    help="Number of requests sent ahead of writing their records",
+)
+@sink_option
+@click.option(
+    "--checkpoint",
+    "checkpoint_path",
+    metavar="PATH",
+    help="Record requests whose records are written in PATH",
+)
+@click.option(
+    "--resume",
+    default=False,
+    is_flag=True,
+    help="Skip requests completed according to --checkpoint",
+)
+@api_options
+def fetch(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    pce: tuple[str],
+    from_date: str,
+    to_date: str,
+    dataset: api.SeriesDataset,
+    window: int,
+    prefetch: int,
+    sink_spec: Optional[str],
+    checkpoint_path: Optional[str],
+    resume: bool,
+) -> None:
+    """Fetch series of many PCEs by windows and output their records
+
+    With --checkpoint, an interrupted fetch is continued with --resume: the
+    sink is truncated to what was checkpointed, then requests not completed
+    are sent. This requires a sqlite or ndjson.gz --sink.
+    """
+    if resume and checkpoint_path is None:
+        raise click.UsageError("--resume requires --checkpoint")
+    grdf = client(client_id, client_secret, bas)
+    grdf.concurrency = prefetch
+    calls = list(stream.units(pce, from_date, to_date, window))
+    with open_sink(sink_spec, spool=True) as out:
+        journal = None
+        if checkpoint_path is not None:
+            if out.position() is None:
+                raise click.UsageError(
+                    "--checkpoint requires a sqlite or ndjson.gz --sink"
+                )
+            journal = checkpoint.Checkpoint(checkpoint_path, resume)
+            # drop records written after the last checkpoint
+            if journal.position is not None:
+                out.truncate(journal.position)
+            journal.save(out.position())
+            out.flush_hooks.append(lambda: journal.save(out.position()))
+            calls = [call for call in calls if (dataset, *call) not in journal]
+            LOGGER.info("Skipping %d completed requests", len(journal))
+        for call, future in stream.iter_responses(grdf, calls, dataset, prefetch):
+            exc = future.exception()
+            if isinstance(exc, requests.RequestException):
+                LOGGER.error("Request %s failed: %s", call, exc)
+                continue
+            out.extend(
+                future.result(),
+                None
+                if journal is None
+                else functools.partial(journal.mark, (dataset, *call)),
+            )
+    log_latency(grdf)
+    log_transfer(grdf)
+
+
+@main.command()
+@click.argument("pce", nargs=-1)
+@click.option(
+    "--state",
+    "state_path",
+    required=True,
+    metavar="PATH",
+    help="Scheduler state from previous runs, created if missing",
+)
+@click.option(
+    "--since",
+    metavar="YYYY-MM-DD",
+    help="Fetch data of newly added PCEs from this date  [default: 30 days ago]",
+)
+@click.option(
+    "--dataset",
+    type=click.Choice(api.SERIES_DATASETS),
+    default="consos_publiees",
+    show_default=True,
+)
+@click.option("--max-requests-per-day", type=int, default=1000, show_default=True)
+@click.option(
+    "--interval",
+    type=int,
+    default=600,
+    show_default=True,
+    metavar="SECONDS",
+    help="Maximum delay between two scheduling cycles",
+)
+@click.option("--once", default=False, is_flag=True, help="Run due polls and exit")
+@sink_option
+@api_options
+def serve(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    pce: tuple[str],
+    state_path: str,
+    since: Optional[str],
+    dataset: api.SeriesDataset,
+    max_requests_per_day: int,
+    interval: int,
+    once: bool,
+    sink_spec: Optional[str],
+) -> None:
+    """Poll PCEs when new data is expected and output fetched records
+
+    PCEs given as arguments are added to those of the state file. Meter
+    frequency is read from donnees_techniques when a PCE is added, or inferred
+    from fetched records.
+
+    Once --max-requests-per-day is used up, polls wait for the next UTC day.
+
+    With a sqlite or ndjson.gz --sink, the state file records the sink
+    position after records of polls done, and the sink is truncated to it on
+    start: records are written exactly once, even if interrupted. With other
+    sinks, records of polls interrupted before their state was saved are
+    written again.
+    """
+    grdf = client(client_id, client_secret, bas)
+    sched = scheduler.Scheduler(state_path, max_requests_per_day)
+    if since is None:
+        since = (datetime.date.today() - datetime.timedelta(days=30)).isoformat()
+    now = time.time()
+    for id_pce in pce:
+        if id_pce in sched:
+            continue
+        frequency = None
+        if sched.remaining(now):
+            sched.consume(now)
+            try:
+                frequency = scheduler.meter_frequency(grdf.donnees_techniques(id_pce))
+            except requests.RequestException as exc:
+                LOGGER.warning("Could not get frequency of %s: %s", id_pce, exc)
+        sched.add(id_pce, since, frequency, now)
+    sched.save()
+    with open_sink(sink_spec) as out:
+        if out.position() is not None and sched.sink_position is not None:
+            # drop records of polls not recorded as done
+            out.truncate(sched.sink_position)
+
+        # polls done since the state was saved
+        polled = False
+
+        def save() -> None:
+            nonlocal polled
+            if polled:
+                sched.sink_position = out.position()
+                sched.save()
+                polled = False
+
+        # polls are recorded as done along with the position after their records
+        out.flush_hooks.append(save)
+        while True:
+            now = time.time()
+            to_date = datetime.date.today().isoformat()
+            for entry in sched.due(now, to_date):
+                records: list[Any] = []
+                if entry.last_date < to_date:
+                    sched.consume(now)
+                    try:
+                        records = grdf.donnees_series(
+                            dataset, entry.pce, entry.last_date, to_date
+                        )
+                    except requests.RequestException as exc:
+                        # rescheduled as a poll returning nothing
+                        LOGGER.error("Could not poll %s: %s", entry.pce, exc)
+                # done before its records are added, and maybe flushed
+                sched.done(entry, records, now)
+                polled = True
+                out.extend(records)
+            out.flush()
+            if once:
+                break
+            wakeup = sched.wakeup(time.time())
+            delay = interval if wakeup is None else wakeup - time.time()
+            time.sleep(min(max(delay, 1), interval))
+
+
+def open_preflight(grdf: api.BaseAPI, preflight_dir: str) -> preflight.Preflight:
+    """Return pre-flight checker whose state is cached in `preflight_dir`"""
+    os.makedirs(preflight_dir, exist_ok=True)
+    return preflight.Preflight(
+        preflight.load_accesses(grdf, os.path.join(preflight_dir, "droits_acces.json")),
+        preflight.NegativeCache(os.path.join(preflight_dir, "errors.json")),
+    )
+
+
+@main.command()
+@click.argument("pce", nargs=-1, required=True)
+@click.option(
+    "--period",
+    "periods",
+    nargs=2,
+    multiple=True,
+    required=True,
+    metavar="FROM TO",
+    help="Period to fetch, as YYYY-MM-DD dates, may be repeated",
+)
+@click.option(
+    "--dataset",
+    "datasets",
+    type=click.Choice(api.DATASETS),
+    multiple=True,
+    help="Datasets to fetch  [default: consos_publiees]",
+)
+@click.option(
+    "--window",
+    type=int,
+    default=365,
+    show_default=True,
+    metavar="DAYS",
+    help="Split periods in requests of at most DAYS days",
+)
+@click.option(
+    "--preflight",
+    "preflight_dir",
+    metavar="DIR",
+    help="Skip or trim requests according to access rights cached in DIR",
+)
+@click.option(
+    "--rate-interval",
+    type=float,
+    default=1.0,
+    show_default=True,
+    metavar="SECONDS",
+    help="Minimal delay between two requests",
+)
+@click.option("--concurrency", type=int, default=1, show_default=True)
+@click.option(
+    "--latency",
+    type=float,
+    default=1.0,
+    show_default=True,
+    metavar="SECONDS",
+    help="Expected duration of a request",
+)
+@click.option("--save", "save_path", metavar="PATH", help="Save the plan to PATH")
+@api_options
+def plan(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    pce: tuple[str],
+    periods: tuple[tuple[str, str]],
+    datasets: tuple[models.Dataset],
+    window: int,
+    preflight_dir: Optional[str],
+    rate_interval: float,
+    concurrency: int,
+    latency: float,
+    save_path: Optional[str],
+) -> None:
+    """Output the number of requests of a fetch and its estimated duration
+
+    Requests whose response is in the --archive are not counted. A saved plan
+    may be queued for workers with ``enqueue --plan``.
+    """
+    grdf = client(client_id, client_secret, bas)
+    checker = None if preflight_dir is None else open_preflight(grdf, preflight_dir)
+    result = planner.plan(
+        pce,
+        periods,
+        datasets or ("consos_publiees",),
+        window,
+        checker=checker,
+        grdf=grdf,
+    )
+    if save_path is not None:
+        result.save(save_path)
+    echo(result.summary(rate_interval, concurrency, latency))
+
+
+@main.command()
+@click.argument("pce", nargs=-1, required=True)
+@click.option("--from-date", required=True)
+@click.option("--to-date", required=True)
+@click.option(
+    "--mix",
+    default=loadtest.DEFAULT_MIX,
+    show_default=True,
+    metavar="OPERATION=WEIGHT,...",
+    help=f"Proportions of operations among {', '.join(loadtest.OPERATIONS)}",
+)
+@click.option(
+    "--requests", "count", type=int, default=100, show_default=True, metavar="N"
+)
+@click.option("--concurrency", type=int, default=4, show_default=True)
+@click.option(
+    "--window",
+    type=int,
+    default=30,
+    show_default=True,
+    metavar="DAYS",
+    help="Days of consumption requests",
+)
+@click.option(
+    "--rate-interval",
+    type=float,
+    default=1.0,
+    show_default=True,
+    metavar="SECONDS",
+    help="Minimal delay between two requests",
+)
+@click.option(
+    "--url",
+    metavar="URL",
+    help="Target a server standing in for the API, serving tokens at URL/token",
+)
+@click.option(
+    "--json",
+    "as_json",
+    default=False,
+    is_flag=True,
+    help="Output the report as JSON, according to --format and --output",
+)
+@api_options
+def bench(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    pce: tuple[str],
+    from_date: str,
+    to_date: str,
+    mix: str,
+    count: int,
+    concurrency: int,
+    window: int,
+    rate_interval: float,
+    url: Optional[str],
+    as_json: bool,
+) -> None:
+    """Load test the API, or a stand-in server or archive, with a workload mix
+
+    Report throughput, error rate and latency percentiles by endpoint. Use
+    --archive with --replay to measure the client alone.
+    """
+    try:
+        weights = loadtest.parse_mix(mix)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--mix") from exc
+    grdf = client(client_id, client_secret, bas, url)
+    grdf.concurrency = concurrency
+    grdf.rate_limiter.interval = rate_interval
+    report = loadtest.run(
+        grdf, pce, from_date, to_date, weights, count, concurrency, window
+    )
+    if as_json:
+        echo(report.summary())
+    else:
+        click.echo(report.text())
+
+
+@main.command()
+@click.argument("pce", nargs=-1)
+@click.option("--queue", "queue_path", required=True, metavar="PATH")
+@click.option("--from-date")
+@click.option("--to-date")
+@click.option(
+    "--dataset",
+    type=click.Choice(api.SERIES_DATASETS),
+    default="consos_publiees",
+    show_default=True,
+)
+@click.option(
+    "--window",
+    type=int,
+    default=365,
+    show_default=True,
+    metavar="DAYS",
+    help="Split each PCE period in jobs of at most DAYS days",
+)
+@click.option(
+    "--plan",
+    "plan_path",
+    metavar="PATH",
+    help="Queue requests of a plan saved by the plan command instead",
+)
+def enqueue(
+    pce: tuple[str],
+    queue_path: str,
+    from_date: Optional[str],
+    to_date: Optional[str],
+    dataset: api.SeriesDataset,
+    window: int,
+    plan_path: Optional[str],
+) -> None:
+    """Add PCE × window fetch jobs to a work queue"""
+    payloads: Iterable[dict[str, Any]]
+    if plan_path is not None:
+        payloads = [
+            attrs.asdict(request, filter=lambda _, v: v is not None)
+            for request in planner.Plan.load(plan_path).requests
+        ]
+    elif pce and from_date and to_date:
+        interval = (
+            datetime.date.fromisoformat(from_date),
+            datetime.date.fromisoformat(to_date),
+        )
+        payloads = [
+            {
+                "pce": id_pce,
+                "dataset": dataset,
+                "from_date": start.isoformat(),
+                "to_date": end.isoformat(),
+            }
+            for id_pce in pce
+            for start, end in gaps.split(interval, window)
+        ]
+    else:
+        raise click.UsageError(
+            "Either --plan or PCE, --from-date and --to-date are required"
+        )
+    queue = workqueue.SQLiteQueue(queue_path)
+    added = queue.put(payloads)
+    LOGGER.info("Queued %d jobs: %s", added, queue.stats())
+
+
+@main.command()
+@click.option("--queue", "queue_path", required=True, metavar="PATH")
+@click.option(
+    "--visibility-timeout",
+    type=float,
+    default=300,
+    show_default=True,
+    metavar="SECONDS",
+    help="Delay after which a job not acknowledged is given to another worker",
+)
+@click.option("--max-attempts", type=int, default=5, show_default=True)
+@click.option(
+    "--wait",
+    type=int,
+    default=0,
+    metavar="SECONDS",
+    help="Poll the queue every SECONDS when empty instead of exiting",
+)
+@click.option(
+    "--preflight",
+    "preflight_dir",
+    metavar="DIR",
+    help=(
+        "Skip or trim jobs which can't succeed according to access rights, "
+        "cached in DIR along with PCE level errors"
+    ),
+)
+@sink_option
+@click.option(
+    "--checkpoint",
+    "checkpoint_path",
+    metavar="PATH",
+    help="Record jobs whose records are written in PATH, kept across runs",
+)
+@api_options
+def worker(
+    client_id: str,
+    client_secret: str,
+    bas: bool,
+    queue_path: str,
+    visibility_timeout: float,
+    max_attempts: int,
+    wait: int,
+    preflight_dir: Optional[str],
+    sink_spec: Optional[str],
+    checkpoint_path: Optional[str],
+) -> None:
+    """Process fetch jobs of a work queue and output fetched records
+
+    Jobs are acknowledged once their records are written: records of jobs
+    interrupted before are written again. With --checkpoint, jobs are recorded
+    in PATH, along with the position of the sink after their records, before
+    being acknowledged, and the sink is truncated to this position on start:
+    records of a job are written once, unless its lease expires and another
+    worker processes it. This requires a sqlite or ndjson.gz --sink, written
+    by this worker only.
+    """
+    grdf = client(client_id, client_secret, bas)
+    queue = workqueue.SQLiteQueue(queue_path, visibility_timeout, max_attempts)
+    checker = None if preflight_dir is None else open_preflight(grdf, preflight_dir)
+
+    def ack(job: workqueue.Job) -> None:
+        if not queue.ack(job):
+            LOGGER.warning("Lease of job %s expired before completion", job.payload)
+
+    with open_sink(sink_spec) as out:
+        journal = None
+        stored: list[workqueue.Job] = []
+        if checkpoint_path is not None:
+            if out.position() is None:
+                raise click.UsageError(
+                    "--checkpoint requires a sqlite or ndjson.gz --sink"
+                )
+            journal = checkpoint.Checkpoint(checkpoint_path, resume=True)
+            # drop records of jobs not recorded as done
+            if journal.position is not None:
+                out.truncate(journal.position)
+
+            def save() -> None:
+                assert journal is not None
+                journal.save(out.position())
+                for job in stored:
+                    ack(job)
+                stored.clear()
+
+            out.flush_hooks.append(save)
+
+        def done(job: workqueue.Job) -> None:
+            if journal is None:
+                ack(job)
+            else:
+                journal.mark((job.id,))
+                stored.append(job)
+
+        while True:
+            # flush delayed records, whether or not jobs yield some
+            out.poll()
+            job = queue.lease()
+            if job is None:
+                out.flush()
+                if not wait:
+                    break
+                time.sleep(wait)
+                continue
+            if journal is not None and (job.id,) in journal:
+                # records written before acknowledging it was interrupted
+                ack(job)
+                continue
+            payload = job.payload
+            if checker is not None:
+                decision = checker.check(preflight.Request(**payload))
+                if decision.skip is not None:
+                    LOGGER.info("Skipping job %s: %s", payload, decision.skip)
+                    queue.ack(job)
+                    continue
+                payload = attrs.asdict(
+                    decision.request, filter=lambda _, v: v is not None
+                )
+            try:
+                if "from_date" in payload:
+                    records = grdf.donnees_series(**payload)
+                else:
+                    # contractuelles or techniques, from a plan
+                    dataset = payload["dataset"]
+                    records = [getattr(grdf, f"donnees_{dataset}")(payload["pce"])]
+            except requests.RequestException as exc:
+                LOGGER.error("Job %s failed: %s", payload, exc)
+                if checker is not None and checker.record_error(payload["pce"], exc):
+                    checker.cache.save()
+                queue.nack(job, str(exc))
+                continue
+            # acknowledged once its records are stored
+            out.extend(records, functools.partial(done, job))
+    log_latency(grdf)
+    log_transfer(grdf)
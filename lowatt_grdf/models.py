@@ -18,15 +18,16 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import time
-from typing import Any, Literal, Optional
+import operator
+from collections.abc import Iterable
+from typing import Any, Callable, Literal, Optional, get_args
 
 import attrs
 import cattrs
 import cattrs.gen
 import cattrs.preconf.json
 
-from . import LOGGER
+from . import LOGGER, dates
 
 
 def validate_date_format(
@@ -36,7 +37,7 @@ def validate_date_format(
         return
     assert isinstance(value, str), type(value)
     try:
-        time.strptime(value, "%Y-%m-%d")
+        dates.epoch_day(value)
     except ValueError as exc:
         raise ValueError(
             f"format of {attribute} must be 'YYYY-MM-DD', got {value}"
@@ -47,12 +48,22 @@ class BaseModel:
     pass
 
 
+SeriesDataset = Literal["consos_publiees", "consos_informatives", "injections_publiees"]
+Dataset = Literal[
+    "contractuelles",
+    "techniques",
+    "consos_publiees",
+    "consos_informatives",
+    "injections_publiees",
+]
+
 ThirdRole = Literal[
     "AUTORISE_CONTRAT_FOURNITURE",
     "DETENTEUR_CONTRAT_FOURNITURE",
     "AUTORISE_CONTRAT_INJECTION",
     "DETENTEUR_CONTRAT_INJECTION",
 ]
+THIRD_ROLES = frozenset(get_args(ThirdRole))
 
 
 @attrs.frozen
@@ -158,6 +169,28 @@ class Access(BaseModel):
             return False
         return True
 
+    def covers(self, dataset: Dataset) -> bool:
+        """Return True if the access perimeter includes `dataset`"""
+        if dataset == "contractuelles":
+            return self.perim_donnees_contractuelles
+        if dataset == "techniques":
+            return self.perim_donnees_techniques
+        if dataset == "consos_informatives":
+            return self.perim_donnees_informatives
+        if dataset == "consos_publiees":
+            return self.perim_donnees_publiees and "FOURNITURE" in self.role_tiers
+        if dataset == "injections_publiees":
+            return self.perim_donnees_publiees and "INJECTION" in self.role_tiers
+        raise ValueError(f"Unknown dataset {dataset!r}")
+
+    def data_period(self, dataset: Dataset) -> tuple[Optional[str], Optional[str]]:
+        """Return first and last days of `dataset` in the perimeter, if bounded"""
+        if dataset == "injections_publiees":
+            return self.perim_donnees_inj_debut, self.perim_donnees_inj_fin
+        if dataset in ("consos_publiees", "consos_informatives"):
+            return self.perim_donnees_conso_debut, self.perim_donnees_conso_fin
+        return None, None
+
     def check_consent(self) -> bool:
         """Return True if there's no pending/failed consent validation"""
         if self.statut_controle_preuve in ("Preuve en attente", "Preuve Vérifiée KO"):
@@ -170,6 +203,36 @@ class Access(BaseModel):
         return True
 
 
+def access_skip_reason(accesses: list[Access], dataset: Dataset) -> Optional[str]:
+    """Return why `dataset` can't be fetched given `accesses` to a PCE, or None"""
+    if not accesses:
+        return "no access right"
+    active = [access for access in accesses if access.is_active(log=False)]
+    if not active:
+        return f"access right is {accesses[0].etat_droit_acces}"
+    if not any(access.covers(dataset) for access in active):
+        return "not in access perimeter"
+    return None
+
+
+@attrs.frozen
+class PCESnapshot(BaseModel):
+    """Datasets of a PCE, None when not fetched
+
+    `skipped` and `errors` map datasets which were not fetched, or whose
+    request failed, to the reason.
+    """
+
+    pce: str
+    contractuelles: Optional[dict[str, Any]] = None
+    techniques: Optional[dict[str, Any]] = None
+    consos_publiees: Optional[list[dict[str, Any]]] = None
+    consos_informatives: Optional[list[dict[str, Any]]] = None
+    injections_publiees: Optional[list[dict[str, Any]]] = None
+    skipped: dict[str, str] = attrs.field(factory=dict)
+    errors: dict[str, str] = attrs.field(factory=dict)
+
+
 def structure_grdf_bool(value: Any, type_: Any) -> bool:
     if not isinstance(value, str):
         raise ValueError(f"Unhandled type {type(value)} for {value!r}")
@@ -212,3 +275,93 @@ converter.register_unstructure_hook(
         },
     ),
 )
+
+
+# exact values sent by the API, other casings go through structure_grdf_bool
+GRDF_BOOLS = {"Vrai": True, "Faux": False}
+
+
+def _make_access_structure_fn() -> Callable[[dict[str, Any]], Access]:
+    """Return function structuring a droits_acces item, as cattrs would do
+    but without checking nor converting values other than booleans
+
+    Booleans are looked up in `GRDF_BOOLS`, other values kept as is.
+    """
+    namespace: dict[str, Any] = {"Access": Access, "bools": GRDF_BOOLS}
+    args = []
+    fields: tuple[attrs.Attribute[Any], ...] = attrs.fields(Access)
+    for i, field in enumerate(fields):
+        key = "id_pce" if field.name == "pce" else field.name
+        if field.default is attrs.NOTHING:
+            value = f"item[{key!r}]"
+        else:
+            namespace[f"default{i}"] = (
+                unstructure_grdf_bool(bool(field.default))
+                if field.type is bool
+                else field.default
+            )
+            value = f"item.get({key!r}, default{i})"
+        if field.type is bool:
+            value = f"bools[{value}]"
+        args.append(f"        {value},  # {field.name}\n")
+    source = f"def structure_access(item):\n    return Access(\n{''.join(args)}    )\n"
+    exec(compile(source, "<generated structure_access>", "exec"), namespace)
+    function: Callable[[dict[str, Any]], Access] = namespace["structure_access"]
+    return function
+
+
+_structure_access = _make_access_structure_fn()
+# value types expected by field, checked when structuring accesses in batch
+_ACCESS_TYPES = {
+    field.name: frozenset({str} if field.type is str else {str, type(None)})
+    for field in attrs.fields(Access)
+    if field.type in (str, Optional[str])
+}
+
+
+def _invalid_accesses(accesses: list[Access]) -> set[int]:
+    """Return indexes of `accesses` with values cattrs would have refused or
+    converted, checked field by field over all accesses
+    """
+    invalid: set[int] = set()
+    get_role = operator.attrgetter("role_tiers")
+    if not set(map(get_role, accesses)) <= THIRD_ROLES:
+        invalid.update(
+            i
+            for i, access in enumerate(accesses)
+            if get_role(access) not in THIRD_ROLES
+        )
+    for name, types in _ACCESS_TYPES.items():
+        get = operator.attrgetter(name)
+        if not set(map(type, map(get, accesses))) <= types:
+            invalid.update(
+                i for i, access in enumerate(accesses) if type(get(access)) not in types
+            )
+    return invalid
+
+
+def structure_accesses(
+    items: Iterable[dict[str, Any]], validate: bool = True
+) -> list[Access]:
+    """Structure droits_acces items in batch, as ``converter`` does one by one
+
+    Items are structured by a precompiled function, falling back to
+    ``converter`` for those it can't handle, e.g. booleans in lower case or
+    missing fields. With `validate`, values are then checked field by field
+    over all accesses, and those which cattrs would have refused or converted
+    (e.g. an unknown role_tiers, or a number instead of a string) structured
+    again by ``converter``, which raises the same error as it would have.
+    Without `validate`, they are kept as is.
+    """
+    items = list(items)
+    accesses = []
+    for item in items:
+        try:
+            access = _structure_access(item)
+        except (KeyError, TypeError, ValueError):
+            access = converter.structure(item, Access)
+        accesses.append(access)
+    if validate:
+        for i in sorted(_invalid_accesses(accesses)):
+            accesses[i] = converter.structure(items[i], Access)
+    return accesses
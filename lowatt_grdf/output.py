@@ -0,0 +1,316 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Streaming writers for command line output.
+
+Records are written as soon as they are produced, in one of :data:`FORMATS`.
+Nested objects are flattened to dotted column names for tabular formats.
+"""
+
+import abc
+import contextlib
+import csv
+import io
+import shutil
+import sys
+import tempfile
+from collections.abc import Iterable, Iterator
+from typing import IO, Any, Literal, Optional, get_args
+
+from . import codec
+
+Format = Literal["json", "ndjson", "csv", "parquet"]
+FORMATS: tuple[Format, ...] = get_args(Format)
+
+
+def flatten(record: Any, prefix: str = "") -> dict[str, Any]:
+    """Flatten nested dictionaries, joining keys with a dot
+
+    >>> flatten({"pce": {"id_pce": "GI000000"}, "energie": 8})
+    {'pce.id_pce': 'GI000000', 'energie': 8}
+    """
+    if not isinstance(record, dict):
+        return {prefix.rstrip(".") or "value": record}
+    flat: dict[str, Any] = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+class Writer(metaclass=abc.ABCMeta):
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+
+    @abc.abstractmethod
+    def write(self, record: Any) -> None:
+        raise NotImplementedError()
+
+    def flush(self) -> None:
+        """Write buffered records to the stream and flush it"""
+        self.stream.flush()
+
+    def close(self) -> None:
+        self.flush()
+
+
+class NdjsonWriter(Writer):
+    def write(self, record: Any) -> None:
+        self.stream.write(codec.dumps(record).encode() + b"\n")
+
+
+class JsonWriter(Writer):
+    """Write records as a JSON array, one record per line"""
+
+    def __init__(self, stream: IO[bytes]):
+        super().__init__(stream)
+        self._count = 0
+
+    def write(self, record: Any) -> None:
+        self.stream.write(b",\n" if self._count else b"[\n")
+        self.stream.write(codec.dumps(record).encode())
+        self._count += 1
+
+    def close(self) -> None:
+        self.stream.write(b"\n]\n" if self._count else b"[]\n")
+        super().close()
+
+
+class NotRewritable(ValueError):
+    """Written records should be rewritten, which their stream doesn't allow"""
+
+
+def _rewritable(stream: IO[Any]) -> bool:
+    return stream.seekable() and stream.readable()
+
+
+class CsvWriter(Writer):
+    """Write flattened records, columns are those of the first record
+
+    Columns of later records are appended, rewriting written rows, which
+    requires a seekable and readable stream: NotRewritable is raised
+    otherwise.
+    """
+
+    def __init__(self, stream: IO[bytes]):
+        super().__init__(stream)
+        self._text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        self._writer: Optional[csv.DictWriter[str]] = None
+
+    def write(self, record: Any) -> None:
+        row = {
+            key: codec.dumps(value) if isinstance(value, (list, dict)) else value
+            for key, value in flatten(record).items()
+        }
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._text, fieldnames=list(row))
+            self._writer.writeheader()
+        elif not row.keys() <= set(self._writer.fieldnames):
+            fieldnames = list(self._writer.fieldnames)
+            fieldnames += [key for key in row if key not in fieldnames]
+            self._rewrite(fieldnames)
+        self._writer.writerow(row)
+
+    def _rewrite(self, fieldnames: list[str]) -> None:
+        assert self._writer is not None
+        if not _rewritable(self._text):
+            new = [key for key in fieldnames if key not in self._writer.fieldnames]
+            raise NotRewritable(f"Can't add columns {new} to written CSV rows")
+        self._text.flush()
+        self._text.seek(0)
+        reader = csv.DictReader(io.StringIO(self._text.read(), newline=""))
+        self._text.seek(0)
+        self._text.truncate()
+        self._writer = csv.DictWriter(self._text, fieldnames=fieldnames)
+        self._writer.writeheader()
+        self._writer.writerows(reader)
+
+    def flush(self) -> None:
+        self._text.flush()
+        super().flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._text.detach()
+
+
+class ParquetWriter(Writer):
+    """Write flattened records by row groups of `row_group_size` rows
+
+    The schema is inferred from the first row group, then widened by later
+    ones (e.g. a column of integers to floats, or a null column to strings),
+    rewriting written row groups, which requires a seekable and readable
+    stream: NotRewritable is raised otherwise, and ValueError on incompatible
+    types.
+    Requires pyarrow.
+    """
+
+    def __init__(self, stream: IO[bytes], row_group_size: int = 10_000):
+        super().__init__(stream)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as exc:
+            raise RuntimeError("parquet output requires pyarrow") from exc
+        self.row_group_size = row_group_size
+        self._rows: list[dict[str, Any]] = []
+        self._writer: Any = None
+
+    def write(self, record: Any) -> None:
+        self._rows.append(flatten(record))
+        if len(self._rows) >= self.row_group_size:
+            self._flush_rows()
+
+    def _flush_rows(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(self._rows)
+        self._rows = []
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.stream, table.schema)
+        else:
+            try:
+                schema = pa.unify_schemas(
+                    [self._writer.schema, table.schema], promote_options="permissive"
+                )
+            except (pa.ArrowInvalid, pa.ArrowTypeError) as exc:
+                raise ValueError(f"Can't write rows to parquet: {exc}") from exc
+            if not schema.equals(self._writer.schema):
+                self._rewrite(schema)
+        self._writer.write_table(_conform(table, self._writer.schema))
+
+    def _rewrite(self, schema: Any) -> None:
+        """Write rows written so far again, with wider `schema`"""
+        import pyarrow.parquet as pq
+
+        if not _rewritable(self.stream):
+            raise NotRewritable(
+                f"Can't widen parquet schema {self._writer.schema} to {schema}"
+            )
+        self._writer.close()
+        self.stream.seek(0)
+        written = pq.ParquetFile(self.stream)
+        groups = [written.read_row_group(i) for i in range(written.num_row_groups)]
+        self.stream.seek(0)
+        self.stream.truncate()
+        self._writer = pq.ParquetWriter(self.stream, schema)
+        for group in groups:
+            self._writer.write_table(_conform(group, schema))
+
+    def flush(self) -> None:
+        """Write buffered rows as a row group, even if smaller than the others"""
+        if self._rows:
+            self._flush_rows()
+        super().flush()
+
+    def close(self) -> None:
+        if self._rows:
+            self._flush_rows()
+        if self._writer is not None:
+            self._writer.close()
+        super().close()
+
+
+def _conform(table: Any, schema: Any) -> Any:
+    """Return `table` cast to `schema`, with null columns for missing fields"""
+    import pyarrow as pa
+
+    columns = [
+        table.column(field.name).cast(field.type)
+        if field.name in table.column_names
+        else pa.nulls(len(table), field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+WRITERS: dict[str, type[Writer]] = {
+    "json": JsonWriter,
+    "ndjson": NdjsonWriter,
+    "csv": CsvWriter,
+    "parquet": ParquetWriter,
+}
+
+
+@contextlib.contextmanager
+def open_stream(path: Optional[str] = None) -> Iterator[IO[bytes]]:
+    """Yield binary file at `path`, or stdout if unset or '-'"""
+    if path is None or path == "-":
+        yield sys.stdout.buffer
+    else:
+        # readable, for writers to rewrite written records
+        with open(path, "w+b") as stream:
+            yield stream
+
+
+@contextlib.contextmanager
+def open_writer(
+    fmt: Format, path: Optional[str] = None, spool: bool = False
+) -> Iterator[Writer]:
+    """Yield a `fmt` writer to file at `path`, or to stdout if unset or '-'
+
+    With `spool`, tabular formats are written to a temporary file when the
+    stream can't be rewritten (e.g. a pipe), copied to the stream once
+    closed, so that later records may add columns.
+    """
+    with open_stream(path) as stream:
+        if not spool or fmt not in ("csv", "parquet") or _rewritable(stream):
+            with _writer(fmt, stream) as writer:
+                yield writer
+            return
+        with tempfile.TemporaryFile() as tmp:
+            with _writer(fmt, tmp) as writer:
+                yield writer
+            tmp.seek(0)
+            shutil.copyfileobj(tmp, stream)
+            stream.flush()
+
+
+@contextlib.contextmanager
+def _writer(fmt: Format, stream: IO[bytes]) -> Iterator[Writer]:
+    writer = WRITERS[fmt](stream)
+    try:
+        yield writer
+    finally:
+        writer.close()
+
+
+def dump(data: Any, fmt: Format = "json", path: Optional[str] = None) -> None:
+    """Write `data`, a single object or an iterable of records
+
+    A single object is written as is in json format and as a one-record table
+    otherwise.
+    """
+    if fmt == "json" and not _is_records(data):
+        with open_stream(path) as stream:
+            stream.write(codec.dumps(data, indent=True).encode() + b"\n")
+            stream.flush()
+        return
+    records = data if _is_records(data) else [data]
+    with open_writer(fmt, path, spool=True) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def _is_records(data: Any) -> bool:
+    return isinstance(data, Iterable) and not isinstance(data, (dict, str, bytes))
@@ -0,0 +1,171 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Planning of fleet fetches, to know their cost before running them.
+
+Requested periods of each PCE are merged when adjacent or overlapping, reduced
+to what isn't already covered, trimmed by pre-flight access checks then split
+in windows. Requests whose response is already archived are left out.
+"""
+
+import datetime
+import os
+from collections import Counter
+from collections.abc import Iterable, Mapping
+from typing import Any, Optional
+
+import attrs
+
+from . import api, codec, gaps, models, preflight
+
+
+@attrs.frozen
+class Plan:
+    requests: tuple[preflight.Request, ...] = ()
+    skipped: tuple[preflight.Decision, ...] = ()
+    # requests whose response is archived
+    cached: int = 0
+
+    def estimate(
+        self, interval: float = 1.0, concurrency: int = 1, latency: float = 1.0
+    ) -> float:
+        """Return estimated wall time, in seconds, to send all requests
+
+        Requests start at most every `interval` seconds, and at most
+        `concurrency` of them, each lasting `latency` seconds, run at once.
+        """
+        throughput = min(
+            1 / interval if interval else float("inf"), concurrency / latency
+        )
+        return len(self.requests) / throughput
+
+    def summary(
+        self, interval: float = 1.0, concurrency: int = 1, latency: float = 1.0
+    ) -> dict[str, Any]:
+        return {
+            "requests": len(self.requests),
+            "by_dataset": dict(Counter(r.dataset for r in self.requests)),
+            "skipped": dict(Counter(d.skip for d in self.skipped)),
+            "cached": self.cached,
+            "estimated_seconds": round(self.estimate(interval, concurrency, latency)),
+        }
+
+    def save(self, path: str) -> None:
+        data = {
+            "requests": [attrs.asdict(r) for r in self.requests],
+            "skipped": [
+                dict(attrs.asdict(d.request), reason=d.skip) for d in self.skipped
+            ],
+            "cached": self.cached,
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(codec.dumps(data, indent=True))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Plan":
+        with open(path, "rb") as f:
+            data = codec.loads(f.read())
+        skipped = []
+        for item in data["skipped"]:
+            reason = item.pop("reason")
+            skipped.append(preflight.Decision(preflight.Request(**item), reason))
+        return cls(
+            tuple(preflight.Request(**item) for item in data["requests"]),
+            tuple(skipped),
+            data["cached"],
+        )
+
+
+def request_key(grdf: api.BaseAPI, request: preflight.Request) -> str:
+    """Return archive key of `request` sent by `grdf`
+
+    Endpoints overridden by :class:`lowatt_grdf.api.StagingAPI` are not
+    handled, their requests are never found archived.
+    """
+    url = f"{grdf.api}/pce/{request.pce}/donnees_{request.dataset}"
+    if request.from_date is None:
+        return api.request_key("GET", url)
+    params = {"date_debut": request.from_date, "date_fin": request.to_date}
+    return api.request_key("GET", url, params=params)
+
+
+def plan(
+    pces: Iterable[str],
+    periods: Iterable[tuple[str, str]],
+    datasets: Iterable[models.Dataset],
+    window: Optional[int] = 365,
+    checker: Optional[preflight.Preflight] = None,
+    covered: Optional[Mapping[tuple[str, str], list[gaps.Interval]]] = None,
+    grdf: Optional[api.BaseAPI] = None,
+) -> Plan:
+    """Return requests fetching `datasets` of `pces` over `periods`
+
+    `covered` maps (pce, dataset) to periods already fetched. Requests whose
+    response is in the archive of `grdf` are counted as cached.
+    """
+    intervals = gaps.merge(
+        (datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))
+        for start, end in periods
+    )
+    candidates: list[preflight.Request] = []
+    for pce in dict.fromkeys(pces):
+        for dataset in datasets:
+            if dataset not in api.SERIES_DATASETS:
+                candidates.append(preflight.Request(pce, dataset))
+                continue
+            done = gaps.merge((covered or {}).get((pce, dataset), []))
+            for interval in intervals:
+                for start, end in gaps.subtract(interval, done):
+                    candidates.append(
+                        preflight.Request(
+                            pce, dataset, start.isoformat(), end.isoformat()
+                        )
+                    )
+    skipped: list[preflight.Decision] = []
+    if checker is not None:
+        candidates, skipped = checker.filter(candidates)
+    requests = []
+    cached = 0
+    for request in candidates:
+        if request.from_date is None or request.to_date is None:
+            windows = [request]
+        else:
+            interval = (
+                datetime.date.fromisoformat(request.from_date),
+                datetime.date.fromisoformat(request.to_date),
+            )
+            windows = [
+                attrs.evolve(
+                    request, from_date=start.isoformat(), to_date=end.isoformat()
+                )
+                for start, end in gaps.split(interval, window)
+            ]
+        for item in windows:
+            if (
+                grdf is not None
+                and grdf.archive is not None
+                and request_key(grdf, item) in grdf.archive
+            ):
+                cached += 1
+            else:
+                requests.append(item)
+    return Plan(tuple(requests), tuple(skipped), cached)
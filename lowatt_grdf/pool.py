@@ -0,0 +1,121 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Pool of API clients using distinct credentials.
+
+Each PCE is routed to the client whose credential holds an access right to
+it. Routes are computed again when a PCE has none, at most once every
+`refresh_interval` seconds, e.g. for PCEs granted since. Clients created by :meth:`ClientPool.from_credentials` with a `lock_dir`
+share their rate budget with every process of the host using the same
+credential.
+"""
+
+import os
+import threading
+import time
+from collections.abc import Iterable, Mapping
+from typing import Any, Optional
+
+import requests
+
+from . import LOGGER, api, ratelimit, snapshot
+
+
+class ClientPool:
+    def __init__(
+        self, clients: Mapping[str, api.BaseAPI], refresh_interval: float = 300
+    ):
+        self.clients = dict(clients)
+        self.refresh_interval = refresh_interval
+        self.routes: dict[str, str] = {}
+        self._refreshed: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_credentials(
+        cls,
+        credentials: Iterable[tuple[str, str, str]],
+        api_class: type[api.BaseAPI] = api.API,
+        lock_dir: Optional[str] = None,
+        interval: float = 1.0,
+    ) -> "ClientPool":
+        """Build a pool from (name, client_id, client_secret) credentials
+
+        With `lock_dir`, rate limiting state of each credential is stored in
+        ``<lock_dir>/<client_id>.rate`` and shared across processes.
+        """
+        clients = {}
+        for name, client_id, client_secret in credentials:
+            limiter: ratelimit.RateLimiter
+            if lock_dir is None:
+                limiter = ratelimit.IntervalLimiter(interval)
+            else:
+                path = os.path.join(lock_dir, f"{client_id}.rate")
+                limiter = ratelimit.FileRateLimiter(path, interval)
+            clients[name] = api_class(client_id, client_secret, rate_limiter=limiter)
+        return cls(clients)
+
+    def refresh_routes(self) -> None:
+        """Route each PCE to a client holding an access to it, active first
+
+        PCEs of clients failing to list their accesses keep their routes.
+        """
+        self._refreshed = time.monotonic()
+        routes: dict[str, str] = {}
+        active: set[str] = set()
+        failed: set[str] = set()
+        for name, client in self.clients.items():
+            try:
+                items = snapshot.access_items(client.droits_acces())
+            except requests.RequestException as exc:
+                LOGGER.error("Could not get accesses of client %s: %s", name, exc)
+                failed.add(name)
+                continue
+            for item in items:
+                pce = item["id_pce"]
+                is_active = item.get("etat_droit_acces") == "Active"
+                if pce not in routes or (is_active and pce not in active):
+                    routes[pce] = name
+                if is_active:
+                    active.add(pce)
+        for pce, name in self.routes.items():
+            if name in failed:
+                routes.setdefault(pce, name)
+        self.routes = routes
+        LOGGER.info("Routed %d PCE to %d clients", len(routes), len(self.clients))
+
+    def client_for(self, pce: str) -> api.BaseAPI:
+        """Return client routed for `pce`, computing routes again if it has none"""
+        with self._lock:
+            if pce not in self.routes and (
+                self._refreshed is None
+                or time.monotonic() - self._refreshed >= self.refresh_interval
+            ):
+                self.refresh_routes()
+        try:
+            return self.clients[self.routes[pce]]
+        except KeyError:
+            raise LookupError(f"No client has an access right to {pce}") from None
+
+    def call(self, method: str, pce: str, *args: Any, **kwargs: Any) -> Any:
+        """Call `method` of the client routed for `pce`, e.g.
+        ``pool.call("donnees_consos_publiees", pce, from_date, to_date)``
+        """
+        return getattr(self.client_for(pce), method)(pce, *args, **kwargs)
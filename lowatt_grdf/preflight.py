@@ -0,0 +1,213 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Pre-flight checks of data requests against access rights.
+
+Requests which can't succeed are skipped before using any rate budget: PCEs
+without an active access right covering the dataset, or periods outside the
+access perimeter dates or older than the available history. Series requests
+are trimmed to the part which may succeed.
+
+PCE level errors returned by the API (e.g. unknown or out of service PCE) are
+kept in a negative cache, so that other requests to the PCE are skipped until
+the error expires.
+"""
+
+import datetime
+import os
+import time
+from collections.abc import Iterable
+from typing import Any, Optional
+
+import attrs
+import requests
+
+from . import LOGGER, api, codec, models, snapshot
+
+DAY = 86400
+HISTORY_YEARS = 5
+# HTTP statuses of errors related to the PCE rather than to the request
+PCE_ERROR_STATUSES = frozenset({403, 404})
+
+
+@attrs.frozen
+class Request:
+    pce: str
+    dataset: models.Dataset
+    from_date: Optional[str] = None
+    to_date: Optional[str] = None
+
+
+@attrs.frozen
+class Decision:
+    """`request`, possibly trimmed, or the reason why it is skipped"""
+
+    request: Request
+    skip: Optional[str] = None
+
+
+def history_start(today: datetime.date) -> datetime.date:
+    """Return first day of the available history"""
+    try:
+        return today.replace(year=today.year - HISTORY_YEARS)
+    except ValueError:  # February 29th
+        return today.replace(year=today.year - HISTORY_YEARS, day=28)
+
+
+class NegativeCache:
+    """PCE level errors expiring after `ttl` seconds, stored as JSON at `path`"""
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DAY):
+        self.path = path
+        self.ttl = ttl
+        # pce: (reason, expires)
+        self.entries: dict[str, tuple[str, float]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as f:
+                self.entries = {
+                    pce: (reason, expires)
+                    for pce, (reason, expires) in codec.loads(f.read()).items()
+                }
+
+    def get(self, pce: str, now: Optional[float] = None) -> Optional[str]:
+        """Return cached error of `pce`, None if there is none or it expired"""
+        entry = self.entries.get(pce)
+        if entry is None:
+            return None
+        reason, expires = entry
+        if expires <= (time.time() if now is None else now):
+            del self.entries[pce]
+            return None
+        return reason
+
+    def add(self, pce: str, reason: str, now: Optional[float] = None) -> None:
+        self.entries[pce] = (reason, (time.time() if now is None else now) + self.ttl)
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(codec.dumps(self.entries))
+        os.replace(tmp, self.path)
+
+
+def load_accesses(
+    grdf: api.BaseAPI, path: Optional[str] = None, max_age: float = DAY
+) -> list[models.Access]:
+    """Return accesses from droits_acces, cached at `path` for `max_age` seconds"""
+    items: Optional[list[dict[str, Any]]] = None
+    if path is not None and os.path.exists(path):
+        with open(path, "rb") as f:
+            cached = codec.loads(f.read())
+        if cached["fetched"] + max_age > time.time():
+            items = cached["items"]
+    if items is None:
+        items = snapshot.access_items(grdf.droits_acces())
+        if path is not None:
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(codec.dumps({"fetched": time.time(), "items": items}))
+            os.replace(tmp, path)
+    return models.structure_accesses(items)
+
+
+class Preflight:
+    def __init__(
+        self,
+        accesses: Iterable[models.Access],
+        cache: Optional[NegativeCache] = None,
+        today: Optional[datetime.date] = None,
+    ):
+        self.accesses: dict[str, list[models.Access]] = {}
+        for access in accesses:
+            self.accesses.setdefault(access.pce, []).append(access)
+        self.cache = NegativeCache() if cache is None else cache
+        self.today = datetime.date.today() if today is None else today
+
+    def check(self, request: Request, now: Optional[float] = None) -> Decision:
+        """Return `request` trimmed to what may succeed, or why it is skipped"""
+        reason = self.cache.get(request.pce, now)
+        if reason is not None:
+            return Decision(request, reason)
+        accesses = self.accesses.get(request.pce, [])
+        reason = models.access_skip_reason(accesses, request.dataset)
+        if reason is not None:
+            return Decision(request, reason)
+        covering = [
+            access
+            for access in accesses
+            if access.is_active(log=False) and access.covers(request.dataset)
+        ]
+        today = self.today.isoformat()
+        if all(access.date_fin_droit_acces < today for access in covering):
+            end = max(access.date_fin_droit_acces for access in covering)
+            return Decision(request, f"access right expired on {end}")
+        if request.from_date is None or request.to_date is None:
+            return Decision(request)
+        return self._trim(request, covering)
+
+    def _trim(self, request: Request, covering: list[models.Access]) -> Decision:
+        assert request.from_date is not None and request.to_date is not None
+        start = datetime.date.fromisoformat(request.from_date)
+        end = datetime.date.fromisoformat(request.to_date)
+        # union of perimeters, unbounded when a bound is missing
+        periods = [access.data_period(request.dataset) for access in covering]
+        starts = [first for first, _ in periods]
+        ends = [last for _, last in periods]
+        if all(starts):
+            first = min(datetime.date.fromisoformat(s) for s in starts if s)
+            start = max(start, first)
+        if all(ends):
+            # perimeter end is included, requested end is not
+            last = max(datetime.date.fromisoformat(e) for e in ends if e)
+            end = min(end, last + datetime.timedelta(days=1))
+        if start >= end:
+            return Decision(request, "outside access perimeter dates")
+        start = max(start, history_start(self.today))
+        end = min(end, self.today)
+        if start >= end:
+            return Decision(request, "outside available history")
+        return Decision(
+            attrs.evolve(request, from_date=start.isoformat(), to_date=end.isoformat())
+        )
+
+    def filter(
+        self, requests: Iterable[Request], now: Optional[float] = None
+    ) -> tuple[list[Request], list[Decision]]:
+        """Return requests to send, trimmed, and decisions of skipped ones"""
+        kept, skipped = [], []
+        for request in requests:
+            decision = self.check(request, now)
+            if decision.skip is None:
+                kept.append(decision.request)
+            else:
+                skipped.append(decision)
+        return kept, skipped
+
+    def record_error(
+        self, pce: str, exc: requests.RequestException, now: Optional[float] = None
+    ) -> bool:
+        """Cache `exc` if it is a PCE level error, return True if so"""
+        if exc.response is None or exc.response.status_code not in PCE_ERROR_STATUSES:
+            return False
+        LOGGER.info("Skipping requests to %s for %ss: %s", pce, self.cache.ttl, exc)
+        self.cache.add(pce, str(exc), now)
+        return True
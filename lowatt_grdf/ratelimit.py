@@ -0,0 +1,134 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Request rate limiters, enforcing a minimal interval between requests."""
+
+import abc
+import contextlib
+import os
+import struct
+import threading
+import time
+from collections.abc import Iterator
+from typing import Optional
+
+
+class RateLimiter(metaclass=abc.ABCMeta):
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def acquire(self, block: bool = True) -> bool:
+        """Block until a request may be sent, and account for it
+
+        Without `block`, return False instead of waiting, True once accounted.
+        """
+        if not self._lock.acquire(block):
+            return False
+        try:
+            with self._locked_state(block) as locked:
+                if not locked:
+                    return False
+                now = time.time()
+                last = self._last()
+                if last is not None and now - last < self.interval:
+                    if not block:
+                        return False
+                    time.sleep(self.interval - (now - last))
+                    now = time.time()
+                self._set_last(now)
+                return True
+        finally:
+            self._lock.release()
+
+    @contextlib.contextmanager
+    def _locked_state(self, block: bool = True) -> Iterator[bool]:
+        """Hold exclusive access to state shared beyond this instance
+
+        Yield False if not held, without `block` and held by others.
+        """
+        yield True
+
+    @abc.abstractmethod
+    def _last(self) -> Optional[float]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def _set_last(self, timestamp: float) -> None:
+        raise NotImplementedError()
+
+
+class IntervalLimiter(RateLimiter):
+    """Rate limiter shared by threads of the current process"""
+
+    def __init__(self, interval: float = 1.0):
+        super().__init__(interval)
+        self._last_request: Optional[float] = None
+
+    def _last(self) -> Optional[float]:
+        return self._last_request
+
+    def _set_last(self, timestamp: float) -> None:
+        self._last_request = timestamp
+
+
+class FileRateLimiter(RateLimiter):
+    """Rate limiter shared by processes of the host through a locked file
+
+    Processes using the same `path` (e.g. one per credential) share the same
+    budget. Requires POSIX ``fcntl``.
+    """
+
+    _FORMAT = "d"
+
+    def __init__(self, path: str, interval: float = 1.0):
+        super().__init__(interval)
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @contextlib.contextmanager
+    def _locked_state(self, block: bool = True) -> Iterator[bool]:
+        import fcntl
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            self._fd = fd
+            yield True
+        finally:
+            self._fd = None
+            os.close(fd)
+
+    def _last(self) -> Optional[float]:
+        assert self._fd is not None
+        data = os.pread(self._fd, struct.calcsize(self._FORMAT), 0)
+        if len(data) != struct.calcsize(self._FORMAT):
+            return None
+        (last,) = struct.unpack(self._FORMAT, data)
+        assert isinstance(last, float)
+        return last
+
+    def _set_last(self, timestamp: float) -> None:
+        assert self._fd is not None
+        os.pwrite(self._fd, struct.pack(self._FORMAT, timestamp), 0)
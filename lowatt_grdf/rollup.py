@@ -0,0 +1,313 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Monthly, yearly and portfolio aggregates of consumption series.
+
+Aggregates are kept up to date as records are added to a
+:class:`lowatt_grdf.series.ConsumptionIndex`: records spanning several months
+(e.g. monthly or half-yearly readings) are split between them pro rata of
+their gas days, and added to the monthly buckets they overlap. When a record
+supersedes others, buckets they overlap are marked stale and computed again
+from the series when next read, as are yearly and portfolio aggregates over
+them.
+"""
+
+import datetime
+import math
+import os
+from collections.abc import Iterable, Iterator, Mapping
+from typing import Any, Optional
+
+import attrs
+
+from . import codec, columnar, gaps, series, store
+
+MEASURES = ("energie", "volume_brut", "volume_converti")
+ROLLUPS = "rollups.json"
+
+
+@attrs.frozen
+class Bucket:
+    energie: float = 0.0
+    volume_brut: float = 0.0
+    volume_converti: float = 0.0
+    # gas days covered by records
+    days: int = 0
+
+    def __neg__(self) -> "Bucket":
+        return Bucket(
+            -self.energie, -self.volume_brut, -self.volume_converti, -self.days
+        )
+
+    def __add__(self, other: "Bucket") -> "Bucket":
+        return Bucket(
+            self.energie + other.energie,
+            self.volume_brut + other.volume_brut,
+            self.volume_converti + other.volume_converti,
+            self.days + other.days,
+        )
+
+
+def next_month(day: datetime.date) -> datetime.date:
+    """Return first day of the month following `day`"""
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def month_days(start: datetime.date, end: datetime.date) -> Iterator[tuple[str, int]]:
+    """Yield months (YYYY-MM) overlapping ``[start, end)`` and their days in it"""
+    day = start
+    while day < end:
+        stop = min(end, next_month(day))
+        yield day.isoformat()[:7], (stop - day).days
+        day = stop
+
+
+def prorate(
+    total: Bucket, interval: gaps.Interval, start: datetime.date, end: datetime.date
+) -> dict[str, Bucket]:
+    """Return shares by month of `total` over `interval`, in ``[start, end)``"""
+    total_days = (interval[1] - interval[0]).days
+    return {
+        month: Bucket(
+            total.energie * days / total_days,
+            total.volume_brut * days / total_days,
+            total.volume_converti * days / total_days,
+            days,
+        )
+        for month, days in month_days(start, end)
+    }
+
+
+def split(
+    record: dict[str, Any], start: datetime.date, end: datetime.date
+) -> dict[str, Bucket]:
+    """Return shares by month of `record` over ``[start, end)`` of its period"""
+    conso = record.get("consommation") or {}
+    energie, volume_brut, volume_converti = (
+        float(conso.get(measure) or 0) for measure in MEASURES
+    )
+    total = Bucket(energie, volume_brut, volume_converti)
+    interval = gaps.record_interval(record)
+    assert interval is not None
+    return prorate(total, interval, start, end)
+
+
+def split_row(row: store.Row) -> dict[str, Bucket]:
+    """Return shares by month of a row of a columnar store"""
+    values = dict(zip(columnar.COLUMNS[1:], row))
+    start, end = (
+        datetime.datetime.fromtimestamp(values[name], datetime.timezone.utc).date()
+        for name in ("start", "end")
+    )
+    energie, volume_brut, volume_converti = (
+        0.0 if math.isnan(values[name]) else float(values[name]) for name in MEASURES
+    )
+    total = Bucket(energie, volume_brut, volume_converti)
+    return prorate(total, (start, end), start, end)
+
+
+class Aggregates:
+    """Yearly and portfolio aggregates of monthly ones
+
+    `portfolios` maps PCEs to the name of the portfolio they belong to.
+    """
+
+    def __init__(self, portfolios: Optional[Mapping[str, str]] = None):
+        self.portfolios = dict(portfolios or {})
+        # pce: {month: bucket}
+        self._monthly: dict[str, dict[str, Bucket]] = {}
+        # (pce, year): bucket
+        self._yearly: dict[tuple[str, str], Bucket] = {}
+        # (portfolio, month or year): bucket
+        self._portfolios: dict[tuple[str, str], Bucket] = {}
+
+    def _add(self, pce: str, shares: dict[str, Bucket]) -> None:
+        monthly = self._monthly.setdefault(pce, {})
+        for month, bucket in shares.items():
+            total = monthly.get(month, Bucket()) + bucket
+            if total.days:
+                monthly[month] = total
+            else:
+                monthly.pop(month, None)
+        self._invalidate(pce, shares)
+
+    def _invalidate(self, pce: str, months: Iterable[str]) -> None:
+        portfolio = self.portfolios.get(pce)
+        for month in months:
+            self._yearly.pop((pce, month[:4]), None)
+            if portfolio is not None:
+                self._portfolios.pop((portfolio, month), None)
+                self._portfolios.pop((portfolio, month[:4]), None)
+
+    def months(self, pce: str) -> list[str]:
+        """Return months (YYYY-MM) with consumption of `pce`"""
+        return sorted(self._monthly.get(pce, {}))
+
+    def monthly(self, pce: str, month: str) -> Bucket:
+        """Return aggregate of `pce` over `month` (YYYY-MM)"""
+        return self._monthly.get(pce, {}).get(month, Bucket())
+
+    def yearly(self, pce: str, year: str) -> Bucket:
+        """Return aggregate of `pce` over `year` (YYYY)"""
+        key = (pce, year)
+        if key not in self._yearly:
+            total = Bucket()
+            for month in range(1, 13):
+                total += self.monthly(pce, f"{year}-{month:02d}")
+            self._yearly[key] = total
+        return self._yearly[key]
+
+    def portfolio(self, name: str, period: str) -> Bucket:
+        """Return aggregate of PCEs of portfolio `name` over a year or month"""
+        key = (name, period)
+        if key not in self._portfolios:
+            total = Bucket()
+            for pce, portfolio in self.portfolios.items():
+                if portfolio == name:
+                    total += (
+                        self.yearly(pce, period)
+                        if len(period) == 4
+                        else self.monthly(pce, period)
+                    )
+            self._portfolios[key] = total
+        return self._portfolios[key]
+
+
+class Rollups(Aggregates):
+    """Aggregates of records added to `index`"""
+
+    def __init__(
+        self,
+        index: Optional[series.ConsumptionIndex] = None,
+        portfolios: Optional[Mapping[str, str]] = None,
+    ):
+        super().__init__(portfolios)
+        self.index = series.ConsumptionIndex() if index is None else index
+        # pce: months to compute again
+        self._stale: dict[str, set[str]] = {}
+        for pce, conso in self.index.series.items():
+            for item in conso:
+                self._add(pce, split(item.record, item.start, item.end))
+
+    def add(self, record: dict[str, Any], published: str = "") -> series.Change:
+        """Add `record` to the index, updating aggregates it changes"""
+        change = self.index.add(record, published)
+        if not change.accepted:
+            return change
+        pce = gaps.record_pce(record)
+        interval = gaps.record_interval(record)
+        assert interval is not None
+        shares = split(record, *interval)
+        if not change.superseded:
+            self._add(pce, shares)
+            return change
+        months = set(shares)
+        for item in change.superseded:
+            months.update(month for month, _ in month_days(item.start, item.end))
+        self._stale.setdefault(pce, set()).update(months)
+        self._invalidate(pce, months)
+        return change
+
+    def update(
+        self, records: Iterable[dict[str, Any]], published: str = ""
+    ) -> list[series.Change]:
+        """Add all `records` of a response, in order"""
+        return [self.add(record, published) for record in records]
+
+    def _add(self, pce: str, shares: dict[str, Bucket]) -> None:
+        stale = self._stale.get(pce, set())
+        super()._add(
+            pce,
+            {month: bucket for month, bucket in shares.items() if month not in stale},
+        )
+
+    def months(self, pce: str) -> list[str]:
+        """Return months (YYYY-MM) with consumption of `pce`"""
+        return sorted(set(self._monthly.get(pce, {})) | self._stale.get(pce, set()))
+
+    def monthly(self, pce: str, month: str) -> Bucket:
+        """Return aggregate of `pce` over `month` (YYYY-MM)"""
+        stale = self._stale.get(pce, set())
+        if month in stale:
+            stale.discard(month)
+            start = datetime.date.fromisoformat(f"{month}-01")
+            total = Bucket()
+            for item in self.index[pce].range(start, next_month(start)):
+                total += split(item.record, item.start, item.end)[month]
+            self._monthly.setdefault(pce, {})[month] = total
+        return self._monthly.get(pce, {}).get(month, Bucket())
+
+
+class StoreRollups(Aggregates):
+    """Aggregates of rows of columnar store `db`, saved in its directory
+
+    They are kept up to date by :meth:`update` from changes of the store, and
+    computed again from its rows when saved for another generation of it
+    (e.g. if an update of the store was interrupted).
+    """
+
+    def __init__(self, db: store.Store, portfolios: Optional[Mapping[str, str]] = None):
+        super().__init__(portfolios)
+        self.db = db
+        self.path = os.path.join(db.directory, ROLLUPS)
+        state = None
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                state = codec.loads(f.read())
+        if state is None or state["generation"] != db.generation:
+            self.rebuild()
+            return
+        self._monthly = {
+            pce: {month: Bucket(*values) for month, values in months.items()}
+            for pce, months in state["monthly"].items()
+        }
+
+    def rebuild(self) -> None:
+        """Compute aggregates again from all rows of the store"""
+        self._monthly, self._yearly, self._portfolios = {}, {}, {}
+        for pce, row in self.db.iter_rows():
+            self._add(pce, split_row(row))
+
+    def update(self, changes: Iterable[store.Change]) -> None:
+        """Update aggregates with `changes` returned by the store's append
+
+        Shares of rows removed, superseded by rows of other boundaries or
+        trimmed, are subtracted from the months they overlap.
+        """
+        for pce, removed, added in changes:
+            for row in removed:
+                shares = split_row(row)
+                self._add(pce, {month: -bucket for month, bucket in shares.items()})
+            for row in added:
+                self._add(pce, split_row(row))
+
+    def save(self) -> None:
+        """Save aggregates of the current generation of the store"""
+        state = {
+            "generation": self.db.generation,
+            "monthly": {
+                pce: {month: attrs.astuple(bucket) for month, bucket in months.items()}
+                for pce, months in self._monthly.items()
+            },
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(codec.dumps(state))
+        os.replace(tmp, self.path)
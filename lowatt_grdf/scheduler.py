@@ -0,0 +1,214 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Scheduling of PCE polls according to their publication frequency.
+
+Each PCE is polled when its next publication is expected: one period after
+the end of the last fetched data, plus a publication delay. Polls that return
+nothing new are retried with an exponential backoff bounded by the period.
+"""
+
+import datetime
+import heapq
+import os
+import statistics
+from collections.abc import Iterable
+from typing import Any, Optional
+
+import attrs
+
+from . import codec, gaps
+
+DAY = 86400
+# publication period, in days, of each meter frequency
+FREQUENCY_DAYS = {"JJ": 1, "MM": 30, "1M": 30, "6M": 182}
+
+
+def meter_frequency(donnees_techniques: Any) -> Optional[str]:
+    """Return the meter frequency (JJ, MM, 1M or 6M) from donnees_techniques"""
+    try:
+        frequence: str = donnees_techniques["donnees_techniques"][
+            "caracteristiques_compteur"
+        ]["frequence"]
+    except (KeyError, TypeError):
+        return None
+    return frequence if frequence in FREQUENCY_DAYS else None
+
+
+def infer_frequency(records: Iterable[dict[str, Any]]) -> Optional[str]:
+    """Guess the meter frequency from the span of published records"""
+    spans = []
+    for record in records:
+        interval = gaps.record_interval(record)
+        if interval is not None:
+            spans.append((interval[1] - interval[0]).days)
+    if not spans:
+        return None
+    span = statistics.median(spans)
+    if span <= 1:
+        return "JJ"
+    if span <= 45:
+        return "1M"
+    return "6M"
+
+
+@attrs.define
+class Entry:
+    pce: str
+    last_date: str
+    next_poll: float = 0.0
+    frequency: Optional[str] = None
+    misses: int = 0
+
+    @property
+    def period(self) -> int:
+        return FREQUENCY_DAYS.get(self.frequency or "JJ", 1) * DAY
+
+
+@attrs.define
+class Budget:
+    day: str = ""
+    used: int = 0
+
+
+class Scheduler:
+    """Priority queue of PCEs by next expected publication, stored at `path`"""
+
+    def __init__(
+        self,
+        path: str,
+        max_requests_per_day: int = 1000,
+        publication_delay: float = DAY,
+    ):
+        self.path = path
+        self.max_requests_per_day = max_requests_per_day
+        self.publication_delay = publication_delay
+        self.entries: dict[str, Entry] = {}
+        self.budget = Budget()
+        # position of the sink after records of polls done, if supported
+        self.sink_position: Any = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = codec.loads(f.read())
+            self.entries = {
+                pce: Entry(**entry) for pce, entry in state["entries"].items()
+            }
+            self.budget = Budget(**state["budget"])
+            self.sink_position = state.get("sink_position")
+        self._heap = [(entry.next_poll, pce) for pce, entry in self.entries.items()]
+        heapq.heapify(self._heap)
+
+    def __contains__(self, pce: str) -> bool:
+        return pce in self.entries
+
+    def add(
+        self, pce: str, since: str, frequency: Optional[str] = None, now: float = 0.0
+    ) -> None:
+        """Register `pce`, to be fetched from `since`, polled at `now`"""
+        self.entries[pce] = Entry(pce, since, now, frequency)
+        heapq.heappush(self._heap, (now, pce))
+
+    def remaining(self, now: float) -> int:
+        day = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).date()
+        if self.budget.day != day.isoformat():
+            self.budget = Budget(day.isoformat())
+        return max(self.max_requests_per_day - self.budget.used, 0)
+
+    def consume(self, now: float, count: int = 1) -> None:
+        self.remaining(now)
+        self.budget.used += count
+
+    def due(self, now: float, to_date: str) -> list[Entry]:
+        """Pop entries due at `now`, within the remaining daily budget
+
+        Entries with data up to `to_date`, polled without request, don't
+        count against the budget.
+        """
+        entries: list[Entry] = []
+        limit = self.remaining(now)
+        while self._heap and self._heap[0][0] <= now:
+            next_poll, pce = self._heap[0]
+            entry = self.entries.get(pce)
+            # skip stale heap items left by rescheduling
+            if entry is not None and entry.next_poll == next_poll:
+                if entry.last_date < to_date:
+                    if not limit:
+                        break
+                    limit -= 1
+                entries.append(entry)
+            heapq.heappop(self._heap)
+        return entries
+
+    def next_poll(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    def wakeup(self, now: float) -> Optional[float]:
+        """Return when polls are next due, None if there is no PCE
+
+        Once the daily budget is exhausted, polls wait for its renewal, at
+        midnight UTC.
+        """
+        next_poll = self.next_poll()
+        if next_poll is None or self.remaining(now):
+            return next_poll
+        day = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).date()
+        renewal = datetime.datetime.combine(
+            day + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc
+        )
+        return max(next_poll, renewal.timestamp())
+
+    def done(self, entry: Entry, records: list[dict[str, Any]], now: float) -> None:
+        """Reschedule `entry` after a poll at `now` which returned `records`"""
+        if entry.frequency is None:
+            entry.frequency = infer_frequency(records)
+        ends = [
+            interval[1]
+            for interval in map(gaps.record_interval, records)
+            if interval is not None
+        ]
+        last = datetime.date.fromisoformat(entry.last_date)
+        if ends and max(ends) > last:
+            last = max(ends)
+            entry.last_date = last.isoformat()
+            entry.misses = 0
+            last_ts = datetime.datetime.combine(
+                last, datetime.time(), datetime.timezone.utc
+            ).timestamp()
+            entry.next_poll = max(
+                last_ts + entry.period + self.publication_delay, now + DAY / 24
+            )
+        else:
+            retry = max(entry.period / 8, DAY / 4) * 2**entry.misses
+            entry.misses += 1
+            entry.next_poll = now + min(retry, entry.period)
+        heapq.heappush(self._heap, (entry.next_poll, entry.pce))
+
+    def save(self) -> None:
+        state = {
+            "entries": {
+                pce: attrs.asdict(entry) for pce, entry in self.entries.items()
+            },
+            "budget": attrs.asdict(self.budget),
+            "sink_position": self.sink_position,
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(codec.dumps(state))
+        os.replace(tmp, self.path)
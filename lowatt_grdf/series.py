@@ -0,0 +1,173 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Consumption series merging records fetched by successive runs.
+
+A series holds non-overlapping records of a PCE sorted by their gas days (see
+:func:`lowatt_grdf.gaps.record_interval`). A record overlapping others
+supersedes them only if its version is at least as good as each of theirs,
+versions being compared on, in this order:
+
+1. consumption status, ``Définitive`` over ``Provisoire``,
+2. reading quality, measures over estimates (see
+   :func:`lowatt_grdf.gaps.is_low_quality`),
+3. publication date, as given when adding records (e.g. the fetch date),
+   latest first; records of equal versions are superseded by the last added.
+
+Otherwise the record is discarded. Superseded records only partially
+overlapping the new one keep the parts of their period it doesn't cover.
+
+Overlapping records are located by bisection, in O(log n) comparisons, while
+replacing them shifts the following items of the series, in O(n) (a single
+move of pointers per list).
+"""
+
+import bisect
+import datetime
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+import attrs
+
+from . import gaps
+
+Version = tuple[bool, bool, str]
+
+
+def record_version(record: dict[str, Any], published: str = "") -> Version:
+    conso = record.get("consommation") or {}
+    return (
+        conso.get("statut_conso") == "Définitive",
+        not gaps.is_low_quality(record),
+        published,
+    )
+
+
+@attrs.frozen
+class Item:
+    """Part ``[start, end)`` of the period of `record` held by a series"""
+
+    start: datetime.date
+    end: datetime.date
+    version: Version
+    record: dict[str, Any]
+
+
+@attrs.frozen
+class Change:
+    """Outcome of adding a record to a series"""
+
+    accepted: bool
+    superseded: tuple[Item, ...] = ()
+
+
+class ConsumptionSeries:
+    def __init__(self) -> None:
+        # sorted and non-overlapping, so that ends are sorted too
+        self._starts: list[datetime.date] = []
+        self._ends: list[datetime.date] = []
+        self._items: list[Item] = []
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[Item]:
+        return iter(self._items)
+
+    def _overlapping(self, start: datetime.date, end: datetime.date) -> range:
+        """Return indexes of items overlapping ``[start, end)``"""
+        first = bisect.bisect_right(self._ends, start)
+        last = bisect.bisect_left(self._starts, end, lo=first)
+        return range(first, last)
+
+    def add(self, record: dict[str, Any], published: str = "") -> Change:
+        """Add `record` published at `published`, unless superseded
+
+        Records without consumption period are discarded.
+        """
+        interval = gaps.record_interval(record)
+        if interval is None or interval[0] >= interval[1]:
+            return Change(False)
+        start, end = interval
+        item = Item(start, end, record_version(record, published), record)
+        overlapping = self._overlapping(start, end)
+        superseded = tuple(self._items[i] for i in overlapping)
+        if any(other.version > item.version for other in superseded):
+            return Change(False)
+        items = [item]
+        if superseded and superseded[0].start < start:
+            items.insert(0, attrs.evolve(superseded[0], end=start))
+        if superseded and superseded[-1].end > end:
+            items.append(attrs.evolve(superseded[-1], start=end))
+        i = overlapping.start
+        self._starts[i : overlapping.stop] = [item.start for item in items]
+        self._ends[i : overlapping.stop] = [item.end for item in items]
+        self._items[i : overlapping.stop] = items
+        return Change(True, superseded)
+
+    def update(
+        self, records: Iterable[dict[str, Any]], published: str = ""
+    ) -> list[Change]:
+        """Add all `records` of a response, in order"""
+        return [self.add(record, published) for record in records]
+
+    def range(self, from_date: datetime.date, to_date: datetime.date) -> list[Item]:
+        """Return items overlapping ``[from_date, to_date)``"""
+        return [self._items[i] for i in self._overlapping(from_date, to_date)]
+
+    def covered(self) -> list[gaps.Interval]:
+        """Return merged periods covered by the series"""
+        return gaps.merge(zip(self._starts, self._ends))
+
+    def records(self) -> list[dict[str, Any]]:
+        """Return records of the series, once if partially superseded"""
+        records = {id(item.record): item.record for item in self._items}
+        return list(records.values())
+
+
+class ConsumptionIndex:
+    """Consumption series of several PCEs"""
+
+    def __init__(self) -> None:
+        self.series: dict[str, ConsumptionSeries] = {}
+
+    def __getitem__(self, pce: str) -> ConsumptionSeries:
+        return self.series[pce]
+
+    def __contains__(self, pce: str) -> bool:
+        return pce in self.series
+
+    def add(self, record: dict[str, Any], published: str = "") -> Change:
+        pce = gaps.record_pce(record)
+        series = self.series.get(pce)
+        if series is None:
+            series = self.series[pce] = ConsumptionSeries()
+        return series.add(record, published)
+
+    def update(
+        self, records: Iterable[dict[str, Any]], published: str = ""
+    ) -> list[Change]:
+        """Add all `records` of a response, in order"""
+        return [self.add(record, published) for record in records]
+
+    def records(self) -> Iterator[dict[str, Any]]:
+        """Yield records of all PCEs, sorted by PCE and period"""
+        for pce in sorted(self.series):
+            yield from self.series[pce].records()
@@ -0,0 +1,299 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Batched writers of fetched records to storage.
+
+Records are buffered and written by batches of about `batch_size` records,
+or when a unit of work is added more than `max_delay` seconds after the
+previous flush. There is no timer: a sink receiving no record holds buffered
+ones until :meth:`Sink.poll` is called, which processing loops do between
+units of work. Records of a unit of work (e.g. a job's records) are added at
+once by :meth:`Sink.extend`, and flushed in the same batch, along with a
+callback running once they are stored, so that work is acknowledged only
+when its result is stored.
+
+Sinks are opened from a ``KIND:PATH`` specification (see :func:`open_sink`):
+
+* ``sqlite:PATH``, rows of flattened records inserted in a single
+  transaction per batch, in table ``records`` of database at PATH,
+* ``ndjson.gz:DIR``, one gzip member per batch, appended to files of DIR
+  rotated once they exceed `max_bytes`,
+* ``json:PATH``, ``ndjson:PATH``, ``csv:PATH`` or ``parquet:PATH``, through
+  the writers of :mod:`lowatt_grdf.output`, a Parquet row group being written
+  per batch.
+"""
+
+import abc
+import contextlib
+import gzip
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+from typing import Any, Callable, Literal, Optional, TypeVar, get_args
+
+from . import codec, output
+
+Kind = Literal["sqlite", "ndjson.gz", "json", "ndjson", "csv", "parquet"]
+KINDS: tuple[Kind, ...] = get_args(Kind)
+BATCH_SIZE = 1000
+MAX_DELAY = 5.0
+
+_S = TypeVar("_S", bound="Sink")
+
+
+class Sink(metaclass=abc.ABCMeta):
+    def __init__(self, batch_size: int = BATCH_SIZE, max_delay: float = MAX_DELAY):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._records: list[Any] = []
+        self._callbacks: list[Callable[[], Any]] = []
+        self._flushed = time.monotonic()
+        # called after each flush, once callbacks of units ran
+        self.flush_hooks: list[Callable[[], Any]] = []
+
+    def write(self, record: Any) -> None:
+        self._records.append(record)
+        if len(self._records) >= self.batch_size:
+            self.flush()
+
+    def extend(
+        self, records: Iterable[Any], callback: Optional[Callable[[], Any]] = None
+    ) -> None:
+        """Add `records` of a unit of work, `callback` running once flushed"""
+        self._records.extend(records)
+        if callback is not None:
+            self._callbacks.append(callback)
+        if len(self._records) >= self.batch_size:
+            self.flush()
+        else:
+            self.poll()
+
+    def poll(self) -> None:
+        """Flush if buffered work was flushed more than `max_delay` ago"""
+        if (self._records or self._callbacks) and (
+            time.monotonic() - self._flushed >= self.max_delay
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._records:
+            self._write_batch(self._records)
+            self._records = []
+        self._flushed = time.monotonic()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks + self.flush_hooks:
+            callback()
+
+    def position(self) -> Any:
+        """Return position after flushed records, None if not supported
+
+        Positions are JSON serializable, to be stored in checkpoints.
+        """
+        return None
+
+    def truncate(self, position: Any) -> None:
+        """Remove records flushed after `position`"""
+        raise NotImplementedError(f"{type(self).__name__} can't be truncated")
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self: _S) -> _S:
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    @abc.abstractmethod
+    def _write_batch(self, records: list[Any]) -> None:
+        raise NotImplementedError()
+
+
+class SQLiteSink(Sink):
+    """Insert flattened records as rows of `table`
+
+    Columns are added as records with new keys come, lists and dictionaries
+    are stored as JSON.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str = "records",
+        batch_size: int = BATCH_SIZE,
+        max_delay: float = MAX_DELAY,
+    ):
+        super().__init__(batch_size, max_delay)
+        self.table = table
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute(
+            f'CREATE TABLE IF NOT EXISTS "{table}" (_rowid INTEGER PRIMARY KEY)'
+        )
+        self.columns = [
+            row[1]
+            for row in self.db.execute(f'PRAGMA table_info("{table}")')
+            if row[1] != "_rowid"
+        ]
+
+    def _write_batch(self, records: list[Any]) -> None:
+        rows = [output.flatten(record) for record in records]
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for row in rows:
+                for name in row:
+                    if name not in self.columns:
+                        self.db.execute(
+                            f'ALTER TABLE "{self.table}" ADD COLUMN "{name}"'
+                        )
+                        self.columns.append(name)
+            names = ", ".join(f'"{name}"' for name in self.columns)
+            marks = ", ".join("?" * len(self.columns))
+            self.db.executemany(
+                f'INSERT INTO "{self.table}" ({names}) VALUES ({marks})',
+                (
+                    [
+                        codec.dumps(value) if isinstance(value, (list, dict)) else value
+                        for value in map(row.get, self.columns)
+                    ]
+                    for row in rows
+                ),
+            )
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def position(self) -> int:
+        (rowid,) = self.db.execute(
+            f'SELECT COALESCE(MAX(_rowid), 0) FROM "{self.table}"'
+        ).fetchone()
+        return int(rowid)
+
+    def truncate(self, position: int) -> None:
+        self.db.execute(f'DELETE FROM "{self.table}" WHERE _rowid > ?', (position,))
+
+    def close(self) -> None:
+        super().close()
+        self.db.close()
+
+
+class NdjsonGzSink(Sink):
+    """Append batches of records to gzip compressed ndjson files of `directory`
+
+    Files are named after their sequence number, e.g. ``000001.ndjson.gz``,
+    and a new one is started when the current one exceeds `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        batch_size: int = BATCH_SIZE,
+        max_delay: float = MAX_DELAY,
+    ):
+        super().__init__(batch_size, max_delay)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        numbers = [
+            int(name.split(".")[0])
+            for name in os.listdir(directory)
+            if name.endswith(".ndjson.gz") and name.split(".")[0].isdigit()
+        ]
+        self.number = max(numbers, default=1)
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"{self.number:06d}.ndjson.gz")
+
+    def _write_batch(self, records: list[Any]) -> None:
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            self.number += 1
+        data = b"".join(codec.dumps(record).encode() + b"\n" for record in records)
+        # concatenated gzip members are read as a single stream
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(data))
+
+    def position(self) -> tuple[int, int]:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return (self.number, size)
+
+    def truncate(self, position: tuple[int, int]) -> None:
+        number, size = position
+        for name in os.listdir(self.directory):
+            stem = name.split(".")[0]
+            if name.endswith(".ndjson.gz") and stem.isdigit() and int(stem) > number:
+                os.remove(os.path.join(self.directory, name))
+        self.number = number
+        if os.path.exists(self.path):
+            os.truncate(self.path, size)
+
+
+class WriterSink(Sink):
+    """Write records in `fmt` to file at `path`, or to stdout if unset or '-'
+
+    See :func:`lowatt_grdf.output.open_writer` for `spool`: spooled records
+    are written once closed, not when flushed.
+    """
+
+    def __init__(
+        self,
+        fmt: output.Format,
+        path: Optional[str] = None,
+        batch_size: int = BATCH_SIZE,
+        max_delay: float = MAX_DELAY,
+        spool: bool = False,
+    ):
+        super().__init__(batch_size, max_delay)
+        self._exit_stack = contextlib.ExitStack()
+        self.writer = self._exit_stack.enter_context(
+            output.open_writer(fmt, path, spool)
+        )
+        if isinstance(self.writer, output.ParquetWriter):
+            # flushed by batches
+            self.writer.row_group_size = batch_size + 1
+
+    def _write_batch(self, records: list[Any]) -> None:
+        for record in records:
+            self.writer.write(record)
+        self.writer.flush()
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self._exit_stack.close()
+
+
+def open_sink(
+    spec: str, batch_size: int = BATCH_SIZE, max_delay: float = MAX_DELAY
+) -> Sink:
+    """Return sink of a ``KIND:PATH`` specification"""
+    kind, sep, path = spec.partition(":")
+    if not sep or not path or kind not in KINDS:
+        raise ValueError(
+            f"Invalid sink {spec!r}, expected KIND:PATH with KIND in {', '.join(KINDS)}"
+        )
+    if kind == "sqlite":
+        return SQLiteSink(path, batch_size=batch_size, max_delay=max_delay)
+    if kind == "ndjson.gz":
+        return NdjsonGzSink(path, batch_size=batch_size, max_delay=max_delay)
+    return WriterSink(kind, path, batch_size, max_delay)
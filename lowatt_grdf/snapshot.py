@@ -0,0 +1,113 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Local snapshot of access rights, to report only what changed between polls."""
+
+import os
+from collections.abc import Iterable
+from typing import Any, Callable, Literal, Optional
+
+from . import codec
+
+EventType = Literal["new", "changed", "removed"]
+WATCHED_FIELDS = ("id_pce", "etat_droit_acces", "statut_controle_preuve")
+
+
+def access_items(resp: Any) -> list[dict[str, Any]]:
+    """Return access records from a droits_acces response, without statuses"""
+    # XXX: this looks like a bug, "liste_acces" should be part of the response
+    items = resp[0]["liste_acces"] if resp and "liste_acces" in resp[0] else resp
+    return [item for item in items if "code_statut_traitement" not in item]
+
+
+class AccessSnapshot:
+    """Watched fields of accesses keyed by ``id_droit_acces``
+
+    State is stored as JSON at `path`, written atomically by :meth:`save`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.accesses: dict[str, dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.accesses = codec.loads(f.read())
+
+    def diff(self, items: Iterable[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Return events turning the snapshot into `items`, without applying them"""
+        events: list[dict[str, Any]] = []
+        seen = set()
+        for item in items:
+            key = item["id_droit_acces"]
+            seen.add(key)
+            state = {field: item.get(field) for field in WATCHED_FIELDS}
+            previous = self.accesses.get(key)
+            if previous is None:
+                events.append(self._event("new", key, state, access=item))
+            elif previous != state:
+                changes = {
+                    field: {"old": previous.get(field), "new": state[field]}
+                    for field in WATCHED_FIELDS
+                    if previous.get(field) != state[field]
+                }
+                events.append(self._event("changed", key, state, changes=changes))
+        for key, previous in self.accesses.items():
+            if key not in seen:
+                events.append(self._event("removed", key, previous))
+        return events
+
+    def apply(self, events: Iterable[dict[str, Any]]) -> None:
+        for event in events:
+            key = event["id_droit_acces"]
+            if event["event"] == "removed":
+                del self.accesses[key]
+            else:
+                self.accesses[key] = event["state"]
+
+    def update(
+        self,
+        items: Iterable[dict[str, Any]],
+        emit: Optional[Callable[[list[dict[str, Any]]], None]] = None,
+    ) -> list[dict[str, Any]]:
+        """Diff `items` against the snapshot, apply and save, return events
+
+        `emit` is called with events before they are applied, e.g. to write
+        them: should it fail, the snapshot is left as is and the next update
+        reports them again.
+        """
+        events = self.diff(items)
+        if events:
+            if emit is not None:
+                emit(events)
+            self.apply(events)
+            self.save()
+        return events
+
+    def save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(codec.dumps(self.accesses))
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _event(
+        event: EventType, key: str, state: dict[str, Any], **extra: Any
+    ) -> dict[str, Any]:
+        return {"event": event, "id_droit_acces": key, "state": state, **extra}
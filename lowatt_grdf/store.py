@@ -0,0 +1,488 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""On-disk columnar store of consumption or injection series.
+
+Each column of :mod:`lowatt_grdf.columnar` but ``pce`` is stored in its own
+file of native int64 or float64 values, read through memory mapping. Rows
+are sorted by PCE then start, and an index maps each PCE to its rows, so
+that queries read only the values they need and never decode JSON.
+
+Rows of a PCE never overlap: a row supersedes those it overlaps following
+the rules of :mod:`lowatt_grdf.series`. Each update writes the rows of each
+PCE over the span it changed to a new segment directory, replacing rows of
+older segments starting in this span. The ``CURRENT`` file, listing segments of the current generation,
+is replaced last: readers see either the previous or the new data. Segments
+are merged once there are too many of them, merged segments being removed by
+the following update only, so that readers having opened them may still read
+them meanwhile.
+"""
+
+import array
+import bisect
+import datetime
+import math
+import mmap
+import os
+import shutil
+from collections.abc import Iterable, Iterator, Mapping
+from typing import Any, Literal, Optional, Union, get_args
+
+from . import codec, columnar
+
+CURRENT = "CURRENT"
+INDEX = "index.json"
+MAX_SEGMENTS = 8
+Aggregate = Literal["sum", "mean", "min", "max", "first", "last", "count"]
+AGGREGATES: tuple[Aggregate, ...] = get_args(Aggregate)
+GroupBy = Literal["pce", "month", "year"]
+GROUP_BY: tuple[GroupBy, ...] = get_args(GroupBy)
+
+Value = Union[int, float]
+# values of columns but pce
+Row = tuple[Value, ...]
+# PCE, rows removed, rows added
+Change = tuple[str, tuple[Row, ...], tuple[Row, ...]]
+# start and end timestamps
+Span = tuple[int, int]
+MEASURES = ("energie", "volume_brut", "volume_converti")
+
+
+def typecode(column: str) -> Literal["q", "d"]:
+    return "q" if column in columnar.INT_COLUMNS else "d"
+
+
+def period_key(timestamp: int, by: GroupBy) -> str:
+    """Return month or year of the gas day starting at `timestamp`
+
+    Gas days start at 6:00 in France, during the same UTC day.
+    """
+    day = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).date()
+    return day.isoformat()[:7] if by == "month" else day.isoformat()[:4]
+
+
+def aggregate(values: Iterable[Value], func: Aggregate) -> Optional[Value]:
+    """Aggregate `values`, ignoring NaN"""
+    items = [v for v in values if not (isinstance(v, float) and math.isnan(v))]
+    if func == "count":
+        return len(items)
+    if not items:
+        return None
+    if func == "sum":
+        return sum(items)
+    if func == "mean":
+        return sum(items) / len(items)
+    if func == "min":
+        return min(items)
+    if func == "max":
+        return max(items)
+    if func == "first":
+        return items[0]
+    return items[-1]
+
+
+class Segment:
+    """Rows written by an update of a store, in `directory`, never modified"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        with open(os.path.join(directory, INDEX), "rb") as f:
+            index = codec.loads(f.read())
+        # pce: (first row, number of rows)
+        self.index: dict[str, tuple[int, int]] = {
+            pce: (first, count) for pce, (first, count, _, _) in index.items()
+        }
+        # pce: span where rows of the segment replace those of older ones
+        self.spans: dict[str, Span] = {
+            pce: (lo, hi) for pce, (_, _, lo, hi) in index.items()
+        }
+        self._maps: list[mmap.mmap] = []
+        self.views: dict[str, memoryview[Any]] = {}
+        if not len(self):
+            return
+        for column in columnar.COLUMNS[1:]:
+            with open(os.path.join(directory, f"{column}.bin"), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps.append(mapped)
+            self.views[column] = memoryview(mapped).cast(typecode(column))
+
+    def __len__(self) -> int:
+        return sum(count for _, count in self.index.values())
+
+    def close(self) -> None:
+        for view in self.views.values():
+            view.release()
+        for mapped in self._maps:
+            mapped.close()
+        self.views, self._maps = {}, []
+
+    def rows(
+        self, pce: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> range:
+        """Return rows of `pce` starting in ``[start, end)`` timestamps"""
+        first, count = self.index.get(pce, (0, 0))
+        lo, hi = first, first + count
+        if count and start is not None:
+            lo = bisect.bisect_left(self.views["start"], start, lo, hi)
+        if count and end is not None:
+            hi = bisect.bisect_left(self.views["start"], end, lo, hi)
+        return range(lo, hi)
+
+    @staticmethod
+    def write(
+        directory: str,
+        rows: Iterable[tuple[str, Row]],
+        spans: Optional[Mapping[str, Span]] = None,
+    ) -> None:
+        """Write `rows` of PCEs, sorted by PCE and start, to `directory`
+
+        `spans` default to those of the rows of each PCE.
+        """
+        names = columnar.COLUMNS[1:]
+        index: dict[str, list[int]] = {}
+        data: dict[str, array.array[Any]] = {
+            name: array.array(typecode(name)) for name in names
+        }
+        for i, (pce, row) in enumerate(rows):
+            first, count, lo, _ = index.get(pce, (i, 0, int(row[0]), 0))
+            index[pce] = [first, count + 1, lo, int(row[0]) + 1]
+            for name, value in zip(names, row):
+                data[name].append(value)
+        for pce, (lo, hi) in (spans or {}).items():
+            index[pce] = [*index.get(pce, [0, 0])[:2], lo, hi]
+        # leftover of an interrupted update
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        for name in names:
+            with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+                data[name].tofile(f)
+        with open(os.path.join(directory, INDEX), "w", encoding="utf-8") as f:
+            f.write(codec.dumps(index))
+
+
+# rows of a PCE, as runs of consecutive rows of a segment
+Runs = list[tuple[Segment, range]]
+
+
+class Store:
+    """Columnar store in `directory`, created if missing
+
+    Segments are merged in a single one when there are more than
+    `max_segments` of them.
+    """
+
+    def __init__(self, directory: str, max_segments: int = MAX_SEGMENTS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_segments = max_segments
+        self.generation = 0
+        # oldest first, rows of a segment replacing those of older ones
+        self.segments: list[Segment] = []
+        # segments left out by the last update, removed by the next one
+        self.obsolete: list[str] = []
+        self._count = 0
+        self._open()
+
+    def _open(self) -> None:
+        path = os.path.join(self.directory, CURRENT)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            state = codec.loads(f.read())
+        self.generation = state["generation"]
+        self.obsolete = state["obsolete"]
+        self._count = state["rows"]
+        self.segments = [
+            Segment(os.path.join(self.directory, name)) for name in state["segments"]
+        ]
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    def __enter__(self) -> "Store":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def pces(self) -> list[str]:
+        return sorted(set().union(*(segment.index for segment in self.segments)))
+
+    def runs(
+        self, pce: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Runs:
+        """Return rows of `pce` starting in ``[start, end)`` timestamps, by start"""
+        parts = [
+            (segment, segment.rows(pce, start, end))
+            for segment in self.segments
+            if _intersects(segment.spans.get(pce), start, end)
+        ]
+        if len(parts) <= 1:
+            return [(segment, rows) for segment, rows in parts if rows]
+        visible: dict[int, tuple[Segment, int]] = {}
+        for segment, rows in parts:
+            lo, hi = segment.spans[pce]
+            for key in [key for key in visible if lo <= key < hi]:
+                del visible[key]
+            for row in rows:
+                visible[segment.views["start"][row]] = (segment, row)
+        runs: Runs = []
+        for key in sorted(visible):
+            segment, row = visible[key]
+            if runs and runs[-1][0] is segment and runs[-1][1].stop == row:
+                runs[-1] = (segment, range(runs[-1][1].start, row + 1))
+            else:
+                runs.append((segment, range(row, row + 1)))
+        return runs
+
+    def column(self, name: str) -> list[Value]:
+        """Return all values of column `name`, sorted by PCE and start"""
+        return self.select(columns=[name])[name]
+
+    def select(
+        self,
+        pces: Optional[Iterable[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        columns: Iterable[str] = columnar.COLUMNS,
+    ) -> columnar.Columns:
+        """Return `columns` of rows of `pces` (all by default) in a period"""
+        names = list(columns)
+        result: columnar.Columns = {name: [] for name in names}
+        for pce in self.pces() if pces is None else pces:
+            for segment, rows in self.runs(pce, start, end):
+                for name in names:
+                    if name == "pce":
+                        result[name].extend([pce] * len(rows))
+                    else:
+                        result[name].extend(segment.views[name][rows.start : rows.stop])
+        return result
+
+    def aggregate(
+        self,
+        columns: Iterable[str],
+        func: Aggregate = "sum",
+        by: Iterable[GroupBy] = ("pce",),
+        pces: Optional[Iterable[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> list[dict[str, Any]]:
+        """Return `func` of `columns` values grouped `by` PCE, month or year
+
+        For instance, ``aggregate(["energie"], "sum", ["pce", "month"])`` or
+        ``aggregate(["index_fin"], "last")``.
+        """
+        names, keys = list(columns), list(by)
+        groups: dict[tuple[str, ...], list[tuple[Segment, int]]] = {}
+        for pce in self.pces() if pces is None else pces:
+            for segment, rows in self.runs(pce, start, end):
+                starts = segment.views["start"]
+                for row in rows:
+                    key = tuple(
+                        pce if k == "pce" else period_key(starts[row], k) for k in keys
+                    )
+                    groups.setdefault(key, []).append((segment, row))
+        return [
+            {
+                **dict(zip(keys, key)),
+                **{
+                    name: aggregate(
+                        (segment.views[name][row] for segment, row in rows), func
+                    )
+                    for name in names
+                },
+            }
+            for key, rows in sorted(groups.items())
+        ]
+
+    def append(self, columns: columnar.Columns) -> list[Change]:
+        """Add rows of `columns`, in order, superseding rows they overlap
+
+        A row is discarded if a row it overlaps is definitive and it isn't,
+        or is a measure and it is an estimate. Otherwise rows it overlaps are
+        removed, keeping the parts of their period it doesn't cover, with
+        measures pro rata of their duration. Rows of each PCE over the span
+        they change are written to a new segment. Return rows removed and
+        added by each row.
+        """
+        by_pce: dict[str, list[Row]] = {}
+        for values in zip(*(columns[name] for name in columnar.COLUMNS)):
+            if values[1] < values[2]:
+                by_pce.setdefault(values[0], []).append(tuple(values[1:]))
+        changes: list[Change] = []
+        # pce: span and rows replacing those of the store starting in it
+        updates: dict[str, tuple[Span, list[Row]]] = {}
+        for pce, new in by_pce.items():
+            first = min(int(row[0]) for row in new)
+            last = max(int(row[1]) for row in new)
+            lo = self._window_start(pce, first)
+            window = _Window(
+                [row for _, row in self._iter_runs(pce, self.runs(pce, lo, last))]
+            )
+            count = len(changes)
+            for row in new:
+                change = window.add(row)
+                if change is not None:
+                    changes.append((pce, *change))
+            if len(changes) > count:
+                rows = window.rows
+                updates[pce] = ((lo, max(last, int(rows[-1][0]) + 1)), rows)
+        if not changes:
+            return []
+        generation = self.generation + 1
+        Segment.write(
+            os.path.join(self.directory, str(generation)),
+            ((pce, row) for pce in sorted(updates) for row in updates[pce][1]),
+            {pce: span for pce, (span, _) in updates.items()},
+        )
+        count = self._count + sum(
+            len(added) - len(removed) for _, removed, added in changes
+        )
+        segments = [segment.name for segment in self.segments]
+        self._commit(generation, [*segments, str(generation)], [], count)
+        if len(self.segments) > self.max_segments:
+            self.compact()
+        return changes
+
+    def compact(self) -> None:
+        """Merge segments in a new one
+
+        Merged segments are removed by the next update, so that readers which
+        opened them in the meantime may still read them.
+        """
+        if len(self.segments) <= 1:
+            return
+        generation = self.generation + 1
+        Segment.write(os.path.join(self.directory, str(generation)), self.iter_rows())
+        obsolete = [segment.name for segment in self.segments]
+        self._commit(generation, [str(generation)], obsolete, self._count)
+
+    def _commit(
+        self, generation: int, segments: list[str], obsolete: list[str], rows: int
+    ) -> None:
+        state = {
+            "generation": generation,
+            "segments": segments,
+            "obsolete": obsolete,
+            "rows": rows,
+        }
+        tmp = os.path.join(self.directory, f"{CURRENT}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(codec.dumps(state))
+        os.replace(tmp, os.path.join(self.directory, CURRENT))
+        for name in self.obsolete:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+        self.close()
+        self._open()
+
+    def _window_start(self, pce: str, start: int) -> int:
+        """Return a timestamp such that rows of `pce` starting before it end
+        by `start`
+
+        Rows of a segment don't overlap: those preceding its last row
+        starting before `start` end by the start of this row.
+        """
+        lo = start
+        for segment in self.segments:
+            rows = segment.rows(pce, None, start)
+            if rows:
+                lo = min(lo, segment.views["start"][rows.stop - 1])
+        return lo
+
+    def iter_rows(self) -> Iterator[tuple[str, Row]]:
+        """Yield PCE and values of all rows, sorted by PCE and start"""
+        for pce in self.pces():
+            yield from self._iter_runs(pce, self.runs(pce))
+
+    @staticmethod
+    def _iter_runs(pce: str, runs: Runs) -> Iterator[tuple[str, Row]]:
+        names = columnar.COLUMNS[1:]
+        for segment, rows in runs:
+            for row in rows:
+                yield pce, tuple(segment.views[name][row] for name in names)
+
+
+def _intersects(span: Optional[Span], start: Optional[int], end: Optional[int]) -> bool:
+    """Return whether `span` is set and overlaps ``[start, end)``"""
+    return (
+        span is not None
+        and (start is None or span[1] > start)
+        and (end is None or span[0] < end)
+    )
+
+
+def _version(row: Row) -> tuple[Value, Value]:
+    low_quality, definitive = row[2], row[3]
+    return (definitive, -low_quality)
+
+
+def _trim(row: Row, start: int, end: int) -> Row:
+    """Return part ``[start, end)`` of the period of `row`
+
+    Measures are pro rata of its duration, and indexes are unknown unless at
+    its boundaries.
+    """
+    values = dict(zip(columnar.COLUMNS[1:], row))
+    ratio = (end - start) / (values["end"] - values["start"])
+    for name in MEASURES:
+        values[name] *= ratio
+    if start != values["start"]:
+        values["index_debut"] = math.nan
+    if end != values["end"]:
+        values["index_fin"] = math.nan
+    values["start"], values["end"] = start, end
+    return tuple(values[name] for name in columnar.COLUMNS[1:])
+
+
+class _Window:
+    """Sorted and non-overlapping rows of a PCE over a period"""
+
+    def __init__(self, rows: list[Row]):
+        self.rows = rows
+        # ends are sorted too
+        self._starts = [row[0] for row in rows]
+        self._ends = [row[1] for row in rows]
+
+    def add(self, row: Row) -> Optional[tuple[tuple[Row, ...], tuple[Row, ...]]]:
+        """Add `row` unless superseded, as :meth:`lowatt_grdf.series.ConsumptionSeries.add`
+
+        Return rows removed and added, or None if `row` is discarded.
+        """
+        start, end = row[0], row[1]
+        first = bisect.bisect_right(self._ends, start)
+        last = bisect.bisect_left(self._starts, end, lo=first)
+        removed = tuple(self.rows[first:last])
+        if any(_version(other) > _version(row) for other in removed):
+            return None
+        added = [row]
+        if removed and removed[0][0] < start:
+            added.insert(0, _trim(removed[0], int(removed[0][0]), int(start)))
+        if removed and removed[-1][1] > end:
+            added.append(_trim(removed[-1], int(end), int(removed[-1][1])))
+        self.rows[first:last] = added
+        self._starts[first:last] = [other[0] for other in added]
+        self._ends[first:last] = [other[1] for other in added]
+        return removed, tuple(added)
@@ -0,0 +1,116 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Lazy iteration over consumption series of a fleet of PCEs.
+
+Requests are split in windows and sent ahead of the consumer by a few
+threads, at most `prefetch` of them being in flight or waiting to be
+consumed. Fetching thus overlaps processing of previous responses, and pauses
+when the consumer is slower, so that memory use doesn't depend on the size of
+the fleet or of the period.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+from collections.abc import Generator, Iterable, Iterator
+from typing import Any, Optional
+
+from . import api, gaps
+
+# pce, from_date, to_date
+Unit = tuple[str, str, str]
+
+
+def units(
+    pces: Iterable[str], from_date: str, to_date: str, window: Optional[int] = 365
+) -> Iterator[Unit]:
+    """Yield requests of `pces` from `from_date` to `to_date`, of `window` days"""
+    interval = (
+        datetime.date.fromisoformat(from_date),
+        datetime.date.fromisoformat(to_date),
+    )
+    for pce in pces:
+        for start, end in gaps.split(interval, window):
+            yield (pce, start.isoformat(), end.isoformat())
+
+
+def iter_responses(
+    grdf: api.BaseAPI,
+    calls: Iterable[Unit],
+    dataset: api.SeriesDataset = "consos_publiees",
+    prefetch: int = 4,
+    transform: Optional[api.Transform] = None,
+) -> Generator[tuple[Unit, "concurrent.futures.Future[Any]"], None, None]:
+    """Yield `calls` of `dataset` in order, with the future of their response
+
+    Futures are done when yielded. Closing the iterator cancels pending
+    requests.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(prefetch)
+    pending: collections.deque[tuple[Unit, concurrent.futures.Future[Any]]] = (
+        collections.deque()
+    )
+    try:
+        for unit in calls:
+            future = executor.submit(
+                grdf.donnees_series, dataset, *unit, transform=transform
+            )
+            pending.append((unit, future))
+            if len(pending) < prefetch:
+                continue
+            unit, future = pending.popleft()
+            concurrent.futures.wait([future])
+            yield unit, future
+        while pending:
+            unit, future = pending.popleft()
+            concurrent.futures.wait([future])
+            yield unit, future
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def iter_consumption(
+    grdf: api.BaseAPI,
+    pces: Iterable[str],
+    from_date: str,
+    to_date: str,
+    dataset: api.SeriesDataset = "consos_publiees",
+    window: Optional[int] = 365,
+    prefetch: int = 4,
+    transform: Optional[api.Transform] = None,
+) -> Generator[Any, None, None]:
+    """Yield records of `dataset` of `pces`, in order, from `from_date` to `to_date`
+
+    Requests cover at most `window` days. With `transform`, its result for
+    each response is yielded instead of records (see
+    :meth:`lowatt_grdf.api.BaseAPI.request`). Errors are raised when reaching
+    the failed request, and closing the iterator cancels pending requests.
+    """
+    responses = iter_responses(
+        grdf, units(pces, from_date, to_date, window), dataset, prefetch, transform
+    )
+    with contextlib.closing(responses):
+        for _, future in responses:
+            if transform is None:
+                yield from future.result()
+            else:
+                yield future.result()
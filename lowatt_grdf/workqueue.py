@@ -0,0 +1,187 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Durable work queue of fetch jobs shared by several workers.
+
+A leased job is invisible to other workers until its visibility timeout
+expires, after which it is handed to another worker. Jobs failing or timing
+out more than `max_attempts` times are moved to the dead letters.
+"""
+
+import abc
+import contextlib
+import json
+import sqlite3
+import time
+import uuid
+from collections.abc import Iterable, Iterator
+from typing import Any, Optional
+
+import attrs
+
+from . import codec
+
+
+@attrs.frozen
+class Job:
+    id: int
+    payload: dict[str, Any]
+    attempts: int
+    lease: str
+    error: Optional[str] = None
+
+
+class WorkQueue(metaclass=abc.ABCMeta):
+    def __init__(self, visibility_timeout: float = 300, max_attempts: int = 5):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+
+    @abc.abstractmethod
+    def put(self, payloads: Iterable[dict[str, Any]]) -> int:
+        """Add jobs, ignoring those already queued, return the number added"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def lease(self) -> Optional[Job]:
+        """Return next available job, or None if there is none"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def ack(self, job: Job) -> bool:
+        """Mark `job` as done, return False if its lease has expired"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def nack(self, job: Job, error: str) -> None:
+        """Release `job` for a retry, or dead letter it after max attempts"""
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def dead_letters(self) -> list[Job]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def stats(self) -> dict[str, int]:
+        """Return the number of jobs by state"""
+        raise NotImplementedError()
+
+
+class SQLiteQueue(WorkQueue):
+    """Work queue stored in an SQLite database at `path`
+
+    Workers on several nodes may share it through a network file system
+    supporting locks.
+    """
+
+    def __init__(
+        self, path: str, visibility_timeout: float = 300, max_attempts: int = 5
+    ):
+        super().__init__(visibility_timeout, max_attempts)
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY,"
+            " payload TEXT UNIQUE NOT NULL,"
+            " state TEXT NOT NULL DEFAULT 'ready',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease TEXT,"
+            " lease_until REAL,"
+            " error TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    def put(self, payloads: Iterable[dict[str, Any]]) -> int:
+        # payloads are unique: encode them canonically, whatever the JSON
+        # backend of the node enqueuing them
+        rows = [
+            (json.dumps(p, sort_keys=True, separators=(",", ":"), ensure_ascii=False),)
+            for p in payloads
+        ]
+        with self._transaction():
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO jobs (payload) VALUES (?)", rows)
+            return self.db.total_changes - before
+
+    def lease(self) -> Optional[Job]:
+        now = time.time()
+        with self._transaction():
+            # jobs leased and not acked before their timeout
+            self.db.execute(
+                "UPDATE jobs SET state = 'dead', error = 'visibility timeout'"
+                " WHERE state = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = self.db.execute(
+                "SELECT id, payload, attempts FROM jobs"
+                " WHERE state = 'ready' OR (state = 'leased' AND lease_until < ?)"
+                " ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, payload, attempts = row
+            lease = uuid.uuid4().hex
+            self.db.execute(
+                "UPDATE jobs SET state = 'leased', attempts = ?, lease = ?,"
+                " lease_until = ? WHERE id = ?",
+                (attempts + 1, lease, now + self.visibility_timeout, job_id),
+            )
+        return Job(job_id, codec.loads(payload), attempts + 1, lease)
+
+    def ack(self, job: Job) -> bool:
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET state = 'done', lease = NULL"
+                " WHERE id = ? AND state = 'leased' AND lease = ?",
+                (job.id, job.lease),
+            )
+            return cursor.rowcount == 1
+
+    def nack(self, job: Job, error: str) -> None:
+        state = "dead" if job.attempts >= self.max_attempts else "ready"
+        with self._transaction():
+            self.db.execute(
+                "UPDATE jobs SET state = ?, error = ?, lease = NULL"
+                " WHERE id = ? AND state = 'leased' AND lease = ?",
+                (state, error, job.id, job.lease),
+            )
+
+    def dead_letters(self) -> list[Job]:
+        return [
+            Job(job_id, codec.loads(payload), attempts, "", error)
+            for job_id, payload, attempts, error in self.db.execute(
+                "SELECT id, payload, attempts, error FROM jobs"
+                " WHERE state = 'dead' ORDER BY id"
+            )
+        ]
+
+    def stats(self) -> dict[str, int]:
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Write transaction, taking the database lock upfront"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
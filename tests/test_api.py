@@ -19,12 +19,20 @@
 # THE SOFTWARE.
 import json
 import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
 
 import ndjson
 import pytest
+import requests
 import responses
 
-from lowatt_grdf import api, models
+from lowatt_grdf import api, archive, columnar, models, ratelimit
+
+from .test_gaps import record
 
 
 @pytest.fixture
@@ -45,6 +53,134 @@ def test_access_token(grdf: api.API) -> None:
     assert grdf.access_token == "xxx"
 
 
+def token_callback(
+    calls: list[float], expires_in: int
+) -> Callable[[Any], tuple[int, dict[str, str], str]]:
+    lock = threading.Lock()
+
+    def callback(request: Any) -> tuple[int, dict[str, str], str]:
+        with lock:
+            calls.append(time.time())
+            count = len(calls)
+        # widen the window during which other threads see an invalid token
+        time.sleep(0.05)
+        body = {"access_token": f"token{count}", "expires_in": expires_in}
+        return (200, {}, json.dumps(body))
+
+    return callback
+
+
+@responses.activate
+def test_concurrent_requests() -> None:
+    auth_calls: list[float] = []
+    responses.add_callback(
+        responses.POST, api.NEW_AUTH_ENDPOINT, token_callback(auth_calls, 14400)
+    )
+    grdf = api.API("id", "secret", rate_limiter=ratelimit.IntervalLimiter(0))
+    url = f"{grdf.api}/pce/23000000000000/donnees_techniques"
+    responses.add(responses.GET, url, json={"pce": "23000000000000"})
+
+    def fetch(_: int) -> Any:
+        return grdf.donnees_techniques("23000000000000")
+
+    with ThreadPoolExecutor(32) as executor:
+        results = list(executor.map(fetch, range(500)))
+    assert results == [{"pce": "23000000000000"}] * 500
+    assert len(auth_calls) == 1
+    assert {
+        call.request.headers["Authorization"]
+        for call in responses.calls
+        if call.request.url == url
+    } == {"Bearer token1"}
+
+    # expired token is refreshed once for all threads
+    grdf._access_expires = time.time() - 1
+    with ThreadPoolExecutor(32) as executor:
+        list(executor.map(fetch, range(200)))
+    assert len(auth_calls) == 2
+    assert grdf.access_token == "token2"
+
+
+@responses.activate
+def test_token_renewal() -> None:
+    auth_calls: list[float] = []
+    responses.add_callback(
+        responses.POST, api.NEW_AUTH_ENDPOINT, token_callback(auth_calls, 14400)
+    )
+    grdf = api.API("id", "secret")
+    assert grdf.access_token == "token1"
+    assert grdf._access_renew == grdf._access_expires - grdf.token_renew_margin  # type: ignore[operator]
+    grdf._access_renew = time.time() - 1
+    # current token is returned while it is being renewed in background
+    with ThreadPoolExecutor(8) as executor:
+        tokens = set(executor.map(lambda _: grdf.access_token, range(100)))
+    assert tokens == {"token1"}
+    deadline = time.time() + 5
+    while grdf.access_token == "token1" and time.time() < deadline:
+        time.sleep(0.01)
+    assert grdf.access_token == "token2"
+    assert len(auth_calls) == 2
+
+
+@responses.activate
+def test_request_coalescing(grdf: api.API) -> None:
+    grdf.rate_limiter = ratelimit.IntervalLimiter(0)
+    url = f"{grdf.api}/pce/23000000000000/donnees_contractuelles"
+
+    def callback(request: Any) -> tuple[int, dict[str, str], str]:
+        # let identical requests pile up
+        time.sleep(0.2)
+        return (200, {}, json.dumps({"pce": {"id_pce": "23000000000000"}}))
+
+    responses.add_callback(responses.GET, url, callback)
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            executor.map(
+                lambda _: grdf.donnees_contractuelles("23000000000000"), range(8)
+            )
+        )
+    assert results == [{"pce": {"id_pce": "23000000000000"}}] * 8
+    assert len([c for c in responses.calls if c.request.url == url]) == 1
+    assert grdf.coalesce_stats == api.CoalesceStats(upstream=1, coalesced=7)
+    # results are not shared between callers
+    assert len({id(result) for result in results}) == 8
+
+    # later requests are sent again, unless within coalesce_window
+    grdf.donnees_contractuelles("23000000000000")
+    grdf.coalesce_window = 60
+    grdf.donnees_contractuelles("23000000000000")
+    grdf.donnees_contractuelles("23000000000000")
+    assert len([c for c in responses.calls if c.request.url == url]) == 3
+    assert grdf.coalesce_stats == api.CoalesceStats(upstream=3, coalesced=8)
+
+
+@responses.activate
+def test_request_coalescing_error(grdf: api.API) -> None:
+    grdf.rate_limiter = ratelimit.IntervalLimiter(0)
+    grdf.coalesce_window = 60
+    url = f"{grdf.api}/pce/23000000000000/donnees_techniques"
+
+    def callback(request: Any) -> tuple[int, dict[str, str], str]:
+        time.sleep(0.2)
+        return (500, {}, "{}")
+
+    responses.add_callback(responses.GET, url, callback)
+    with ThreadPoolExecutor(4) as executor:
+        futures = [
+            executor.submit(grdf.donnees_techniques, "23000000000000") for _ in range(4)
+        ]
+    for future in futures:
+        assert isinstance(future.exception(), requests.HTTPError)
+    assert grdf.coalesce_stats == api.CoalesceStats(upstream=1, coalesced=3)
+    # errors are not kept
+    with pytest.raises(requests.HTTPError):
+        grdf.donnees_techniques("23000000000000")
+    assert grdf.coalesce_stats.upstream == 2
+    assert api.request_key("GET", url, params={"a": 1, "b": 2}) == api.request_key(
+        "GET", url, params={"b": 2, "a": 1}
+    )
+
+
 @responses.activate
 def test_donnees_contractuelles(grdf: api.API) -> None:
     payload = {
@@ -66,6 +202,25 @@ def test_donnees_contractuelles(grdf: api.API) -> None:
     assert grdf.donnees_contractuelles("23000000000000") == payload
 
 
+@responses.activate
+def test_staging_multiline_response() -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    grdf = api.StagingAPI("id", "secret")
+    responses.add(
+        responses.GET,
+        f"{grdf.api}/droits_acces",
+        body='{\n  "id_pce": "GI000000"\n}{\n  "code_statut_traitement": "0000000000"\n}',
+    )
+    assert grdf.droits_acces() == [
+        {"id_pce": "GI000000"},
+        {"code_statut_traitement": "0000000000"},
+    ]
+
+
 @responses.activate
 def test_donnees_techniques(grdf: api.API) -> None:
     payload = {
@@ -464,3 +619,175 @@ def test_declare_acces(grdf: api.API, caplog: pytest.LogCaptureFixture) -> None:
     assert [r.message for r in caplog.records] == [
         "Successfully declared access to 23000000000000",
     ]
+
+
+@responses.activate
+def test_pce_snapshot(grdf: api.API) -> None:
+    grdf.rate_limiter = ratelimit.IntervalLimiter(0)
+    responses.add(
+        responses.POST,
+        f"{grdf.api}/droits_acces",
+        body=ndjson.dumps([ACCESS_PAYLOAD]),
+    )
+    base = f"{grdf.api}/pce/GI000000"
+    responses.add(responses.GET, f"{base}/donnees_contractuelles", json={"car": 9426})
+    responses.add(
+        responses.GET, f"{base}/donnees_consos_publiees", json={"energie": 2032}
+    )
+    responses.add(responses.GET, f"{base}/donnees_consos_informatives", status=500)
+    snapshot = grdf.pce_snapshot("GI000000", "2021-01-01", "2021-02-01")
+    assert snapshot.contractuelles == {"car": 9426}
+    assert snapshot.consos_publiees == [{"energie": 2032}]
+    assert snapshot.techniques is None
+    assert snapshot.skipped == {
+        # "perim_donnees_techniques:" typo in GRDF payload
+        "techniques": "not in access perimeter",
+        "injections_publiees": "not in access perimeter",
+    }
+    assert list(snapshot.errors) == ["consos_informatives"]
+
+    inactive = models.converter.structure(
+        dict(ACCESS_PAYLOAD, etat_droit_acces="Révoquée"), models.Access
+    )
+    snapshot = grdf.pce_snapshot(
+        "GI000000", "2021-01-01", "2021-02-01", ["techniques"], accesses=[inactive]
+    )
+    assert snapshot.skipped == {"techniques": "access right is Révoquée"}
+    snapshot = grdf.pce_snapshot(
+        "GI000001", "2021-01-01", "2021-02-01", ["techniques"], accesses=[inactive]
+    )
+    assert snapshot.skipped == {"techniques": "no access right"}
+
+
+@responses.activate
+def test_archive_replay(grdf: api.API, tmp_path: Path) -> None:
+    store = archive.Archive(str(tmp_path))
+    grdf.archive = store
+    url = f"{grdf.api}/pce/GI000000/donnees_consos_publiees"
+    responses.add(responses.GET, url, body=b'{"energie": 1}\n{"energie": 2}')
+    expected = [{"energie": 1}, {"energie": 2}]
+    assert grdf.donnees_consos_publiees("GI000000", "2021-01-01", "2021-02-01") == (
+        expected
+    )
+    assert len(store) == 1
+    responses.reset()
+    staging = api.StagingAPI("id", "secret", archive=store, replay=True)
+    # url differs for staging
+    with pytest.raises(archive.NotArchived):
+        staging.donnees_consos_publiees("GI000000", "2021-01-01", "2021-02-01")
+    replay = api.API(
+        "id", "secret", archive=archive.Archive(str(tmp_path)), replay=True
+    )
+    assert replay.donnees_consos_publiees("GI000000", "2021-01-01", "2021-02-01") == (
+        expected
+    )
+    assert not responses.calls
+
+
+@responses.activate
+def test_parse_executor(grdf: api.API) -> None:
+    url = f"{grdf.api}/pce/GI000000/donnees_consos_publiees"
+    responses.add(
+        responses.GET,
+        url,
+        body=ndjson.dumps([record("2021-01-01", "2021-01-02")] * 2),
+    )
+    responses.add(responses.GET, f"{grdf.api}/droits_acces", json=ACCESS_PAYLOAD)
+    with ProcessPoolExecutor(1) as executor:
+        grdf.parse_executor = executor
+        columns = grdf.donnees_series(
+            "consos_publiees",
+            "GI000000",
+            "2021-01-01",
+            "2021-01-03",
+            transform=columnar.to_columns,
+        )
+        (access,) = grdf.accesses()
+    assert columns["start"] == [1609477200] * 2
+    assert access.pce == "GI000000"
+
+
+def test_latency_stats() -> None:
+    stats = api.LatencyStats(size=100)
+    assert stats.percentile(50) is None
+    for latency in range(1, 201):
+        stats.add(latency / 100)
+    # the last 100 samples are kept
+    assert stats.summary() == {"p50": 1.5, "p95": 1.95, "p99": 1.99}
+
+
+@responses.activate
+def test_timeouts(grdf: api.API) -> None:
+    url = f"{grdf.api}/pce/GI000000/donnees_techniques"
+    calls: list[float] = []
+
+    def callback(request: requests.PreparedRequest) -> tuple[int, dict[str, str], str]:
+        calls.append(time.monotonic())
+        assert request.req_kwargs["timeout"] == (10.0, 60.0)  # type: ignore[attr-defined]
+        # the first request hangs
+        time.sleep(0.5 if len(calls) == 1 else 0)
+        return (200, {}, json.dumps({"pce": "GI000000"}))
+
+    responses.add_callback(responses.GET, url, callback)
+    grdf.rate_limiter = ratelimit.IntervalLimiter(0)
+    grdf.deadline = 0.1
+    start = time.monotonic()
+    with pytest.raises(api.DeadlineExceeded):
+        grdf.donnees_techniques("GI000000")
+    assert time.monotonic() - start < 0.4
+    # a duplicate is sent once the 50th percentile of latencies is exceeded
+    calls.clear()
+    grdf.deadline = None
+    grdf.hedge_percentile = 50
+    grdf.hedge_budget = 1
+    for _ in range(grdf.hedge_min_samples):
+        grdf.latency_stats.add(0.05)
+    start = time.monotonic()
+    assert grdf.donnees_techniques("GI000000") == {"pce": "GI000000"}
+    assert time.monotonic() - start < 0.4
+    assert calls[1] - calls[0] >= 0.04
+    assert grdf.hedge_stats == api.HedgeStats(requests=2, hedged=1, won=1)
+    # within the hedge budget
+    grdf.hedge_budget = 0.1
+    calls.clear()
+    assert grdf.donnees_techniques("GI000000") == {"pce": "GI000000"}
+    assert len(calls) == 1
+    assert grdf.hedge_stats == api.HedgeStats(requests=3, hedged=1, won=1)
+
+
+@responses.activate
+def test_timeouts_rate_limiter() -> None:
+    auth_calls: list[float] = []
+    responses.add_callback(
+        responses.POST, api.NEW_AUTH_ENDPOINT, token_callback(auth_calls, 14400)
+    )
+    url = f"{api.API.api}/pce/GI000000/donnees_techniques"
+    calls: list[float] = []
+
+    def callback(request: requests.PreparedRequest) -> tuple[int, dict[str, str], str]:
+        calls.append(time.monotonic())
+        time.sleep(0.2 if len(calls) == 3 else 0)
+        return (200, {}, json.dumps({"pce": "GI000000"}))
+
+    responses.add_callback(responses.GET, url, callback)
+    grdf = api.API("id", "secret", rate_limiter=ratelimit.IntervalLimiter(0.3))
+    grdf.concurrency = 3
+    assert grdf.donnees_techniques("GI000000") == {"pce": "GI000000"}
+    # the token expiring while waiting for the rate limiter isn't sent
+    grdf._access_expires = time.time() + 0.1
+    # the deadline starts once the rate limiter allows the request
+    grdf.deadline = 0.2
+    assert grdf.donnees_techniques("GI000000") == {"pce": "GI000000"}
+    assert responses.calls[-1].request.headers["Authorization"] == "Bearer token2"
+    assert grdf._http_executor is not None
+    assert grdf._http_executor._max_workers == 6
+    # no hedge is sent while the rate limiter doesn't allow it
+    grdf.deadline = None
+    grdf.hedge_percentile = 50
+    grdf.hedge_budget = 1
+    for _ in range(grdf.hedge_min_samples):
+        grdf.latency_stats.add(0.05)
+    time.sleep(0.3)
+    assert grdf.donnees_techniques("GI000000") == {"pce": "GI000000"}
+    assert len(calls) == 3
+    assert grdf.hedge_stats == api.HedgeStats(requests=3, hedged=0, won=0)
@@ -0,0 +1,69 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+from pathlib import Path
+
+import pytest
+
+from lowatt_grdf import archive
+
+
+@pytest.mark.parametrize("compression", archive.COMPRESSIONS)
+def test_put_get(tmp_path: Path, compression: archive.Compression) -> None:
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    store = archive.Archive(str(tmp_path), compression)
+    store.put("GET a", b'{"a": 1}')
+    store.put("GET b", b'{"b": 1}')
+    store.put("GET a", b'{"a": 2}')
+    assert store.get("GET a") == b'{"a": 2}'
+    assert store.get("GET b") == b'{"b": 1}'
+    with pytest.raises(archive.NotArchived):
+        store.get("GET c")
+    # index is loaded back
+    store = archive.Archive(str(tmp_path), compression)
+    assert len(store) == 2
+    assert store.get("GET a") == b'{"a": 2}'
+
+
+def test_rotation(tmp_path: Path) -> None:
+    store = archive.Archive(str(tmp_path), segment_size=100)
+    bodies = [os.urandom(100) for i in range(10)]
+    for i, body in enumerate(bodies):
+        store.put(f"GET {i}", body)
+    assert len({entry.segment for entry in store}) == 10
+    assert store.get("GET 3") == bodies[3]
+    # a new segment is started by another compression, older remain readable
+    pytest.importorskip("zstandard")
+    store = archive.Archive(str(tmp_path), "zstd", segment_size=100)
+    entry = store.put("GET 3", b"y")
+    assert entry.segment == "000011.zst"
+    assert store.get("GET 3") == b"y"
+    assert store.get("GET 4") == bodies[4]
+
+
+def test_truncated_index(tmp_path: Path) -> None:
+    store = archive.Archive(str(tmp_path))
+    store.put("GET a", b"a")
+    with open(tmp_path / archive.INDEX, "a") as f:
+        f.write('{"key": "GET b", "timest')
+    store = archive.Archive(str(tmp_path))
+    assert list(store.entries) == ["GET a"]
@@ -0,0 +1,135 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import functools
+import gzip
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import pytest
+from click.testing import CliRunner
+
+from lowatt_grdf import api, checkpoint, main, sink
+
+FAKE_API = """
+import functools
+import sys
+import time
+
+from lowatt_grdf import api, main, sink
+
+
+def donnees_series(self, dataset, pce, from_date, to_date, transform=None):
+    time.sleep(0.05)
+    return [{"pce": {"id_pce": pce}, "date_debut": from_date}]
+
+
+api.BaseAPI.donnees_series = donnees_series
+sink.open_sink = functools.partial(sink.open_sink, batch_size=3)
+main.main(sys.argv[1:])
+"""
+
+
+def test_checkpoint(tmp_path: Path) -> None:
+    path = str(tmp_path / "checkpoint")
+    journal = checkpoint.Checkpoint(path)
+    journal.save(0)
+    journal.mark(("GI000000", "2021-01-01"))
+    journal.save(3)
+    # nothing new to record
+    journal.save(3)
+    with open(path, "a") as f:
+        f.write('{"units": [["GI000001", "2021-01-01"]], "posi')
+    journal = checkpoint.Checkpoint(path, resume=True)
+    assert ("GI000000", "2021-01-01") in journal
+    assert ("GI000001", "2021-01-01") not in journal
+    assert journal.position == 3
+    assert len(checkpoint.Checkpoint(path)) == 0
+    assert not Path(path).exists()
+
+
+def read_records(directory: Path) -> list[tuple[str, str]]:
+    records: list[Any] = []
+    for path in sorted(directory.iterdir()):
+        with gzip.open(path) as f:
+            records.extend(json.loads(line) for line in f)
+    return [(r["pce"]["id_pce"], r["date_debut"]) for r in records]
+
+
+def test_resume_after_kill(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    journal = tmp_path / "checkpoint"
+    output = tmp_path / "records"
+    pces = [f"GI{i:06d}" for i in range(50)]
+    args = ["fetch", *pces, "--from-date", "2021-01-01", "--to-date", "2021-03-01"]
+    args += ["--window", "31", "--sink", f"ndjson.gz:{output}"]
+    args += ["--checkpoint", str(journal), "--client-id", "id", "--client-secret", "x"]
+    units = {(pce, day) for pce in pces for day in ("2021-01-01", "2021-02-01")}
+    proc = subprocess.Popen([sys.executable, "-c", FAKE_API, *args])
+    deadline = time.time() + 30
+    while not journal.exists() or len(journal.read_text().splitlines()) < 5:
+        assert time.time() < deadline and proc.poll() is None
+        time.sleep(0.01)
+    proc.kill()
+    proc.wait()
+    done = {
+        (pce, from_date)
+        for _, pce, from_date, _ in checkpoint.Checkpoint(str(journal), True).done
+    }
+    assert 0 < len(done) < len(units)
+
+    calls = []
+
+    def donnees_series(
+        self: api.BaseAPI, dataset: str, pce: str, from_date: str, *args: Any, **kw: Any
+    ) -> list[dict[str, Any]]:
+        calls.append((pce, from_date))
+        return [{"pce": {"id_pce": pce}, "date_debut": from_date}]
+
+    monkeypatch.setattr(api.BaseAPI, "donnees_series", donnees_series)
+    monkeypatch.setattr(
+        sink, "open_sink", functools.partial(sink.open_sink, batch_size=3)
+    )
+    runner = CliRunner()
+    result = runner.invoke(main.main, [*args, "--resume"])
+    assert result.exit_code == 0, result.output
+    # completed requests are not sent again, nor their records written
+    assert set(calls) == units - done and len(calls) == len(units - done)
+    records = read_records(output)
+    assert sorted(records) == sorted(units)
+    # nothing left to do
+    calls.clear()
+    result = runner.invoke(main.main, [*args, "--resume"])
+    assert result.exit_code == 0, result.output
+    assert calls == [] and len(read_records(output)) == len(units)
+
+
+def test_checkpoint_usage(tmp_path: Path) -> None:
+    runner = CliRunner()
+    args = ["fetch", "GI000000", "--from-date", "2021-01-01", "--to-date", "2021-02-01"]
+    args += ["--client-id", "id", "--client-secret", "x"]
+    result = runner.invoke(main.main, [*args, "--resume"])
+    assert result.exit_code == 2 and "--resume requires --checkpoint" in result.output
+    result = runner.invoke(main.main, [*args, "--checkpoint", str(tmp_path / "c")])
+    assert result.exit_code == 2
+    assert "--checkpoint requires a sqlite or ndjson.gz --sink" in result.output
@@ -0,0 +1,70 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+from collections.abc import Iterator
+from typing import Optional
+
+import attrs
+import pytest
+
+from lowatt_grdf import codec
+
+
+@pytest.fixture(params=codec.BACKENDS)
+def backend(request: pytest.FixtureRequest) -> Iterator[str]:
+    previous = codec.backend
+    try:
+        codec.use(request.param)
+    except ImportError:
+        pytest.skip(f"{request.param} is not installed")
+    yield request.param
+    codec.use(previous)
+
+
+def test_roundtrip(backend: str) -> None:
+    data = {"pce": {"id_pce": "GI000000"}, "energie": 2032, "libelle": "Relevé"}
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads(codec.dumps(data, indent=True)) == data
+    assert "\n" in codec.dumps(data, indent=True)
+    assert "é" in codec.dumps(data)
+
+
+def test_loads_ndjson(backend: str) -> None:
+    assert codec.loads_ndjson(b"") == []
+    assert codec.loads_ndjson(b'{"a": 1}\n\n{"a": 2}\n') == [{"a": 1}, {"a": 2}]
+    assert codec.loads_ndjson('{"a": "é"}') == [{"a": "é"}]
+
+
+@attrs.frozen
+class Period:
+    date_debut: str
+    date_fin: Optional[str] = None
+
+
+def test_decode(backend: str) -> None:
+    assert codec.decode(
+        b'[{"date_debut": "2021-01-01"}, {"date_debut": "2021-01-02", "date_fin": "2021-01-03"}]',
+        list[Period],
+    ) == [Period("2021-01-01"), Period("2021-01-02", "2021-01-03")]
+
+
+def test_use_unknown() -> None:
+    with pytest.raises(ValueError, match="Unknown JSON backend"):
+        codec.use("simplejson")
+    assert "json" in codec.available()
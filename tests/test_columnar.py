@@ -0,0 +1,76 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import math
+
+import ndjson
+import pytest
+
+from lowatt_grdf import codec, columnar
+
+from .test_codec import backend  # noqa: F401
+from .test_gaps import record
+
+
+def test_to_columns() -> None:
+    first = record("2021-01-01", "2021-01-02", qualite="Estimé")
+    first["consommation"].update(energie=12, volume_brut=1.1, statut_conso="Définitive")
+    first["releve_fin"]["index_brut_fin"] = {"valeur_index": 951}
+    columns = columnar.to_columns(
+        [first, record("2021-01-02", "2021-01-03"), {"pce": {"id_pce": "GI000000"}}]
+    )
+    assert columns["pce"] == ["GI000000", "GI000000"]
+    assert columns["start"] == [1609477200, 1609563600]
+    assert columns["end"] == [1609563600, 1609650000]
+    assert columns["low_quality"] == [1, 0]
+    assert columns["definitive"] == [1, 0]
+    assert columns["energie"][0] == 12 and math.isnan(columns["energie"][1])
+    assert columns["index_fin"][0] == 951 and math.isnan(columns["index_debut"][0])
+    (row, _) = columnar.rows(columns)
+    assert row["volume_brut"] == 1.1
+    both = columnar.concat([columns, columns])
+    assert len(both["pce"]) == 4
+
+
+def nan_equal(a: columnar.Columns, b: columnar.Columns) -> bool:
+    return all(
+        len(a[name]) == len(b[name])
+        and all(
+            x == y or (isinstance(x, float) and math.isnan(x) and math.isnan(y))
+            for x, y in zip(a[name], b[name])
+        )
+        for name in columnar.COLUMNS
+    )
+
+
+@pytest.mark.usefixtures("backend")
+def test_decode_columns() -> None:
+    first = record("2021-01-01", "2021-01-02", qualite="Estimé")
+    first["consommation"].update(
+        energie=12, coeff_calcul={"coeff_conversion": 11.2}, statut_conso="Définitive"
+    )
+    first["releve_fin"]["index_brut_fin"] = {"valeur_index": 951}
+    records = [first, record("2021-01-02", "2021-01-03"), {"pce": {"id_pce": "GI0"}}]
+    expected = columnar.to_columns(records)
+    assert nan_equal(columnar.decode_columns(ndjson.dumps(records)), expected)
+    assert nan_equal(columnar.decode_columns(codec.dumps(records).encode()), expected)
+    # unexpected types are handled by the untyped path
+    first["consommation"]["energie"] = "12"
+    assert nan_equal(columnar.decode_columns(ndjson.dumps(records)), expected)
@@ -0,0 +1,144 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import gzip
+import zlib
+
+import ndjson
+import pytest
+import requests
+import responses
+
+from lowatt_grdf import api, contentcoding, ratelimit
+
+from .test_gaps import record
+
+DATA = b'{"energie": 1234, "statut_conso": "Definitive"}\n' * 1000
+
+
+def chunked(data: bytes, size: int = 100) -> list[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def decoded(data: bytes, content_encoding: str) -> bytes:
+    return b"".join(contentcoding.iter_decoded(chunked(data), content_encoding))
+
+
+def test_gzip() -> None:
+    # several members
+    data = gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:])
+    assert decoded(data, "gzip") == DATA
+    assert decoded(zlib.compress(DATA), "deflate") == DATA
+    assert decoded(DATA, "") == DATA
+    assert decoded(DATA, "identity") == DATA
+
+
+def test_brotli() -> None:
+    brotli = pytest.importorskip("brotli")
+    assert decoded(brotli.compress(DATA), "br") == DATA
+    assert "br" in contentcoding.accept_encoding()
+
+
+def test_zstd() -> None:
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    # several frames
+    data = compressor.compress(DATA[:1000]) + compressor.compress(DATA[1000:])
+    assert decoded(data, "zstd") == DATA
+    assert contentcoding.accept_encoding().startswith("zstd, ")
+
+
+def test_chained_codings() -> None:
+    data = gzip.compress(zlib.compress(DATA))
+    assert decoded(data, "deflate, gzip") == DATA
+
+
+def test_invalid() -> None:
+    with pytest.raises(requests.exceptions.ContentDecodingError):
+        decoded(DATA, "compress")
+    with pytest.raises(requests.exceptions.ContentDecodingError):
+        decoded(DATA, "gzip")
+
+
+def test_truncated() -> None:
+    for data, content_encoding in [
+        (gzip.compress(DATA), "gzip"),
+        (gzip.compress(DATA) + gzip.compress(DATA), "gzip"),
+        (zlib.compress(DATA), "deflate"),
+        (gzip.compress(zlib.compress(DATA)), "deflate, gzip"),
+    ]:
+        with pytest.raises(requests.exceptions.ContentDecodingError, match="Truncated"):
+            decoded(data[:-10], content_encoding)
+    # e.g. a 204 response
+    assert decoded(b"", "gzip") == b""
+
+
+def test_truncated_brotli() -> None:
+    brotli = pytest.importorskip("brotli")
+    with pytest.raises(requests.exceptions.ContentDecodingError, match="Truncated"):
+        decoded(brotli.compress(DATA)[:-10], "br")
+    assert decoded(b"", "br") == b""
+
+
+def test_truncated_zstd() -> None:
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    data = compressor.compress(DATA[:1000]) + compressor.compress(DATA[1000:])
+    with pytest.raises(requests.exceptions.ContentDecodingError, match="Truncated"):
+        decoded(data[:-10], "zstd")
+    # cut between frames
+    frame = compressor.compress(DATA[:1000])
+    assert decoded(frame + frame, "zstd") == DATA[:1000] * 2
+    assert decoded(b"", "zstd") == b""
+
+
+@responses.activate
+def test_compressed_response() -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    grdf = api.API("id", "secret", rate_limiter=ratelimit.IntervalLimiter(0))
+    body = ndjson.dumps([record("2021-01-01", "2021-01-02")] * 100).encode()
+    url = f"{grdf.api}/pce/GI000000/donnees_consos_publiees"
+    responses.add(
+        responses.GET,
+        url,
+        body=gzip.compress(body),
+        headers={"Content-Encoding": "gzip"},
+    )
+    records = grdf.donnees_consos_publiees("GI000000", "2021-01-01", "2021-02-01")
+    assert len(records) == 100
+    request = responses.calls[1].request
+    assert "gzip" in request.headers["Accept-Encoding"]
+    assert request.headers["Accept-Encoding"] == contentcoding.accept_encoding()
+    assert grdf.response_bytes == {"donnees_consos_publiees": len(body)}
+    assert grdf.wire_bytes == {"donnees_consos_publiees": len(gzip.compress(body))}
+    assert grdf.wire_bytes["donnees_consos_publiees"] < len(body) / 10
+    assert grdf.content_codings == {"gzip": 1}
+    responses.add(
+        responses.GET,
+        f"{grdf.api}/pce/GI000001/donnees_consos_publiees",
+        body=b"not gzip",
+        headers={"Content-Encoding": "gzip"},
+    )
+    with pytest.raises(requests.exceptions.ContentDecodingError):
+        grdf.donnees_consos_publiees("GI000001", "2021-01-01", "2021-02-01")
@@ -0,0 +1,48 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+
+import pytest
+
+from lowatt_grdf import dates
+
+
+def test_epoch_day() -> None:
+    assert dates.epoch_day("1970-01-01") == 0
+    assert dates.date_timestamp("2021-01-31") == 1612051200
+    for value in ("2021-1-31", "2021-02-30", "20210131", "2021-01-31T00:00"):
+        with pytest.raises(ValueError):
+            dates.epoch_day(value)
+
+
+def test_timestamps() -> None:
+    values = [
+        "2021-01-01T06:00:00+01:00",
+        "2021-07-01T06:00:00+02:00",
+        "2021-01-01T06:00:00+01:00",
+        "2021-07-01T04:00:00+00:00",
+    ]
+    assert dates.timestamps(values) == [
+        int(datetime.datetime.fromisoformat(value).timestamp()) for value in values
+    ]
+    assert dates.timestamps(values)[:2] == [1609477200, 1625112000]
+    with pytest.raises(ValueError):
+        dates.timestamps(["2021-01-01T25:00:00+01:00"])
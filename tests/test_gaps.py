@@ -0,0 +1,130 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+import json
+from pathlib import Path
+from typing import Any
+
+from click.testing import CliRunner
+
+from lowatt_grdf import gaps, main
+
+
+def record(
+    start: str, end: str, pce: str = "GI000000", qualite: str = "Mesure"
+) -> dict[str, Any]:
+    return {
+        "pce": {"id_pce": pce},
+        "releve_debut": {"qualite_releve": qualite, "statut_releve": "Normal"},
+        "releve_fin": {"qualite_releve": "Mesure", "statut_releve": "Normal"},
+        "consommation": {
+            "date_debut_consommation": f"{start}T06:00:00+01:00",
+            "date_fin_consommation": f"{end}T06:00:00+01:00",
+        },
+    }
+
+
+RECORDS = [
+    record("2021-01-01", "2021-01-10"),
+    record("2021-01-10", "2021-01-15", qualite="Estimé"),
+    record("2021-01-20", "2021-01-25"),
+    record("2021-01-25", "2021-02-01"),
+    record("2021-01-01", "2021-02-01", pce="GI000001"),
+]
+
+
+def test_find_gaps() -> None:
+    found = gaps.find_gaps(
+        RECORDS, "2021-01-01", "2021-02-05", pces=["GI000000", "GI000002"]
+    )
+    assert [gap.as_dict() for gap in found] == [
+        {
+            "pce": "GI000000",
+            "from_date": "2021-01-10",
+            "to_date": "2021-01-15",
+            "reason": "low_quality",
+        },
+        {
+            "pce": "GI000000",
+            "from_date": "2021-01-15",
+            "to_date": "2021-01-20",
+            "reason": "missing",
+        },
+        {
+            "pce": "GI000000",
+            "from_date": "2021-02-01",
+            "to_date": "2021-02-05",
+            "reason": "missing",
+        },
+        {
+            "pce": "GI000001",
+            "from_date": "2021-02-01",
+            "to_date": "2021-02-05",
+            "reason": "missing",
+        },
+        {
+            "pce": "GI000002",
+            "from_date": "2021-01-01",
+            "to_date": "2021-02-05",
+            "reason": "missing",
+        },
+    ]
+
+
+def test_refetch_requests() -> None:
+    found = gaps.find_gaps(RECORDS, "2021-01-01", "2021-02-05")
+    assert gaps.refetch_requests(found) == [
+        ("GI000000", "2021-01-10", "2021-01-20"),
+        ("GI000000", "2021-02-01", "2021-02-05"),
+        ("GI000001", "2021-02-01", "2021-02-05"),
+    ]
+    assert gaps.refetch_requests(found, tolerance=15, max_days=20) == [
+        ("GI000000", "2021-01-10", "2021-01-30"),
+        ("GI000000", "2021-01-30", "2021-02-05"),
+        ("GI000001", "2021-02-01", "2021-02-05"),
+    ]
+
+
+def test_cli_donnees_gaps(tmp_path: Path) -> None:
+    path = tmp_path / "records.ndjson"
+    path.write_text("\n".join(json.dumps(r) for r in RECORDS))
+    runner = CliRunner()
+    result = runner.invoke(
+        main.main,
+        ["--format", "ndjson", "donnees-gaps", "GI000001", "--input", str(path)]
+        + ["--from-date", "2021-01-01", "--to-date", "2021-02-02"],
+        env={"CLIENT_ID": None, "CLIENT_SECRET": None},
+    )
+    # no credentials needed to read records
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        {
+            "pce": "GI000001",
+            "from_date": "2021-02-01",
+            "to_date": "2021-02-02",
+            "reason": "missing",
+        }
+    ]
+    result = runner.invoke(
+        main.main,
+        ["donnees-gaps", "GI000001", "--input", str(path), "--refetch"]
+        + ["--from-date", "2021-01-01", "--to-date", "2021-02-02"],
+    )
+    assert result.exit_code == 2
+    assert "--client-id and --client-secret are required" in result.output
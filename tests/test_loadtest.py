@@ -0,0 +1,160 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import re
+from collections import Counter
+
+import ndjson
+import pytest
+import requests
+import responses
+from click.testing import CliRunner
+
+from lowatt_grdf import api, loadtest, main, ratelimit
+
+from .test_gaps import record
+
+URL = "http://localhost:8080/adict/v2"
+
+
+def test_parse_mix() -> None:
+    assert loadtest.parse_mix("droits_acces=1, consos_publiees=8,techniques") == {
+        "droits_acces": 1,
+        "consos_publiees": 8,
+        "techniques": 1,
+    }
+    for spec in ("unknown=1", "techniques=x", "techniques=-1", "techniques=0"):
+        with pytest.raises(ValueError):
+            loadtest.parse_mix(spec)
+
+
+def test_schedule() -> None:
+    mix: dict[loadtest.Operation, int] = {"droits_acces": 1, "consos_publiees": 3}
+    assert (
+        loadtest.schedule(mix, 8)
+        == [
+            "consos_publiees",
+            "droits_acces",
+            "consos_publiees",
+            "consos_publiees",
+        ]
+        * 2
+    )
+    assert Counter(loadtest.schedule(mix, 400)) == {
+        "consos_publiees": 300,
+        "droits_acces": 100,
+    }
+
+
+def add_stand_in_responses() -> None:
+    responses.add(
+        responses.POST,
+        f"{URL}/token",
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    responses.add(
+        responses.GET,
+        f"{URL}/droits_acces",
+        body=ndjson.dumps([{"id_pce": "GI000000"}, {"id_pce": "GI000001"}]),
+    )
+
+    def series(request: requests.PreparedRequest) -> tuple[int, dict[str, str], str]:
+        assert request.url is not None
+        pce = request.url.split("/")[-2]
+        if pce == "GI999999":
+            return (404, {}, "{}")
+        params = request.params  # type: ignore[attr-defined]
+        body = ndjson.dumps([record(params["date_debut"], params["date_fin"], pce)])
+        return (200, {}, body)
+
+    responses.add_callback(
+        responses.GET, re.compile(rf"{URL}/pce/\w+/donnees_consos_publiees"), series
+    )
+    responses.add(
+        responses.GET,
+        re.compile(rf"{URL}/pce/\w+/donnees_techniques"),
+        body=json.dumps({"pce": "GI000000"}),
+    )
+
+
+@responses.activate
+def test_run() -> None:
+    add_stand_in_responses()
+    grdf = api.StandInAPI(
+        f"{URL}/", "id", "secret", rate_limiter=ratelimit.IntervalLimiter(0)
+    )
+    report = loadtest.run(
+        grdf,
+        ["GI000000", "GI999999"],
+        "2021-01-01",
+        "2021-03-01",
+        {"droits_acces": 1, "consos_publiees": 2, "techniques": 1},
+        count=8,
+        concurrency=2,
+    )
+    # authentication and 8 requests
+    assert len(responses.calls) == 9
+    consos = report.endpoints["consos_publiees"]
+    assert (consos.requests, consos.errors, consos.records) == (4, 2, 2)
+    assert report.endpoints["droits_acces"].records == 4
+    assert report.endpoints["techniques"].errors == 0
+    assert report.endpoints["techniques"].bytes == 2 * len('{"pce": "GI000000"}')
+    assert (
+        report.endpoints["techniques"].wire_bytes
+        == report.endpoints["techniques"].bytes
+    )
+    summary = report.summary()
+    assert summary["total"]["requests"] == 8
+    assert summary["total"]["errors"] == 2
+    assert summary["endpoints"]["consos_publiees"]["error_rate"] == 0.5
+    assert summary["total"]["p50"] is not None
+    assert summary["total"]["bytes"] == sum(
+        stats.bytes for stats in report.endpoints.values()
+    )
+    lines = report.text().splitlines()
+    assert lines[0].startswith("8 requests in ")
+    assert [line.split()[0] for line in lines[1:]] == [
+        "endpoint",
+        "droits_acces",
+        "consos_publiees",
+        "techniques",
+        "total",
+    ]
+
+
+@responses.activate
+def test_bench_command() -> None:
+    add_stand_in_responses()
+    runner = CliRunner()
+    args = ["GI000000", "--from-date", "2021-01-01", "--to-date", "2021-02-01"]
+    args += ["--url", URL, "--rate-interval", "0", "--requests", "4"]
+    args += ["--client-id", "id", "--client-secret", "secret"]
+    result = runner.invoke(main.main, ["bench", *args, "--json"])
+    assert result.exit_code == 0, result.output
+    summary = json.loads(result.stdout)
+    assert summary["total"]["requests"] == 4
+    assert set(summary["endpoints"]) == {"consos_publiees", "droits_acces"}
+    result = runner.invoke(main.main, ["bench", *args])
+    assert result.exit_code == 0, result.output
+    assert "consos_publiees" in result.stdout
+    result = runner.invoke(main.main, ["bench", *args, "--mix", "unknown=1"])
+    assert result.exit_code == 2
+    assert "Invalid value for --mix" in result.output
@@ -20,9 +20,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import json
+
+import responses
 from click.testing import CliRunner
 
-from lowatt_grdf import main
+from lowatt_grdf import api, main
 
 
 def test_cli_base() -> None:
@@ -34,18 +37,41 @@ def test_cli_base() -> None:
         == """Usage: main [OPTIONS] COMMAND [ARGS]...
 
 Options:
-  -h, --help  Show this message and exit.
+  --format [json|ndjson|csv|parquet]
+                                  Output format, records are written as they are
+                                  produced  [default: json]
+  --output PATH                   Write output to PATH instead of stdout
+  --archive DIR                   Archive raw API responses in DIR
+  --replay                        Serve API responses from --archive instead of
+                                  requesting the API
+  --deadline SECONDS              Fail API requests lasting more than SECONDS,
+                                  hedges included
+  --hedge-percentile P            Send a duplicate of GET requests lasting more
+                                  than the P percentile of latencies, for at
+                                  most 5% of requests  [0<x<=100]
+  -h, --help                      Show this message and exit.
 
 Commands:
+  bench                        Load test the API, or a stand-in server or...
   declare-acces
   donnees-consos-informatives
   donnees-consos-publiees
   donnees-contractuelles
+  donnees-gaps                 Output missing or low quality periods of...
   donnees-injections-publiees
   donnees-techniques
   droits-acces
+  droits-acces-diff            Output new, changed and removed accesses...
   droits-acces-specifiques
+  enqueue                      Add PCE × window fetch jobs to a work queue
+  fetch                        Fetch series of many PCEs by windows and...
+  ingest                       Add stored consumption or injection records...
+  pce-snapshot                 Output all datasets of a PCE covered by its...
+  plan                         Output the number of requests of a fetch and...
+  query                        Output rows, or aggregated values, of a...
   revoke-acces
+  serve                        Poll PCEs when new data is expected and...
+  worker                       Process fetch jobs of a work queue and...
 """
     )
 
@@ -84,3 +110,28 @@ Options:
   -h, --help                      Show this message and exit.
 """
     )
+
+
+@responses.activate
+def test_cli_format() -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    responses.add(
+        responses.GET,
+        f"{api.API.api}/droits_acces",
+        body='{"id_pce": "GI000000", "pce": {"a": 1}}\n{"id_pce": "GI000001"}\n',
+    )
+    runner = CliRunner()
+    args = ["droits-acces", "--client-id", "id", "--client-secret", "secret"]
+    result = runner.invoke(main.main, ["--format", "ndjson", *args])
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        {"id_pce": "GI000000", "pce": {"a": 1}},
+        {"id_pce": "GI000001"},
+    ]
+    result = runner.invoke(main.main, ["--format", "csv", *args])
+    assert result.exit_code == 0, result.output
+    assert result.stdout.splitlines() == ["id_pce,pce.a", "GI000000,1", "GI000001,"]
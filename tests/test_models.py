@@ -1,5 +1,12 @@
+from typing import Any
+
+import cattrs
+import pytest
+
 from lowatt_grdf import models
 
+from .test_api import ACCESS_PAYLOAD
+
 
 def test_structure_access() -> None:
     obj = models.converter.structure(
@@ -72,3 +79,54 @@ def test_unstructure_declare_access() -> None:
         "raison_sociale": "COGIP",
         "role_tiers": "AUTORISE_CONTRAT_FOURNITURE",
     }
+
+
+def test_structure_accesses() -> None:
+    items: list[dict[str, Any]] = [
+        ACCESS_PAYLOAD,
+        dict(
+            ACCESS_PAYLOAD,
+            perim_donnees_publiees="Faux",
+            perim_donnees_techniques="Vrai",
+        ),
+        # handled by the converter
+        dict(ACCESS_PAYLOAD, perim_donnees_informatives="vrai"),
+        # converted by the converter, kept as is without validation
+        dict(ACCESS_PAYLOAD, id_pce=123, statut_controle_preuve=None),
+    ]
+    expected = [models.converter.structure(item, models.Access) for item in items]
+    assert models.structure_accesses(items) == expected
+    assert expected[3].pce == "123"
+    unchecked = models.structure_accesses(items, validate=False)
+    assert unchecked[:3] == expected[:3]
+    assert unchecked[3].pce == 123  # type: ignore[comparison-overlap]
+    assert models.structure_accesses([]) == []
+
+
+@pytest.mark.parametrize(
+    "item",
+    [
+        dict(ACCESS_PAYLOAD, role_tiers="UNKNOWN"),
+        dict(ACCESS_PAYLOAD, perim_donnees_publiees="Oui"),
+        dict(ACCESS_PAYLOAD, raison_sociale_du_titulaire=None),
+        {k: v for k, v in ACCESS_PAYLOAD.items() if k != "courriel_titulaire"},
+    ],
+)
+def test_structure_accesses_errors(item: dict[str, Any]) -> None:
+    with pytest.raises(cattrs.ClassValidationError) as expected:
+        models.converter.structure(item, models.Access)
+    with pytest.raises(cattrs.ClassValidationError) as raised:
+        models.structure_accesses([ACCESS_PAYLOAD, item])
+    assert repr(raised.value.exceptions) == repr(expected.value.exceptions)
+
+
+def test_validate_date_format() -> None:
+    with pytest.raises(ValueError, match="must be 'YYYY-MM-DD', got 2022-7-11"):
+        models.DeclareAccess(
+            pce="0123",
+            code_postal="42000",
+            courriel_titulaire="cogip@example.com",
+            date_debut_droit_acces="2022-7-11",
+            date_fin_droit_acces="2023-07-11",
+            raison_sociale="COGIP",
+        )
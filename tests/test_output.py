@@ -0,0 +1,165 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+import io
+import json
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from lowatt_grdf import output
+
+RECORDS: list[dict[str, Any]] = [
+    {"pce": {"id_pce": "GI000000"}, "energie": 8, "tags": ["a"]},
+    {"pce": {"id_pce": "GI000001"}, "energie": None, "tags": []},
+]
+
+
+def produce(produced: list[Any]) -> Iterator[dict[str, Any]]:
+    for record in RECORDS:
+        produced.append(record)
+        yield record
+
+
+def test_json(tmp_path: Path) -> None:
+    path = tmp_path / "out.json"
+    output.dump(iter(RECORDS), "json", str(path))
+    assert json.loads(path.read_text()) == RECORDS
+    output.dump([], "json", str(path))
+    assert json.loads(path.read_text()) == []
+    output.dump(RECORDS[0], "json", str(path))
+    assert json.loads(path.read_text()) == RECORDS[0]
+
+
+def test_ndjson_streaming(tmp_path: Path) -> None:
+    path = tmp_path / "out.ndjson"
+    produced: list[Any] = []
+    with output.open_writer("ndjson", str(path)) as writer:
+        for record in produce(produced):
+            writer.write(record)
+            writer.stream.flush()
+            assert len(path.read_text().splitlines()) == len(produced)
+    assert [json.loads(line) for line in path.read_text().splitlines()] == RECORDS
+
+
+def test_csv(tmp_path: Path) -> None:
+    path = tmp_path / "out.csv"
+    output.dump(RECORDS, "csv", str(path))
+    assert path.read_text().splitlines() == [
+        "pce.id_pce,energie,tags",
+        'GI000000,8,"[""a""]"',
+        "GI000001,,[]",
+    ]
+
+
+def test_parquet(tmp_path: Path) -> None:
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    with output.open_writer("parquet", str(path)) as writer:
+        assert isinstance(writer, output.ParquetWriter)
+        writer.row_group_size = 1
+        for record in RECORDS:
+            writer.write(record)
+    parquet = pq.ParquetFile(path)
+    assert parquet.num_row_groups == 2
+    assert parquet.read().to_pylist() == [output.flatten(r) for r in RECORDS]
+
+
+def test_csv_new_columns(tmp_path: Path) -> None:
+    path = tmp_path / "out.csv"
+    output.dump([{"a": 1}, {"a": 2, "b": "x"}, {"b": "y"}], "csv", str(path))
+    assert path.read_text().splitlines() == ["a,b", "1,", "2,x", ",y"]
+    with pytest.raises(ValueError, match=r"columns \['b'\]"):
+        stream = io.BytesIO()
+        stream.readable = lambda: False  # type: ignore[method-assign]
+        writer = output.CsvWriter(stream)
+        writer.write({"a": 1})
+        writer.write({"b": 2})
+
+
+class Pipe(io.BytesIO):
+    """Stream that can't be rewritten"""
+
+    def seekable(self) -> bool:
+        return False
+
+    def readable(self) -> bool:
+        return False
+
+
+def test_csv_pipe(monkeypatch: pytest.MonkeyPatch) -> None:
+    pipe = Pipe()
+    monkeypatch.setattr(sys, "stdout", io.TextIOWrapper(pipe))
+    output.dump(
+        [
+            {"pce": "a", "releve_debut": None},
+            {"pce": "b", "releve_debut": {"qualite_releve": "Mesure"}},
+        ],
+        "csv",
+    )
+    assert pipe.getvalue().decode().splitlines() == [
+        "pce,releve_debut,releve_debut.qualite_releve",
+        "a,,",
+        "b,,Mesure",
+    ]
+    # records written as produced can't have new columns
+    with pytest.raises(output.NotRewritable), output.open_writer("csv") as writer:
+        writer.write({"a": 1})
+        writer.write({"b": 2})
+
+
+@pytest.mark.parametrize(
+    "records, expected_type",
+    [
+        ([{"a": 1}, {"a": 1.5}], "double"),
+        ([{"a": None}, {"a": "x"}], "string"),
+        ([{"a": 1}, {"a": None, "b": [2]}], "int64"),
+    ],
+)
+def test_parquet_schema_widening(
+    tmp_path: Path, records: list[dict[str, Any]], expected_type: str
+) -> None:
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    with output.open_writer("parquet", str(path)) as writer:
+        assert isinstance(writer, output.ParquetWriter)
+        writer.row_group_size = 1
+        for record in records:
+            writer.write(record)
+    parquet = pq.ParquetFile(path)
+    assert parquet.num_row_groups == len(records)
+    assert str(parquet.schema_arrow.field("a").type) == expected_type
+    columns = parquet.schema_arrow.names
+    assert parquet.read().to_pylist() == [
+        {column: record.get(column) for column in columns} for record in records
+    ]
+
+
+def test_parquet_schema_incompatible(tmp_path: Path) -> None:
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "out.parquet"
+    with output.open_writer("parquet", str(path)) as writer:
+        assert isinstance(writer, output.ParquetWriter)
+        writer.row_group_size = 1
+        writer.write({"a": "x"})
+        with pytest.raises(ValueError, match="incompatible types"):
+            writer.write({"a": 1})
@@ -0,0 +1,123 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import json
+from pathlib import Path
+
+import responses
+from click.testing import CliRunner
+
+from lowatt_grdf import api, archive, main, planner, preflight, workqueue
+
+from .test_api import ACCESS_PAYLOAD
+from .test_preflight import access
+
+
+def periods(plan: planner.Plan) -> list[tuple[object, ...]]:
+    return [(r.pce, r.dataset, r.from_date, r.to_date) for r in plan.requests]
+
+
+def test_plan() -> None:
+    d = datetime.date
+    result = planner.plan(
+        ["GI000000", "GI000001", "GI000000"],
+        [("2021-01-01", "2021-06-01"), ("2021-05-01", "2021-08-01")]
+        + [("2021-08-01", "2021-09-01")],
+        ["consos_publiees", "contractuelles"],
+        window=100,
+        checker=preflight.Preflight([access()], today=d(2022, 1, 1)),
+        covered={("GI000000", "consos_publiees"): [(d(2021, 3, 1), d(2021, 4, 1))]},
+    )
+    assert periods(result) == [
+        ("GI000000", "consos_publiees", "2021-01-01", "2021-03-01"),
+        ("GI000000", "consos_publiees", "2021-04-01", "2021-07-10"),
+        ("GI000000", "consos_publiees", "2021-07-10", "2021-09-01"),
+        ("GI000000", "contractuelles", None, None),
+    ]
+    assert result.summary(interval=1, concurrency=4, latency=8) == {
+        "requests": 4,
+        "by_dataset": {"consos_publiees": 3, "contractuelles": 1},
+        "skipped": {"no access right": 2},
+        "cached": 0,
+        "estimated_seconds": 8,
+    }
+    assert result.estimate(interval=1, concurrency=4, latency=2) == 4
+
+
+def test_save_load(tmp_path: Path) -> None:
+    result = planner.plan(
+        ["GI000000", "GI000001"],
+        [("2021-01-01", "2021-06-01")],
+        ["consos_publiees"],
+        checker=preflight.Preflight([access()], today=datetime.date(2022, 1, 1)),
+    )
+    path = str(tmp_path / "plan.json")
+    result.save(path)
+    assert planner.Plan.load(path) == result
+
+
+def test_plan_cached(tmp_path: Path) -> None:
+    grdf = api.API("id", "secret", archive=archive.Archive(str(tmp_path)))
+    request = preflight.Request(
+        "GI000000", "consos_publiees", "2021-01-01", "2021-02-01"
+    )
+    assert grdf.archive is not None
+    grdf.archive.put(planner.request_key(grdf, request), b"{}")
+    result = planner.plan(
+        ["GI000000"], [("2021-01-01", "2021-03-01")], ["consos_publiees"], 31, grdf=grdf
+    )
+    assert result.cached == 1
+    assert periods(result) == [
+        ("GI000000", "consos_publiees", "2021-02-01", "2021-03-01")
+    ]
+
+
+@responses.activate
+def test_cli_plan(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    responses.add(responses.GET, f"{api.API.api}/droits_acces", json=ACCESS_PAYLOAD)
+    path = str(tmp_path / "plan.json")
+    runner = CliRunner()
+    result = runner.invoke(
+        main.main,
+        ["plan", "GI000000", "GI000001", "--period", "2024-01-01", "2025-01-01"]
+        + ["--dataset", "consos_publiees", "--dataset", "contractuelles"]
+        + ["--window", "100", "--preflight", str(tmp_path / "preflight")]
+        + ["--save", path, "--client-id", "id", "--client-secret", "secret"],
+    )
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.stdout) == {
+        "requests": 5,
+        "by_dataset": {"consos_publiees": 4, "contractuelles": 1},
+        "skipped": {"no access right": 2},
+        "cached": 0,
+        "estimated_seconds": 5,
+    }
+    queue = str(tmp_path / "queue.db")
+    result = runner.invoke(main.main, ["enqueue", "--queue", queue, "--plan", path])
+    assert result.exit_code == 0, result.output
+    assert workqueue.SQLiteQueue(queue).stats() == {"ready": 5}
+    result = runner.invoke(main.main, ["enqueue", "--queue", queue])
+    assert result.exit_code == 2
@@ -0,0 +1,132 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+import multiprocessing
+import time
+from pathlib import Path
+
+import ndjson
+import pytest
+import responses
+
+from lowatt_grdf import api, pool, ratelimit
+
+from .test_api import ACCESS_PAYLOAD
+
+
+def acquire_times(path: str, count: int, queue: "multiprocessing.Queue[float]") -> None:
+    limiter = ratelimit.FileRateLimiter(path, interval=0.05)
+    for _ in range(count):
+        limiter.acquire()
+        queue.put(time.time())
+
+
+def test_file_rate_limiter(tmp_path: Path) -> None:
+    path = str(tmp_path / "client.rate")
+    queue: multiprocessing.Queue[float] = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=acquire_times, args=(path, 5, queue))
+        for _ in range(3)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    times = sorted(queue.get() for _ in range(15))
+    intervals = [b - a for a, b in zip(times, times[1:])]
+    # allow for the delay between acquire() and time()
+    assert min(intervals) > 0.04
+
+
+def test_interval_limiter() -> None:
+    limiter = ratelimit.IntervalLimiter(interval=0.05)
+    start = time.time()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.time() - start >= 0.1
+    # without blocking, only once the interval elapsed
+    assert not limiter.acquire(block=False)
+    time.sleep(0.05)
+    assert limiter.acquire(block=False)
+
+
+def test_file_rate_limiter_no_block(tmp_path: Path) -> None:
+    path = str(tmp_path / "client.rate")
+    limiter = ratelimit.FileRateLimiter(path, interval=60)
+    assert limiter.acquire(block=False)
+    # shared with other limiters of the same file
+    assert not ratelimit.FileRateLimiter(path, interval=60).acquire(block=False)
+
+
+@responses.activate
+def test_client_pool(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    grdf = pool.ClientPool.from_credentials(
+        [("north", "id1", "secret1"), ("south", "id2", "secret2")],
+        lock_dir=str(tmp_path),
+        interval=0,
+    )
+    north = dict(ACCESS_PAYLOAD, id_pce="GI000001", etat_droit_acces="Révoquée")
+    south = dict(ACCESS_PAYLOAD, id_pce="GI000001")
+    url = f"{api.API.api}/droits_acces"
+    responses.add(responses.GET, url, body=ndjson.dumps([ACCESS_PAYLOAD, north]))
+    responses.add(responses.GET, url, body=ndjson.dumps([south]))
+    assert grdf.client_for("GI000000") is grdf.clients["north"]
+    assert grdf.client_for("GI000001") is grdf.clients["south"]
+    with pytest.raises(LookupError):
+        grdf.client_for("GI000002")
+    responses.add(
+        responses.GET,
+        f"{api.API.api}/pce/GI000001/donnees_contractuelles",
+        json={"pce": {"id_pce": "GI000001"}},
+    )
+    assert grdf.call("donnees_contractuelles", "GI000001") == {
+        "pce": {"id_pce": "GI000001"}
+    }
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["id1.rate", "id2.rate"]
+
+
+@responses.activate
+def test_client_pool_refresh() -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    grdf = pool.ClientPool.from_credentials(
+        [("north", "id1", "secret1"), ("south", "id2", "secret2")], interval=0
+    )
+    granted = dict(ACCESS_PAYLOAD, id_pce="GI000001")
+    url = f"{api.API.api}/droits_acces"
+    responses.add(responses.GET, url, body=ndjson.dumps([ACCESS_PAYLOAD]))
+    # a failing client doesn't prevent routing to others
+    responses.add(responses.GET, url, status=500)
+    assert grdf.client_for("GI000000") is grdf.clients["north"]
+    # PCE granted since, routes are refreshed at most once per interval
+    responses.add(responses.GET, url, body=ndjson.dumps([ACCESS_PAYLOAD]))
+    responses.add(responses.GET, url, body=ndjson.dumps([granted]))
+    with pytest.raises(LookupError):
+        grdf.client_for("GI000001")
+    grdf.refresh_interval = 0
+    assert grdf.client_for("GI000001") is grdf.clients["south"]
+    assert grdf.client_for("GI000000") is grdf.clients["north"]
@@ -0,0 +1,117 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+from pathlib import Path
+from typing import Any
+
+import requests
+import responses
+
+from lowatt_grdf import api, models, preflight
+
+from .test_api import ACCESS_PAYLOAD
+
+
+def access(**kwargs: Any) -> models.Access:
+    return models.converter.structure(dict(ACCESS_PAYLOAD, **kwargs), models.Access)
+
+
+def check(
+    checker: preflight.Preflight,
+    dataset: models.Dataset,
+    from_date: str = "2021-01-01",
+    to_date: str = "2022-01-01",
+    pce: str = "GI000000",
+) -> tuple[Any, ...]:
+    decision = checker.check(preflight.Request(pce, dataset, from_date, to_date))
+    if decision.skip is not None:
+        return (decision.skip,)
+    return (decision.request.from_date, decision.request.to_date)
+
+
+def test_check() -> None:
+    today = datetime.date(2024, 6, 1)
+    checker = preflight.Preflight(
+        [access(), access(id_pce="GI000001", etat_droit_acces="Révoquée")], today=today
+    )
+    assert check(checker, "consos_publiees") == ("2021-01-01", "2022-01-01")
+    assert check(checker, "consos_informatives", "2019-01-01", "2026-01-01") == (
+        "2020-01-01",
+        "2024-06-01",
+    )
+    assert check(checker, "consos_publiees", "2018-01-01", "2019-06-01") == (
+        "outside access perimeter dates",
+    )
+    assert check(checker, "injections_publiees") == ("not in access perimeter",)
+    assert check(checker, "consos_publiees", pce="GI000001") == (
+        "access right is Révoquée",
+    )
+    assert check(checker, "consos_publiees", pce="GI000002") == ("no access right",)
+    # perimeter ends on 2025-01-01, included
+    checker = preflight.Preflight([access()], today=datetime.date(2026, 6, 1))
+    assert check(checker, "consos_publiees", "2021-01-01", "2026-01-01") == (
+        "2021-06-01",
+        "2025-01-02",
+    )
+    assert check(checker, "consos_publiees", "2020-01-01", "2021-01-01") == (
+        "outside available history",
+    )
+    checker = preflight.Preflight([access()], today=datetime.date(2030, 6, 1))
+    assert check(checker, "contractuelles") == ("access right expired on 2030-01-01",)
+
+
+def test_negative_cache(tmp_path: Path) -> None:
+    path = str(tmp_path / "errors.json")
+    cache = preflight.NegativeCache(path, ttl=60)
+    checker = preflight.Preflight([access()], cache, today=datetime.date(2022, 1, 1))
+    resp = requests.Response()
+    resp.status_code = 500
+    assert not checker.record_error("GI000000", requests.HTTPError(response=resp))
+    resp.status_code = 404
+    assert checker.record_error(
+        "GI000000", requests.HTTPError("PCE inconnu", response=resp), now=1000
+    )
+    cache.save()
+    checker.cache = preflight.NegativeCache(path, ttl=60)
+    assert checker.check(
+        preflight.Request("GI000000", "contractuelles"), now=1059
+    ) == preflight.Decision(
+        preflight.Request("GI000000", "contractuelles"), "PCE inconnu"
+    )
+    decision = checker.check(preflight.Request("GI000000", "contractuelles"), now=1060)
+    assert decision.skip is None
+
+
+@responses.activate
+def test_load_accesses(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    responses.add(responses.GET, f"{api.API.api}/droits_acces", json=ACCESS_PAYLOAD)
+    grdf = api.API("id", "secret")
+    path = str(tmp_path / "droits_acces.json")
+    assert preflight.load_accesses(grdf, path) == [access()]
+    assert preflight.load_accesses(grdf, path) == [access()]
+    assert len(responses.calls) == 2
+    preflight.load_accesses(grdf, path, max_age=0)
+    assert len(responses.calls) == 3
@@ -0,0 +1,148 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+from click.testing import CliRunner
+
+from lowatt_grdf import main, rollup, store
+
+from .test_store import conso
+
+
+def test_month_days() -> None:
+    assert list(
+        rollup.month_days(datetime.date(2020, 12, 15), datetime.date(2021, 3, 2))
+    ) == [("2020-12", 17), ("2021-01", 31), ("2021-02", 28), ("2021-03", 1)]
+
+
+def test_rollups() -> None:
+    rollups = rollup.Rollups(portfolios={"GI000000": "north", "GI000001": "north"})
+    rollups.update(
+        [
+            # 17 days in January, 28 in February, 14 in March
+            conso("2021-01-15", "2021-03-15", 59, qualite="Estimé"),
+            conso("2021-01-01", "2021-02-01", 10, pce="GI000001"),
+        ]
+    )
+    assert rollups.months("GI000000") == ["2021-01", "2021-02", "2021-03"]
+    assert rollups.monthly("GI000000", "2021-02") == rollup.Bucket(28, days=28)
+    assert rollups.yearly("GI000000", "2021") == rollup.Bucket(59, days=59)
+    assert rollups.portfolio("north", "2021-01") == rollup.Bucket(27, days=48)
+    assert rollups.portfolio("north", "2021") == rollup.Bucket(69, days=90)
+    assert rollups.portfolio("south", "2021") == rollup.Bucket()
+    # added without superseding anything
+    rollups.add(conso("2021-03-15", "2021-04-01", 17))
+    assert rollups.yearly("GI000000", "2021").energie == 76
+    # measures supersede the estimate over February, and invalidate the months
+    # it covered, where its other parts are kept
+    change = rollups.add(conso("2021-02-01", "2021-03-01", 100))
+    assert change.accepted and len(change.superseded) == 1
+    assert rollups.monthly("GI000000", "2021-01") == rollup.Bucket(17, days=17)
+    assert rollups.monthly("GI000000", "2021-03") == rollup.Bucket(31, days=31)
+    assert rollups.yearly("GI000000", "2021") == rollup.Bucket(148, days=76)
+    assert rollups.portfolio("north", "2021") == rollup.Bucket(158, days=107)
+    # estimates don't supersede measures
+    assert not rollups.add(
+        conso("2021-02-01", "2021-03-01", 1, qualite="Estimé")
+    ).accepted
+    assert rollups.monthly("GI000000", "2021-02").energie == 100
+    # rollups of an existing index
+    rebuilt = rollup.Rollups(rollups.index)
+    assert rebuilt.yearly("GI000000", "2021") == rollup.Bucket(148, days=76)
+
+
+def test_store_rollups(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    runner = CliRunner()
+    db = str(tmp_path / "store")
+
+    def ingest(records: list[dict[str, Any]]) -> None:
+        path = tmp_path / "records.json"
+        path.write_text(json.dumps(records))
+        result = runner.invoke(main.main, ["ingest", "--store", db, str(path)])
+        assert result.exit_code == 0, result.output
+
+    ingest(
+        [
+            conso("2021-01-31", "2021-02-01", 1, qualite="Estimé"),
+            conso("2021-02-01", "2021-02-02", 2),
+        ]
+    )
+    with store.Store(db) as s:
+        rollups = rollup.StoreRollups(s, portfolios={"GI000000": "north"})
+        assert rollups.months("GI000000") == ["2021-01", "2021-02"]
+        assert rollups.portfolio("north", "2021") == rollup.Bucket(3, days=2)
+
+    # the second ingest updates saved aggregates, without reading the store
+    def rebuild(self: rollup.StoreRollups) -> None:
+        raise AssertionError("rebuilt")
+
+    monkeypatch.setattr(rollup.StoreRollups, "rebuild", rebuild)
+    ingest(
+        [
+            conso("2021-01-31", "2021-02-01", 4),
+            conso("2021-03-01", "2021-03-02", 8, pce="GI000001"),
+        ]
+    )
+    monkeypatch.undo()
+    with store.Store(db) as s:
+        saved = rollup.StoreRollups(s)
+        assert saved.monthly("GI000000", "2021-01") == rollup.Bucket(4, days=1)
+        assert saved.yearly("GI000000", "2021") == rollup.Bucket(6, days=2)
+        assert saved.monthly("GI000001", "2021-03") == rollup.Bucket(8, days=1)
+        # saved aggregates match those computed from the store
+        rebuilt = rollup.StoreRollups(s)
+        rebuilt.rebuild()
+        assert rebuilt._monthly == saved._monthly
+
+
+def test_store_rollups_supersede(tmp_path: Path) -> None:
+    runner = CliRunner()
+    db = str(tmp_path / "store")
+
+    def ingest(records: list[dict[str, Any]]) -> None:
+        path = tmp_path / "records.json"
+        path.write_text(json.dumps(records))
+        result = runner.invoke(main.main, ["ingest", "--store", db, str(path)])
+        assert result.exit_code == 0, result.output
+
+    ingest(
+        [
+            conso(f"2021-01-{day:02d}", f"2021-01-{day + 1:02d}", 10)
+            for day in range(1, 31)
+        ]
+        + [conso("2021-01-31", "2021-02-02", 20)]
+    )
+    # a monthly record supersedes daily ones, except the second half of the last
+    monthly = conso("2021-01-01", "2021-02-01", 300)
+    monthly["consommation"]["statut_conso"] = "Définitive"
+    ingest([monthly])
+    with store.Store(db) as s:
+        saved = rollup.StoreRollups(s, portfolios={"GI000000": "north"})
+        assert saved.monthly("GI000000", "2021-01") == rollup.Bucket(300, days=31)
+        assert saved.monthly("GI000000", "2021-02") == rollup.Bucket(10, days=1)
+        assert saved.portfolio("north", "2021") == rollup.Bucket(310, days=32)
+        rebuilt = rollup.StoreRollups(s)
+        rebuilt.rebuild()
+        assert rebuilt._monthly == saved._monthly
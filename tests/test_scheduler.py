@@ -0,0 +1,239 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+import datetime
+import json
+import sqlite3
+from pathlib import Path
+
+import pytest
+import requests
+import responses
+from click.testing import CliRunner
+
+from lowatt_grdf import api, main, scheduler, sink
+
+from .test_gaps import record
+
+# 2021-02-01T00:00:00Z
+NOW = 1612137600.0
+DAY = scheduler.DAY
+
+
+def test_frequency() -> None:
+    techniques = {
+        "donnees_techniques": {"caracteristiques_compteur": {"frequence": "6M"}}
+    }
+    assert scheduler.meter_frequency(techniques) == "6M"
+    assert scheduler.meter_frequency({}) is None
+    assert scheduler.infer_frequency([]) is None
+    assert scheduler.infer_frequency([record("2021-01-01", "2021-01-02")]) == "JJ"
+    assert scheduler.infer_frequency([record("2021-01-01", "2021-02-01")]) == "1M"
+
+
+def test_scheduler(tmp_path: Path) -> None:
+    path = str(tmp_path / "state.json")
+    sched = scheduler.Scheduler(path, max_requests_per_day=2)
+    sched.add("daily", "2021-01-01", "JJ", NOW)
+    sched.add("monthly", "2021-01-01", None, NOW)
+    sched.add("late", "2021-01-01", "JJ", NOW + DAY)
+    assert [entry.pce for entry in sched.due(NOW, "2021-02-01")] == ["daily", "monthly"]
+    daily, monthly = sched.entries["daily"], sched.entries["monthly"]
+    sched.consume(NOW, 2)
+    sched.done(daily, [record("2021-01-30", "2021-01-31")], NOW)
+    sched.done(monthly, [record("2021-01-01", "2021-02-01")], NOW)
+    assert monthly.frequency == "1M"
+    assert monthly.last_date == "2021-02-01"
+    # next month + publication delay
+    assert monthly.next_poll == NOW + 31 * DAY
+    assert daily.next_poll == NOW + DAY
+    assert sched.remaining(NOW) == 0
+    assert sched.due(NOW + DAY / 2, "2021-02-01") == []
+    sched.save()
+
+    sched = scheduler.Scheduler(path, max_requests_per_day=2)
+    assert sched.remaining(NOW + DAY) == 2
+    due = sched.due(NOW + DAY, "2021-02-02")
+    assert [entry.pce for entry in due] == ["daily", "late"]
+    sched.done(due[0], [], NOW + DAY)
+    assert due[0].next_poll == NOW + DAY + DAY / 4
+    sched.done(due[0], [], NOW + DAY)
+    assert due[0].next_poll == NOW + DAY + DAY / 2
+    # backoff is bounded by the period
+    sched.done(due[0], [], NOW + DAY)
+    sched.done(due[0], [], NOW + DAY)
+    assert due[0].misses == 4
+    assert due[0].next_poll == NOW + 2 * DAY
+
+
+def test_scheduler_budget(tmp_path: Path) -> None:
+    sched = scheduler.Scheduler(str(tmp_path / "state.json"), max_requests_per_day=1)
+    sched.add("current", "2021-02-01", "JJ", NOW)
+    sched.add("daily", "2021-01-01", "JJ", NOW)
+    sched.add("other", "2021-01-01", "JJ", NOW)
+    # polls of PCEs with current data don't count against the budget
+    assert [entry.pce for entry in sched.due(NOW, "2021-02-01")] == ["current", "daily"]
+    sched.consume(NOW)
+    assert sched.due(NOW, "2021-02-01") == []
+    # polls wait for the budget renewal
+    assert sched.wakeup(NOW) == NOW + DAY
+    assert sched.remaining(NOW + DAY) == 1
+    assert [entry.pce for entry in sched.due(NOW + DAY, "2021-02-02")] == ["other"]
+    assert sched.wakeup(NOW + DAY) is None
+
+
+@responses.activate
+def test_cli_serve(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    responses.add(
+        responses.GET,
+        f"{api.API.api}/pce/GI000000/donnees_techniques",
+        json={"donnees_techniques": {"caracteristiques_compteur": {"frequence": "JJ"}}},
+    )
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    responses.add(
+        responses.GET,
+        f"{api.API.api}/pce/GI000000/donnees_consos_publiees",
+        json=record(yesterday.isoformat(), datetime.date.today().isoformat()),
+    )
+    state = tmp_path / "state.json"
+    runner = CliRunner()
+    args = ["--format", "ndjson", "serve", "GI000000", "--state", str(state)]
+    args += ["--once", "--client-id", "id", "--client-secret", "secret"]
+    result = runner.invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    assert len(result.stdout.splitlines()) == 1
+    entry = json.loads(state.read_text())["entries"]["GI000000"]
+    assert entry["frequency"] == "JJ"
+    assert entry["last_date"] == datetime.date.today().isoformat()
+    # nothing is due anymore
+    result = runner.invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    assert result.stdout == ""
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_cli_serve_error(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    for id_pce in ("GI000000", "GI000001"):
+        responses.add(
+            responses.GET,
+            f"{api.API.api}/pce/{id_pce}/donnees_techniques",
+            body=requests.ConnectionError("connection reset"),
+        )
+        responses.add(
+            responses.GET,
+            f"{api.API.api}/pce/{id_pce}/donnees_consos_publiees",
+            body=requests.ConnectionError("connection reset"),
+        )
+    state = tmp_path / "state.json"
+    args = ["serve", "GI000000", "GI000001", "--state", str(state), "--once"]
+    args += ["--since", "2021-01-01", "--client-id", "id", "--client-secret", "x"]
+    result = CliRunner().invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    # failed polls are rescheduled, with a backoff
+    entries = json.loads(state.read_text())["entries"]
+    for id_pce in ("GI000000", "GI000001"):
+        assert entries[id_pce]["last_date"] == "2021-01-01"
+        assert entries[id_pce]["misses"] == 1
+        assert entries[id_pce]["next_poll"] > NOW
+
+
+@responses.activate
+def test_cli_serve_sink_position(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    responses.add(
+        responses.GET,
+        f"{api.API.api}/pce/GI000000/donnees_consos_publiees",
+        json=record(yesterday.isoformat(), datetime.date.today().isoformat()),
+    )
+    state = tmp_path / "state.json"
+    db = tmp_path / "records.db"
+    sched = scheduler.Scheduler(str(state))
+    sched.add("GI000000", yesterday.isoformat(), "JJ")
+    sched.save()
+    args = ["serve", "--state", str(state), "--once", "--sink", f"sqlite:{db}"]
+    args += ["--client-id", "id", "--client-secret", "secret"]
+    result = CliRunner().invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    assert json.loads(state.read_text())["sink_position"] == 1
+    # records written by a poll interrupted before the state was saved
+    with sink.SQLiteSink(str(db)) as out:
+        out.write(record(yesterday.isoformat(), datetime.date.today().isoformat()))
+    result = CliRunner().invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    assert sqlite3.connect(db).execute("SELECT COUNT(*) FROM records").fetchone() == (
+        1,
+    )
+
+
+@responses.activate
+def test_cli_serve_budget(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    for id_pce in ("GI000000", "GI000001"):
+        responses.add(
+            responses.GET,
+            f"{api.API.api}/pce/{id_pce}/donnees_consos_publiees",
+            json=record("2021-01-01", "2021-01-02", id_pce),
+        )
+    state = tmp_path / "state.json"
+    sched = scheduler.Scheduler(str(state))
+    sched.add("GI000000", "2021-01-01", "JJ")
+    sched.add("GI000001", "2021-01-01", "JJ")
+    sched.save()
+    delays: list[float] = []
+    saves: list[None] = []
+
+    def sleep(delay: float) -> None:
+        delays.append(delay)
+        if len(delays) == 3:
+            raise InterruptedError()
+
+    save = scheduler.Scheduler.save
+    monkeypatch.setattr("time.sleep", sleep)
+    monkeypatch.setattr(
+        scheduler.Scheduler, "save", lambda self: saves.append(save(self))
+    )
+    args = ["serve", "--state", str(state), "--max-requests-per-day", "1"]
+    args += ["--interval", str(2 * DAY)]
+    args += ["--client-id", "id", "--client-secret", "secret"]
+    result = CliRunner().invoke(main.main, args)
+    assert isinstance(result.exception, InterruptedError)
+    # a single poll, then waiting for the budget renewal without saving again
+    assert len(responses.calls) == 2
+    assert len(saves) == 2
+    assert all(1 < delay <= DAY for delay in delays)
@@ -0,0 +1,145 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import datetime
+from typing import Any
+
+from lowatt_grdf import gaps, series
+
+from .test_gaps import record
+
+
+def version(
+    start: str, end: str, statut: str = "Définitive", qualite: str = "Mesure"
+) -> dict[str, Any]:
+    result = record(start, end, qualite=qualite)
+    result["consommation"]["statut_conso"] = statut
+    return result
+
+
+def periods(items: list[series.Item]) -> list[tuple[str, str]]:
+    return [(item.start.isoformat(), item.end.isoformat()) for item in items]
+
+
+def test_supersede() -> None:
+    conso = series.ConsumptionSeries()
+    changes = conso.update(
+        [
+            version("2021-01-01", "2021-01-10", "Provisoire"),
+            version("2021-01-10", "2021-01-20", qualite="Estimé"),
+            version("2021-01-20", "2021-02-01"),
+        ],
+        published="2021-02-02",
+    )
+    assert all(change.accepted and not change.superseded for change in changes)
+    # definitive data replaces provisional data
+    change = conso.add(version("2021-01-01", "2021-01-05"), "2021-02-10")
+    assert change.accepted
+    assert periods(list(change.superseded)) == [("2021-01-01", "2021-01-10")]
+    assert periods(list(conso))[:2] == [
+        ("2021-01-01", "2021-01-05"),
+        ("2021-01-05", "2021-01-10"),
+    ]
+    # measures replace estimates, though published earlier
+    change = conso.add(version("2021-01-10", "2021-01-20"), "2021-01-01")
+    assert change.accepted and len(change.superseded) == 1
+    # provisional or estimated data never replaces definitive measures
+    assert not conso.add(version("2021-01-15", "2021-01-25", "Provisoire")).accepted
+    assert not conso.add(version("2021-01-15", "2021-01-25", qualite="Estimé")).accepted
+    # latest publication wins among equal versions
+    assert not conso.add(version("2021-01-19", "2021-01-21"), "2021-01-31").accepted
+    change = conso.add(version("2021-01-19", "2021-01-21"), "2021-02-02")
+    assert periods(list(change.superseded)) == [
+        ("2021-01-10", "2021-01-20"),
+        ("2021-01-20", "2021-02-01"),
+    ]
+    # parts of superseded records it doesn't cover are kept
+    assert periods(list(conso)) == [
+        ("2021-01-01", "2021-01-05"),
+        ("2021-01-05", "2021-01-10"),
+        ("2021-01-10", "2021-01-19"),
+        ("2021-01-19", "2021-01-21"),
+        ("2021-01-21", "2021-02-01"),
+    ]
+    assert len(conso.records()) == 5
+    assert not conso.add({"pce": {"id_pce": "GI000000"}}).accepted
+
+
+def test_split() -> None:
+    conso = series.ConsumptionSeries()
+    provisional = version("2021-01-01", "2021-02-01", "Provisoire")
+    conso.add(provisional)
+    definitive = version("2021-01-10", "2021-01-20")
+    change = conso.add(definitive)
+    assert change.accepted
+    assert periods(list(change.superseded)) == [("2021-01-01", "2021-02-01")]
+    # the provisional record is kept before and after the definitive one
+    assert periods(list(conso)) == [
+        ("2021-01-01", "2021-01-10"),
+        ("2021-01-10", "2021-01-20"),
+        ("2021-01-20", "2021-02-01"),
+    ]
+    assert [item.record for item in conso] == [provisional, definitive, provisional]
+    assert conso.records() == [provisional, definitive]
+    d = datetime.date
+    assert conso.covered() == [(d(2021, 1, 1), d(2021, 2, 1))]
+    # superseding its remaining parts
+    change = conso.add(version("2021-01-05", "2021-01-25"))
+    assert periods(list(change.superseded)) == [
+        ("2021-01-01", "2021-01-10"),
+        ("2021-01-10", "2021-01-20"),
+        ("2021-01-20", "2021-02-01"),
+    ]
+    assert periods(list(conso)) == [
+        ("2021-01-01", "2021-01-05"),
+        ("2021-01-05", "2021-01-25"),
+        ("2021-01-25", "2021-02-01"),
+    ]
+
+
+def test_range() -> None:
+    conso = series.ConsumptionSeries()
+    conso.update(
+        version(f"2021-01-{day:02}", f"2021-01-{day + 1:02}") for day in range(1, 31)
+    )
+    d = datetime.date
+    assert periods(conso.range(d(2021, 1, 10), d(2021, 1, 12))) == [
+        ("2021-01-10", "2021-01-11"),
+        ("2021-01-11", "2021-01-12"),
+    ]
+    assert conso.range(d(2021, 2, 1), d(2021, 3, 1)) == []
+    assert conso.covered() == [(d(2021, 1, 1), d(2021, 1, 31))]
+
+
+def test_index() -> None:
+    index = series.ConsumptionIndex()
+    index.update(
+        [
+            record("2021-01-01", "2021-01-10", pce="GI000001"),
+            record("2021-01-01", "2021-01-10"),
+            record("2021-01-01", "2021-01-10"),
+        ]
+    )
+    assert "GI000001" in index
+    assert len(index["GI000000"]) == 1
+    assert [gaps.record_pce(r) for r in index.records()] == [
+        "GI000000",
+        "GI000001",
+    ]
@@ -0,0 +1,234 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import gzip
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any
+
+import pyarrow.parquet as pq
+import pytest
+import responses
+from click.testing import CliRunner
+
+from lowatt_grdf import api, checkpoint, main, sink, workqueue
+
+from .test_gaps import record
+
+
+def test_sqlite_sink(tmp_path: Path) -> None:
+    path = str(tmp_path / "records.db")
+    acked: list[int] = []
+    with sink.open_sink(f"sqlite:{path}", batch_size=2, max_delay=60) as out:
+        out.extend(
+            [{"pce": {"id_pce": "GI000000"}, "energie": 1}], lambda: acked.append(1)
+        )
+        assert acked == []
+        # flushed by batch size, with the whole unit of work
+        out.extend(
+            [
+                {"pce": {"id_pce": "GI000000"}, "energie": 2, "tags": ["a"]},
+                {"pce": {"id_pce": "GI000001"}},
+            ],
+            lambda: acked.append(2),
+        )
+        assert acked == [1, 2]
+    db = sqlite3.connect(path)
+    query = 'SELECT _rowid, "pce.id_pce", energie, tags FROM records'
+    assert list(db.execute(query)) == [
+        (1, "GI000000", 1, None),
+        (2, "GI000000", 2, '["a"]'),
+        (3, "GI000001", None, None),
+    ]
+    # columns are found again when reopened
+    with sink.SQLiteSink(path) as out:
+        assert out.columns == ["pce.id_pce", "energie", "tags"]
+        out.write({"energie": 3})
+        out.flush()
+        assert out.position() == 4
+        out.truncate(1)
+    assert db.execute("SELECT COUNT(*) FROM records").fetchone() == (1,)
+
+
+def test_ndjson_gz_sink(tmp_path: Path) -> None:
+    with sink.NdjsonGzSink(str(tmp_path), max_bytes=1, batch_size=2) as out:
+        for i in range(5):
+            out.write({"i": i})
+        # flushed once max_delay has elapsed
+        out.max_delay = 0
+        out.extend([])
+        out.write({"i": 5})
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "000001.ndjson.gz",
+        "000002.ndjson.gz",
+        "000003.ndjson.gz",
+        "000004.ndjson.gz",
+    ]
+
+    def read() -> list[Any]:
+        records: list[Any] = []
+        for path in sorted(tmp_path.iterdir()):
+            with gzip.open(path) as f:
+                records.extend(json.loads(line) for line in f)
+        return records
+
+    assert read() == [{"i": i} for i in range(6)]
+    # files are appended to when reopened
+    with sink.NdjsonGzSink(str(tmp_path), batch_size=2) as out:
+        out.write({"i": 6})
+        assert out.number == 4
+    assert read() == [{"i": i} for i in range(7)]
+    # records written after a position are removed
+    with sink.NdjsonGzSink(str(tmp_path), batch_size=2) as out:
+        position = out.position()
+        out.write({"i": 7})
+        out.write({"i": 8})
+        out.truncate(position)
+    assert read() == [{"i": i} for i in range(7)]
+
+
+def test_sink_poll(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    now = [0.0]
+    monkeypatch.setattr("time.monotonic", lambda: now[0])
+    path = tmp_path / "records.ndjson"
+    acked: list[int] = []
+    with sink.open_sink(f"ndjson:{path}", max_delay=5) as out:
+        out.extend([{"i": 0}], lambda: acked.append(0))
+        out.poll()
+        assert acked == []
+        # records are held until polled, when no record is added
+        now[0] = 5
+        assert path.read_text() == ""
+        out.poll()
+        assert acked == [0]
+        assert path.read_text() == '{"i":0}\n'
+        now[0] = 10
+        out.extend([{"i": 1}])
+        assert path.read_text().count("\n") == 2
+
+
+def test_writer_sink(tmp_path: Path) -> None:
+    path = str(tmp_path / "records.parquet")
+    with sink.open_sink(f"parquet:{path}", batch_size=3) as out:
+        for i in range(7):
+            # integers then floats, quality unknown in the first batch
+            energie = i if i < 3 else i + 0.5
+            quality = None if i < 3 else "Définitive"
+            out.write({"pce": "GI000000", "energie": energie, "qualite": quality})
+    parquet = pq.ParquetFile(path)
+    assert [parquet.metadata.row_group(i).num_rows for i in range(3)] == [3, 3, 1]
+    table = parquet.read()
+    assert table.column("energie").to_pylist() == [0, 1, 2, 3.5, 4.5, 5.5, 6.5]
+    assert table.column("qualite").to_pylist() == [None] * 3 + ["Définitive"] * 4
+    path = str(tmp_path / "records.csv")
+    with sink.open_sink(f"csv:{path}") as out:
+        out.write({"pce": {"id_pce": "GI000000"}, "energie": 1})
+    assert Path(path).read_text().splitlines() == ["pce.id_pce,energie", "GI000000,1"]
+    with pytest.raises(ValueError, match="Invalid sink 'xml:out.xml'"):
+        sink.open_sink("xml:out.xml")
+
+
+@responses.activate
+def test_cli_worker_sink(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    url = f"{api.API.api}/pce/GI000000/donnees_consos_publiees"
+    responses.add(responses.GET, url, json=record("2021-01-01", "2021-01-02"))
+    queue = str(tmp_path / "queue.db")
+    workqueue.SQLiteQueue(queue).put(
+        [
+            {"pce": "GI000000", "dataset": "consos_publiees"}
+            | {"from_date": f"2021-01-0{day}", "to_date": f"2021-01-0{day + 1}"}
+            for day in (1, 2)
+        ]
+    )
+    db = str(tmp_path / "records.db")
+    runner = CliRunner()
+    result = runner.invoke(
+        main.main,
+        ["worker", "--queue", queue, "--sink", f"sqlite:{db}"]
+        + ["--client-id", "id", "--client-secret", "secret"],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.stdout == ""
+    assert workqueue.SQLiteQueue(queue).stats() == {"done": 2}
+    rows = sqlite3.connect(db).execute('SELECT "pce.id_pce" FROM records')
+    assert list(rows) == [("GI000000",), ("GI000000",)]
+    result = runner.invoke(
+        main.main,
+        ["worker", "--queue", queue, "--sink", "sqlite"]
+        + ["--client-id", "id", "--client-secret", "secret"],
+    )
+    assert result.exit_code == 2
+    assert "Invalid value for --sink" in result.output
+
+
+@responses.activate
+def test_cli_worker_checkpoint(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    url = f"{api.API.api}/pce/GI000000/donnees_consos_publiees"
+    responses.add(responses.GET, url, json=record("2021-01-02", "2021-01-03"))
+    queue_path = str(tmp_path / "queue.db")
+    # leases expire at once, as if the worker had been killed
+    queue = workqueue.SQLiteQueue(queue_path, visibility_timeout=0)
+    queue.put(
+        [
+            {"pce": "GI000000", "dataset": "consos_publiees"}
+            | {"from_date": f"2021-01-0{day}", "to_date": f"2021-01-0{day + 1}"}
+            for day in (1, 2)
+        ]
+    )
+    db = str(tmp_path / "records.db")
+    journal_path = str(tmp_path / "journal")
+    journal = checkpoint.Checkpoint(journal_path)
+    with sink.SQLiteSink(db) as out:
+        # the first job was recorded before being acknowledged
+        first = queue.lease()
+        assert first is not None
+        out.write(record("2021-01-01", "2021-01-02"))
+        out.flush()
+        journal.mark((first.id,))
+        journal.save(out.position())
+        # records of the second job were written before being recorded
+        assert queue.lease() is not None
+        out.write(record("2021-01-02", "2021-01-03"))
+    result = CliRunner().invoke(
+        main.main,
+        ["worker", "--queue", queue_path, "--sink", f"sqlite:{db}"]
+        + ["--checkpoint", journal_path]
+        + ["--client-id", "id", "--client-secret", "secret"],
+    )
+    assert result.exit_code == 0, result.output
+    assert workqueue.SQLiteQueue(queue_path).stats() == {"done": 2}
+    # only the second job is fetched again, and its records written once
+    assert [str(call.request.url).split("?")[0] for call in responses.calls[1:]] == [
+        url
+    ]
+    column = '"consommation.date_debut_consommation"'
+    rows = sqlite3.connect(db).execute(f"SELECT substr({column}, 1, 10) FROM records")
+    assert list(rows) == [("2021-01-01",), ("2021-01-02",)]
@@ -0,0 +1,112 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+import json
+from pathlib import Path
+from typing import Any
+
+import ndjson
+import pytest
+import responses
+from click.testing import CliRunner
+
+from lowatt_grdf import api, main, snapshot
+
+from .test_api import ACCESS_PAYLOAD
+
+STATUS = {
+    "code_statut_traitement": "0000000000",
+    "message_retour_traitement": "L'opération s'est déroulée avec succès.",
+}
+
+
+def test_access_snapshot(tmp_path: Path) -> None:
+    path = str(tmp_path / "snapshot.json")
+    other = dict(ACCESS_PAYLOAD, id_droit_acces="other", id_pce="GI000001")
+    store = snapshot.AccessSnapshot(path)
+    events = store.update([ACCESS_PAYLOAD, other])
+    assert [(e["event"], e["id_droit_acces"]) for e in events] == [
+        ("new", ACCESS_PAYLOAD["id_droit_acces"]),
+        ("new", "other"),
+    ]
+    assert events[0]["access"] == ACCESS_PAYLOAD
+
+    store = snapshot.AccessSnapshot(path)
+    assert store.update([ACCESS_PAYLOAD, other]) == []
+    revoked = dict(ACCESS_PAYLOAD, etat_droit_acces="Révoquée")
+    assert store.diff([revoked]) == [
+        {
+            "event": "changed",
+            "id_droit_acces": ACCESS_PAYLOAD["id_droit_acces"],
+            "state": {
+                "id_pce": "GI000000",
+                "etat_droit_acces": "Révoquée",
+                "statut_controle_preuve": None,
+            },
+            "changes": {"etat_droit_acces": {"old": "Active", "new": "Révoquée"}},
+        },
+        {
+            "event": "removed",
+            "id_droit_acces": "other",
+            "state": {
+                "id_pce": "GI000001",
+                "etat_droit_acces": "Active",
+                "statut_controle_preuve": None,
+            },
+        },
+    ]
+    # diff doesn't alter the snapshot
+    assert len(store.diff([revoked])) == 2
+
+    # events that couldn't be written are reported again
+    def emit(events: list[dict[str, Any]]) -> None:
+        raise BrokenPipeError()
+
+    with pytest.raises(BrokenPipeError):
+        store.update([revoked], emit)
+    store = snapshot.AccessSnapshot(path)
+    emitted: list[dict[str, Any]] = []
+    assert store.update([revoked], emitted.extend) == emitted
+    assert len(emitted) == 2
+    assert store.diff([revoked]) == []
+
+
+@responses.activate
+def test_cli_droits_acces_diff(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    url = f"{api.API.api}/droits_acces"
+    responses.add(responses.GET, url, body=ndjson.dumps([ACCESS_PAYLOAD, STATUS]))
+    preuve = dict(ACCESS_PAYLOAD, statut_controle_preuve="Preuve Vérifiée KO")
+    responses.add(responses.GET, url, body=ndjson.dumps([preuve, STATUS]))
+    runner = CliRunner()
+    args = ["droits-acces-diff", "--snapshot", str(tmp_path / "snapshot.json")]
+    args += ["--client-id", "id", "--client-secret", "secret"]
+    result = runner.invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line)["event"] for line in result.stdout.splitlines()] == ["new"]
+    result = runner.invoke(main.main, args)
+    assert result.exit_code == 0, result.output
+    (event,) = (json.loads(line) for line in result.stdout.splitlines())
+    assert event["changes"] == {
+        "statut_controle_preuve": {"old": None, "new": "Preuve Vérifiée KO"}
+    }
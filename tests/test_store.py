@@ -0,0 +1,172 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import math
+from pathlib import Path
+from typing import Any
+
+from click.testing import CliRunner
+
+from lowatt_grdf import columnar, dates, main, store
+
+from .test_gaps import record
+
+
+def conso(
+    start: str, end: str, energie: float, pce: str = "GI000000", **kwargs: Any
+) -> dict[str, Any]:
+    result = record(start, end, pce, **kwargs)
+    result["consommation"]["energie"] = energie
+    result["releve_fin"]["index_brut_fin"] = {"valeur_index": energie * 10}
+    return result
+
+
+RECORDS = [
+    conso("2021-01-30", "2021-01-31", 1),
+    conso("2021-01-31", "2021-02-01", 2),
+    conso("2021-02-01", "2021-02-02", 4),
+    conso("2021-01-31", "2021-02-01", 8, pce="GI000001"),
+]
+
+
+def test_store(tmp_path: Path) -> None:
+    with store.Store(str(tmp_path)) as db:
+        assert len(db) == 0
+        assert db.aggregate(["energie"]) == []
+        db.append(columnar.to_columns(RECORDS[2:]))
+        db.append(columnar.to_columns(RECORDS[:2]))
+        assert db.pces() == ["GI000000", "GI000001"]
+    with store.Store(str(tmp_path)) as db:
+        assert len(db) == 4
+        assert list(db.column("energie")) == [1, 2, 4, 8]
+        start = dates.date_timestamp("2021-01-31")
+        end = dates.date_timestamp("2021-02-01")
+        assert db.select(["GI000000"], start, end, ["pce", "energie"]) == {
+            "pce": ["GI000000"],
+            "energie": [2],
+        }
+        assert db.aggregate(["energie"], "sum", ["pce", "month"]) == [
+            {"pce": "GI000000", "month": "2021-01", "energie": 3},
+            {"pce": "GI000000", "month": "2021-02", "energie": 4},
+            {"pce": "GI000001", "month": "2021-01", "energie": 8},
+        ]
+        assert db.aggregate(["index_fin"], "last") == [
+            {"pce": "GI000000", "index_fin": 40},
+            {"pce": "GI000001", "index_fin": 80},
+        ]
+        assert db.aggregate(["energie"], "count", ["year"], start=start) == [
+            {"year": "2021", "energie": 3}
+        ]
+        # estimates don't replace measures, measures replace estimates
+        db.append(
+            columnar.to_columns(
+                [
+                    conso("2021-01-31", "2021-02-01", 16, qualite="Estimé"),
+                    conso("2021-01-31", "2021-02-01", 32, pce="GI000002"),
+                ]
+            )
+        )
+        assert list(db.column("energie")) == [1, 2, 4, 8, 32]
+        db.append(columnar.to_columns([conso("2021-01-30", "2021-01-31", 64)]))
+        assert list(db.column("energie")) == [64, 2, 4, 8, 32]
+    # each update wrote its rows to a new segment
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["1", "2", "3", "4", "CURRENT"]
+    assert (tmp_path / "4" / "energie.bin").stat().st_size == 8
+
+
+def test_store_compact(tmp_path: Path) -> None:
+    with store.Store(str(tmp_path), max_segments=2) as db:
+        db.append(columnar.to_columns(RECORDS[:2]))
+        first = (tmp_path / "1" / "energie.bin").stat()
+        db.append(columnar.to_columns(RECORDS[2:]))
+        # segments are never modified
+        assert (tmp_path / "1" / "energie.bin").stat() == first
+        assert [segment.name for segment in db.segments] == ["1", "2"]
+        db.append(columnar.to_columns([conso("2021-01-30", "2021-01-31", 16)]))
+        # merged in a new segment, merged ones being kept for readers
+        assert [segment.name for segment in db.segments] == ["4"]
+        assert db.obsolete == ["1", "2", "3"]
+        with store.Store(str(tmp_path)) as reader:
+            assert reader.column("energie") == [16, 2, 4, 8]
+            db.append(columnar.to_columns([conso("2021-02-02", "2021-02-03", 32)]))
+            assert reader.column("energie") == [16, 2, 4, 8]
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["4", "5", "CURRENT"]
+        assert len(db) == 5
+        assert db.column("energie") == [16, 2, 4, 32, 8]
+
+
+def test_store_supersede(tmp_path: Path) -> None:
+    january = [
+        conso(f"2021-01-{day:02d}", f"2021-01-{day + 1:02d}", 10)
+        for day in range(1, 31)
+    ]
+    with store.Store(str(tmp_path)) as db:
+        db.append(columnar.to_columns(january))
+        db.append(columnar.to_columns([conso("2021-01-31", "2021-02-02", 20)]))
+        assert len(db) == 31
+        # a monthly record supersedes daily ones it overlaps, keeping the part
+        # of the last one it doesn't cover
+        monthly = conso("2021-01-01", "2021-02-01", 300)
+        monthly["consommation"]["statut_conso"] = "Définitive"
+        changes = db.append(columnar.to_columns([monthly]))
+        ((pce, removed, added),) = changes
+        assert pce == "GI000000" and len(removed) == 31
+        assert [row[4] for row in added] == [300, 10]
+        assert len(db) == 2
+        assert db.column("energie") == [300, 10]
+        assert db.aggregate(["energie"], "sum", ["month"]) == [
+            {"month": "2021-01", "energie": 300},
+            {"month": "2021-02", "energie": 10},
+        ]
+        start = dates.date_timestamp("2021-01-15")
+        assert db.select(start=start, columns=["energie"]) == {"energie": [10]}
+        # provisional data doesn't supersede definitive data
+        assert db.append(columnar.to_columns(january[:1])) == []
+        # the part of the superseded record has no start index
+        (index_debut,) = db.select(start=start, columns=["index_debut"]).values()
+        assert math.isnan(index_debut[0])
+    with store.Store(str(tmp_path)) as db:
+        assert db.column("energie") == [300, 10]
+        db.compact()
+        assert db.column("energie") == [300, 10]
+
+
+def test_cli_query(tmp_path: Path) -> None:
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps(RECORDS))
+    runner = CliRunner()
+    db = str(tmp_path / "store")
+    result = runner.invoke(main.main, ["ingest", "--store", db, str(path)])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        main.main,
+        ["query", "--store", db, "--pce", "GI000000", "--from-date", "2021-02-01"],
+    )
+    assert result.exit_code == 0, result.output
+    (row,) = json.loads(result.stdout)
+    assert row["energie"] == 4 and row["pce"] == "GI000000"
+    result = runner.invoke(
+        main.main,
+        ["--format", "csv", "query", "--store", db, "--aggregate", "sum"]
+        + ["--by", "month", "--column", "energie", "--to-date", "2021-02-01"],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.stdout.splitlines() == ["month,energie", "2021-01,11.0"]
@@ -0,0 +1,106 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import re
+from typing import Any
+
+import ndjson
+import pytest
+import requests
+import responses
+
+from lowatt_grdf import api, columnar, ratelimit, stream
+
+from .test_gaps import record
+
+
+def series_callback(
+    calls: list[tuple[str, str, str]],
+) -> Any:
+    def callback(request: requests.PreparedRequest) -> tuple[int, dict[str, str], str]:
+        assert request.url is not None
+        pce = request.url.split("/")[-2]
+        params = request.params  # type: ignore[attr-defined]
+        calls.append((pce, params["date_debut"], params["date_fin"]))
+        if pce == "GI999999":
+            return (403, {}, "{}")
+        body = ndjson.dumps([record(params["date_debut"], params["date_fin"], pce)])
+        return (200, {}, body)
+
+    return callback
+
+
+@pytest.fixture
+def grdf() -> api.API:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    return api.API("id", "secret", rate_limiter=ratelimit.IntervalLimiter(0))
+
+
+@responses.activate
+def test_iter_consumption(grdf: api.API) -> None:
+    calls: list[tuple[str, str, str]] = []
+    responses.add_callback(
+        responses.GET,
+        re.compile(rf"{grdf.api}/pce/\w+/donnees_consos_publiees"),
+        series_callback(calls),
+    )
+    records = stream.iter_consumption(
+        grdf, ["GI000000", "GI000001"], "2021-01-01", "2021-03-01", window=31
+    )
+    assert [
+        (r["pce"]["id_pce"], r["consommation"]["date_debut_consommation"][:10])
+        for r in records
+    ] == [
+        ("GI000000", "2021-01-01"),
+        ("GI000000", "2021-02-01"),
+        ("GI000001", "2021-01-01"),
+        ("GI000001", "2021-02-01"),
+    ]
+    assert sorted(calls) == [
+        ("GI000000", "2021-01-01", "2021-02-01"),
+        ("GI000000", "2021-02-01", "2021-03-01"),
+        ("GI000001", "2021-01-01", "2021-02-01"),
+        ("GI000001", "2021-02-01", "2021-03-01"),
+    ]
+    # fetching stops when the consumer does
+    calls.clear()
+    pces = [f"GI{i:06d}" for i in range(100)]
+    records = stream.iter_consumption(
+        grdf, pces, "2021-01-01", "2021-01-02", prefetch=2
+    )
+    next(records)
+    records.close()
+    assert len(calls) <= 2
+    # transformed responses
+    (columns,) = stream.iter_consumption(
+        grdf, ["GI000000"], "2021-01-01", "2021-01-02", transform=columnar.to_columns
+    )
+    assert columns["pce"] == ["GI000000"]
+    # errors are raised in order
+    records = stream.iter_consumption(
+        grdf, ["GI000000", "GI999999"], "2021-01-01", "2021-01-02"
+    )
+    assert next(records)["pce"]["id_pce"] == "GI000000"
+    with pytest.raises(requests.HTTPError):
+        next(records)
@@ -0,0 +1,204 @@
+# Copyright (c) 2021 Lowatt <info@lowatt.fr>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+import contextlib
+import json
+from collections.abc import Iterator
+from pathlib import Path
+from typing import IO, Optional
+
+import pytest
+import responses
+from click.testing import CliRunner
+
+from lowatt_grdf import api, codec, main, output, workqueue
+
+from .test_api import ACCESS_PAYLOAD
+from .test_gaps import record
+from .test_output import Pipe
+
+
+def test_lease_ack(tmp_path: Path) -> None:
+    path = str(tmp_path / "queue.db")
+    queue = workqueue.SQLiteQueue(path)
+    assert queue.put([{"pce": "GI000000"}, {"pce": "GI000001"}]) == 2
+    assert queue.put([{"pce": "GI000000"}]) == 0
+    # another worker
+    other = workqueue.SQLiteQueue(path)
+    first, second = queue.lease(), other.lease()
+    assert first is not None and second is not None
+    assert (first.payload, second.payload) == ({"pce": "GI000000"}, {"pce": "GI000001"})
+    assert queue.lease() is None
+    assert queue.ack(first)
+    assert queue.stats() == {"done": 1, "leased": 1}
+
+
+@pytest.mark.parametrize("backend", [b for b in codec.available() if b != "json"])
+def test_put_backends(tmp_path: Path, backend: str) -> None:
+    # nodes with different JSON backends installed share the queue
+    queue = workqueue.SQLiteQueue(str(tmp_path / "queue.db"))
+    payload = {"pce": "GI000000", "from_date": "2021-01-01", "to_date": "2021-01-15"}
+    previous = codec.backend
+    try:
+        codec.use(backend)
+        assert queue.put([payload]) == 1
+        codec.use("json")
+        assert queue.put([dict(reversed(payload.items()))]) == 0
+    finally:
+        codec.use(previous)
+    assert queue.stats() == {"ready": 1}
+
+
+def test_visibility_timeout(tmp_path: Path) -> None:
+    queue = workqueue.SQLiteQueue(
+        str(tmp_path / "queue.db"), visibility_timeout=-1, max_attempts=2
+    )
+    queue.put([{"pce": "GI000000"}])
+    stale = queue.lease()
+    assert stale is not None
+    job = queue.lease()
+    assert job is not None and job.attempts == 2
+    # lease was taken over
+    assert not queue.ack(stale)
+    assert queue.lease() is None
+    assert [j.error for j in queue.dead_letters()] == ["visibility timeout"]
+
+
+def test_nack(tmp_path: Path) -> None:
+    queue = workqueue.SQLiteQueue(str(tmp_path / "queue.db"), max_attempts=2)
+    queue.put([{"pce": "GI000000"}])
+    for _ in range(2):
+        job = queue.lease()
+        assert job is not None
+        queue.nack(job, "400 Client Error")
+    assert queue.lease() is None
+    (dead,) = queue.dead_letters()
+    assert (dead.payload, dead.attempts, dead.error) == (
+        {"pce": "GI000000"},
+        2,
+        "400 Client Error",
+    )
+
+
+@responses.activate
+def test_cli_worker(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    url = f"{api.API.api}/pce/GI000000/donnees_consos_publiees"
+    responses.add(responses.GET, url, json=record("2021-01-01", "2021-01-02"))
+    responses.add(responses.GET, url, status=500)
+    queue = str(tmp_path / "queue.db")
+    runner = CliRunner()
+    result = runner.invoke(
+        main.main,
+        ["enqueue", "GI000000", "--queue", queue, "--window", "10"]
+        + ["--from-date", "2021-01-01", "--to-date", "2021-01-15"],
+    )
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        main.main,
+        ["--format", "ndjson", "worker", "--queue", queue, "--max-attempts", "1"]
+        + ["--client-id", "id", "--client-secret", "secret"],
+    )
+    assert result.exit_code == 0, result.output
+    assert [json.loads(line) for line in result.stdout.splitlines()] == [
+        record("2021-01-01", "2021-01-02")
+    ]
+    (dead,) = workqueue.SQLiteQueue(queue).dead_letters()
+    assert dead.payload == {
+        "pce": "GI000000",
+        "dataset": "consos_publiees",
+        "from_date": "2021-01-11",
+        "to_date": "2021-01-15",
+    }
+
+
+@responses.activate
+def test_cli_worker_pipe(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    url = f"{api.API.api}/pce/GI000000/donnees_consos_publiees"
+    first, second = (
+        record("2021-01-01", "2021-01-02"),
+        record("2021-01-11", "2021-01-12"),
+    )
+    first["releve_debut"] = None
+    responses.add(responses.GET, url, json=first)
+    responses.add(responses.GET, url, json=second)
+    pipe = Pipe()
+
+    @contextlib.contextmanager
+    def open_stream(path: Optional[str] = None) -> Iterator[IO[bytes]]:
+        yield pipe
+
+    monkeypatch.setattr(output, "open_stream", open_stream)
+    queue = str(tmp_path / "queue.db")
+    runner = CliRunner()
+    result = runner.invoke(
+        main.main,
+        ["enqueue", "GI000000", "--queue", queue, "--window", "10"]
+        + ["--from-date", "2021-01-01", "--to-date", "2021-01-15"],
+    )
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        main.main,
+        ["--format", "csv", "worker", "--queue", queue]
+        + ["--client-id", "id", "--client-secret", "secret"],
+    )
+    # columns of the second record can't be added to rows written to the pipe
+    assert result.exit_code == 2
+    assert "write to a file with --output" in result.output
+    assert pipe.getvalue().decode().splitlines()[1].startswith("GI000000,")
+
+
+@responses.activate
+def test_cli_worker_preflight(tmp_path: Path) -> None:
+    responses.add(
+        responses.POST,
+        api.NEW_AUTH_ENDPOINT,
+        json={"access_token": "xxx", "expires_in": 14400},
+    )
+    responses.add(responses.GET, f"{api.API.api}/droits_acces", json=ACCESS_PAYLOAD)
+    queue = str(tmp_path / "queue.db")
+    workqueue.SQLiteQueue(queue).put(
+        [
+            {
+                "pce": "GI000001",
+                "dataset": "consos_publiees",
+                "from_date": "2021-01-01",
+                "to_date": "2021-01-15",
+            }
+        ]
+    )
+    result = CliRunner().invoke(
+        main.main,
+        ["worker", "--queue", queue, "--preflight", str(tmp_path / "preflight")]
+        + ["--client-id", "id", "--client-secret", "secret"],
+    )
+    assert result.exit_code == 0, result.output
+    # only droits_acces was requested
+    assert len(responses.calls) == 2
+    assert workqueue.SQLiteQueue(queue).stats() == {"done": 1}
+    assert (tmp_path / "preflight" / "droits_acces.json").exists()